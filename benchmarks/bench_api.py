@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+端到端 API 基准：进程内 ASGI 客户端（httpx.ASGITransport，不经过网络栈）并发压测
+应用指向临时目录中的合成语料库，不会触碰仓库里的 docs/ 和 .insightpipe/
+用法: python benchmarks/bench_api.py --docs 1000 --concurrency 16 --requests 2000
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from benchmarks.harness import summarize
+from benchmarks.synthetic import make_corpus
+
+
+def _scenarios(filenames):
+    """场景名 -> 生成第 i 个请求的函数 (method, url, kwargs)"""
+    def list_page(i):
+        return "GET", "/api/docs", {"params": {"limit": 50, "offset": (i * 50) % len(filenames)}}
+
+    def read_doc(i):
+        return "GET", f"/api/docs/{filenames[i % len(filenames)]}", {}
+
+    def read_raw(i):
+        return "GET", f"/api/docs/{filenames[i % len(filenames)]}/raw", {}
+
+    def search(i):
+        return "GET", "/api/search", {"params": {"q": ("缓存", "索引", "并发", "向量")[i % 4], "limit": 20}}
+
+    def save(i):
+        # 在少量文档上反复覆盖，包含版本历史、索引和变更推送的完整保存路径
+        return "POST", "/api/docs/save", {"json": {
+            "title": f"bench save {i % 8}", "content": f"保存基准 {i}\n\n" + "内容 " * 200, "overwrite": True,
+        }}
+
+    return {"list_page": list_page, "read_doc": read_doc, "read_raw": read_raw,
+            "search": search, "save": save}
+
+
+async def _load(client, make_request, total, concurrency):
+    """concurrency 个协程共同发出 total 个请求，返回 (每个请求耗时, 总耗时, 失败数)"""
+    timings = []
+    errors = 0
+    counter = iter(range(total))
+
+    async def worker():
+        nonlocal errors
+        for i in counter:
+            method, url, kwargs = make_request(i)
+            start = time.perf_counter()
+            resp = await client.request(method, url, **kwargs)
+            await resp.aread()
+            timings.append(time.perf_counter() - start)
+            if resp.status_code >= 400:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return timings, time.perf_counter() - start, errors
+
+
+async def _run(app, filenames, total, concurrency, scenarios):
+    import httpx
+
+    results = {}
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            for name, make_request in _scenarios(filenames).items():
+                if scenarios and name not in scenarios:
+                    continue
+                await _load(client, make_request, min(total, 50), concurrency)  # 预热
+                timings, elapsed, errors = await _load(client, make_request, total, concurrency)
+                results[name] = {**summarize(timings), "throughput_rps": round(total / elapsed, 1),
+                                 "errors": errors}
+    return results
+
+
+def run(docs=1000, total=1000, concurrency=16, scenarios=None, turns=5, turn_chars=800):
+    work = tempfile.mkdtemp(prefix="insightpipe-bench-api-")
+    try:
+        docs_dir = os.path.join(work, "docs")
+        filenames = make_corpus(docs_dir, docs, turns, turn_chars)
+        # server.main 在导入时读取目录配置
+        os.environ["INSIGHTPIPE_DOCS_DIR"] = docs_dir
+        os.environ["INSIGHTPIPE_STATE_DIR"] = os.path.join(work, "state")
+        from server import main
+
+        # 预先把各索引同步完，启动后的后台同步不再与压测争抢 CPU
+        main.doc_index.reconcile()
+        main.search_index.sync()
+        main.vector_index.sync()
+        main.dedup_index.sync()
+
+        results = asyncio.run(_run(main.app, filenames, total, concurrency, scenarios))
+        return {"docs": docs, "concurrency": concurrency, "scenarios": results}
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="In-process API load benchmark")
+    parser.add_argument("--docs", type=int, default=1000)
+    parser.add_argument("--requests", type=int, default=1000, help="requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--scenario", action="append", help="run only these scenarios (repeatable)")
+    args = parser.parse_args()
+
+    results = run(args.docs, args.requests, args.concurrency, args.scenario)
+    print(f"{results['docs']} docs, concurrency {results['concurrency']}")
+    for name, r in results["scenarios"].items():
+        print(f"  {name:<12} p50 {r['p50_ms']:8.2f} ms  p95 {r['p95_ms']:8.2f} ms  p99 {r['p99_ms']:8.2f} ms  "
+              f"{r['throughput_rps']:8.1f} req/s  errors {r['errors']}")
+
+
+if __name__ == "__main__":
+    main()
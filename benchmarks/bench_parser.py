@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+batchexecute 解析器基准：流式单遍解析器 vs 旧实现（split 行 + 两次 json.loads 整树解码 + join），
+以及服务端导入的完整路径（流式切帧 -> 解析并写缓存 -> 生成 Markdown）
+用法: python benchmarks/bench_parser.py --turns 200 --turn-chars 5000
+"""
+import argparse
+import asyncio
+import json
+import os
+import re
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from benchmarks.synthetic import make_batchexecute
+from server.services.batchexecute import afind_payload, aiter_lines, parse_text
+from server.services.conversation import count_turns, render_turns, render_turns_document
+from server.services.gemini_cache import GeminiCache
+from server.services.gemini_service import GeminiService
+
+# 模拟 httpx aiter_text() 的文本块大小
+CHUNK_CHARS = 65536
+
+
+def legacy_parse(raw_text):
+    """重构前 GeminiService._parse_response 的算法（仅用于对比）"""
+    lines = raw_text.split('\n')
+    target_line = None
+    for line in reversed(lines):
+        if 'wrb.fr' in line:
+            match = re.search(r'(\[\["wrb\.fr".*)$', line)
+            if match:
+                target_line = match.group(1)
+                break
+    outer_data = json.loads(target_line)
+    inner_data = json.loads(outer_data[0][2])
+    title_node = inner_data[0][2]
+    title = str(title_node[1]) if isinstance(title_node, list) and len(title_node) > 1 else str(title_node)
+    turns = []
+    markdown_lines = []
+    for item in inner_data[0][1]:
+        if not isinstance(item, list) or len(item) < 4:
+            continue
+        user_text = item[2][0][0]
+        first_node = item[3][0]
+        content_node = first_node[0]
+        if isinstance(content_node, list) and len(content_node) > 1 and isinstance(content_node[1], list):
+            model_text = content_node[1][0]
+        else:
+            model_text = first_node[1][0]
+        turns.append({'user': user_text, 'model': model_text})
+        markdown_lines.append(f"## 🙋‍♂️ User\n\n{user_text}\n")
+        markdown_lines.append(f"## 🤖 AI\n\n{model_text}\n")
+        markdown_lines.append("---\n")
+    return {"title": title, "content": "\n".join(markdown_lines), "turns": turns}
+
+
+def streaming_parse(raw_text):
+    return parse_text(raw_text).to_dict()
+
+
+def streaming_turns_only(raw_text):
+    """只消费轮次（不拼接整篇Markdown），体现惰性解码的下限"""
+    conversation = parse_text(raw_text)
+    return sum(1 for _ in conversation.iter_turns())
+
+
+def server_path(raw_text):
+    """
+    导入接口的真实路径：按块到达的响应 -> afind_payload 切出数据帧 -> _decode_frame（写缓存）
+    -> render_turns_document 生成返回的 Markdown；峰值包含最终结果（轮次 + Markdown）
+    """
+    async def chunks():
+        for start in range(0, len(raw_text), CHUNK_CHARS):
+            yield raw_text[start:start + CHUNK_CHARS]
+
+    with tempfile.TemporaryDirectory() as root:
+        cache = GeminiCache(root)
+        try:
+            holder = [asyncio.run(afind_payload(aiter_lines(chunks())))]
+            result = GeminiService._decode_frame("bench", holder, cache)
+        finally:
+            cache.close()
+    turns = result["turns"]
+    return result, render_turns_document(result["title"], turns, count_turns(turns))
+
+
+def measure(func, raw_text, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(raw_text)
+        timings.append(time.perf_counter() - start)
+    tracemalloc.start()
+    func(raw_text)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return statistics.median(timings), peak
+
+
+def run(turns, turn_chars, repeat):
+    raw_text = make_batchexecute(turns=turns, turn_chars=turn_chars)
+    payload_bytes = len(raw_text.encode('utf-8'))
+    legacy = legacy_parse(raw_text)
+    streaming = streaming_parse(raw_text)
+    assert (legacy["title"], legacy["turns"]) == (streaming["title"], streaming["turns"]), "parsers disagree"
+    assert legacy["content"] == render_turns(streaming["turns"]), "markdown differs"
+    assert server_path(raw_text)[0] == streaming, "server path differs"
+    del legacy, streaming
+
+    results = {"payload_bytes": payload_bytes, "turns": turns, "parsers": {}}
+    for name, func in (("legacy", legacy_parse), ("streaming", streaming_parse),
+                       ("streaming_turns_only", streaming_turns_only), ("server", server_path)):
+        seconds, peak = measure(func, raw_text, repeat)
+        results["parsers"][name] = {
+            "median_s": round(seconds, 6),
+            "mb_per_s": round(payload_bytes / seconds / 1e6, 2),
+            "peak_bytes": peak,
+            "peak_x_payload": round(peak / payload_bytes, 2),
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare batchexecute parsers")
+    parser.add_argument("--turns", type=int, default=200)
+    parser.add_argument("--turn-chars", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    results = run(args.turns, args.turn_chars, args.repeat)
+    print(f"payload: {results['payload_bytes'] / 1e6:.2f} MB, {results['turns']} turns")
+    for name, r in results["parsers"].items():
+        print(f"  {name:<22} {r['median_s'] * 1000:8.1f} ms  {r['mb_per_s']:7.1f} MB/s  "
+              f"peak {r['peak_bytes'] / 1e6:6.1f} MB ({r['peak_x_payload']}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+存储层基准：合成 docs/ 语料库上的列表、保存、读取延迟
+用法: python benchmarks/bench_storage.py --sizes 10,1000,10000 [--corpus-dir /tmp/corpora]
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from benchmarks.harness import summarize, time_calls
+from benchmarks.synthetic import make_corpus, make_document
+from server.services import DocCache, DocIndex, DocStore, RevisionStore
+
+# 全量列表（不分页）在大语料库上只跑几次
+FULL_LIST_MAX_DOCS = 10_000
+
+
+def scan_directory(docs_dir):
+    """索引引入之前 list_documents 的做法：listdir + stat + 读标题行（仅用于对比）"""
+    docs = []
+    for name in os.listdir(docs_dir):
+        if not name.endswith(".md"):
+            continue
+        path = os.path.join(docs_dir, name)
+        stats = os.stat(path)
+        with open(path, "r", encoding="utf-8") as f:
+            title = f.readline().strip().lstrip("# ")
+        docs.append({"filename": name, "title": title, "mtime": stats.st_mtime, "size": stats.st_size})
+    docs.sort(key=lambda d: d["mtime"], reverse=True)
+    return docs
+
+
+def bench_listing(docs_dir, state_dir, count, repeat):
+    index = DocIndex(docs_dir, os.path.join(state_dir, "doc_index.db"))
+    try:
+        # 冷启动：空索引首次对账（建索引）；之后是后台线程发现外部修改时的扫描代价
+        cold = time_calls(lambda _: index.reconcile(), 1)
+        results = {
+            "reconcile_cold": summarize(cold),
+            "reconcile_warm": summarize(time_calls(lambda _: index.reconcile(), max(1, repeat // 10))),
+            "list_page": summarize(time_calls(lambda i: index.list(limit=50, offset=(i * 50) % max(1, count)), repeat)),
+            "count": summarize(time_calls(lambda _: index.count(), repeat)),
+        }
+        full_repeat = repeat if count <= FULL_LIST_MAX_DOCS else 3
+        results["list_full"] = summarize(time_calls(lambda _: index.list(), full_repeat))
+        results["directory_scan"] = summarize(time_calls(lambda _: scan_directory(docs_dir), full_repeat))
+        return results
+    finally:
+        index.close()
+
+
+def bench_save(docs_dir, state_dir, repeat, turns, turn_chars):
+    """新建、覆盖（带版本历史）两种保存；在单独的目录里进行，不污染复用的语料库"""
+    save_dir = os.path.join(state_dir, "save_docs")
+    plain = DocStore(save_dir)
+    revisions = RevisionStore(os.path.join(state_dir, "revisions"))
+    versioned = DocStore(save_dir, revisions=revisions)
+    documents = [make_document(i, turns, turn_chars, seed=1) for i in range(repeat)]
+    try:
+        create = time_calls(lambda i: plain.write(documents[i][0], documents[i][1], overwrite=False), repeat)
+        # 同一文档反复小改：版本历史以增量存储
+        name, text = documents[0]
+        edit = time_calls(lambda i: versioned.write(name, text + f"\n补充 {i}\n"), repeat)
+        return {"create": summarize(create), "overwrite_with_revisions": summarize(edit)}
+    finally:
+        revisions.close()
+
+
+def bench_read(docs_dir, filenames, repeat):
+    store = DocStore(docs_dir)
+    cache = DocCache(docs_dir)
+    names = [filenames[i % len(filenames)] for i in range(repeat)]
+    raw = time_calls(lambda i: store.read_bytes(names[i]), repeat)
+    def cold_get(i):
+        cache.invalidate(names[i])
+        return cache.get(names[i])
+    cache_cold = time_calls(cold_get, repeat)
+    # 热缓存：反复读同一小组文档（命中后只做一次 stat 校验）
+    hot = names[:min(16, len(names))]
+    cache_warm = time_calls(lambda i: cache.get(hot[i % len(hot)]), repeat, warmup=len(hot))
+    return {"read_bytes": summarize(raw), "cache_cold": summarize(cache_cold), "cache_warm": summarize(cache_warm)}
+
+
+def run(sizes, repeat=200, turns=5, turn_chars=800, corpus_dir=None):
+    results = {}
+    for count in sizes:
+        work = tempfile.mkdtemp(prefix=f"insightpipe-bench-{count}-")
+        try:
+            docs_dir = os.path.join(corpus_dir, f"n{count}") if corpus_dir else os.path.join(work, "docs")
+            filenames = make_corpus(docs_dir, count, turns, turn_chars)
+            results[f"n{count}"] = {
+                "listing": bench_listing(docs_dir, work, count, repeat),
+                "save": bench_save(docs_dir, work, min(repeat, 200), turns, turn_chars),
+                "read": bench_read(docs_dir, filenames, repeat),
+            }
+        finally:
+            shutil.rmtree(work, ignore_errors=True)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Storage benchmarks on synthetic corpora")
+    parser.add_argument("--sizes", default="10,1000,10000", help="comma separated corpus sizes (up to 100000)")
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--turns", type=int, default=5)
+    parser.add_argument("--turn-chars", type=int, default=800)
+    parser.add_argument("--corpus-dir", help="keep generated corpora here and reuse them across runs")
+    args = parser.parse_args()
+
+    sizes = [int(s) for s in args.sizes.split(",") if s]
+    results = run(sizes, args.repeat, args.turns, args.turn_chars, args.corpus_dir)
+    for size, groups in results.items():
+        print(size)
+        for group, metrics in groups.items():
+            for name, r in metrics.items():
+                print(f"  {group + '.' + name:<36} p50 {r['p50_ms']:9.3f} ms  p95 {r['p95_ms']:9.3f} ms  (n={r['n']})")
+
+
+if __name__ == "__main__":
+    main()
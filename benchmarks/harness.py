@@ -0,0 +1,147 @@
+"""基准测试的公共部分：计时统计、结果文件、与基线对比"""
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from typing import Callable, Dict, List, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# 基线按规模（profile）分开存放并提交到仓库：benchmarks/baselines/<profile>.json
+BASELINE_DIR = os.path.join(ROOT, "benchmarks", "baselines")
+
+
+def baseline_path(profile: str) -> str:
+    return os.path.join(BASELINE_DIR, f"{profile}.json")
+
+# 参与基线对比的指标（mean/p99 波动太大，只记录不比较）
+COMPARED_METRICS = ("p50_ms", "p95_ms", "median_s", "mb_per_s", "throughput_rps", "peak_bytes")
+# 方向：吞吐类越大越好，其余（耗时、内存）越小越好
+HIGHER_IS_BETTER = ("mb_per_s", "throughput_rps")
+# 亚毫秒级操作的计时抖动，绝对变化小于此值（毫秒）不算回归
+NOISE_FLOOR_MS = 0.05
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(q * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summarize(seconds: List[float]) -> dict:
+    """一组耗时（秒）-> 毫秒分位数"""
+    values = sorted(seconds)
+    return {
+        "n": len(values),
+        "p50_ms": round(percentile(values, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(values, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(values, 0.99) * 1000, 3),
+        "mean_ms": round(statistics.fmean(values) * 1000, 3) if values else 0.0,
+    }
+
+
+def time_calls(func: Callable[[int], object], n: int, warmup: int = 0) -> List[float]:
+    """调用 func(i) n 次，返回每次的耗时（秒）"""
+    for i in range(warmup):
+        func(i)
+    timings = []
+    for i in range(n):
+        start = time.perf_counter()
+        func(i)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def cpu_model() -> str:
+    """CPU 型号（Linux 读 /proc/cpuinfo，其他平台用 platform.processor()）"""
+    try:
+        with open("/proc/cpuinfo", "r", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("model name"):
+                    return line.split(":", 1)[1].strip()
+    except OSError:
+        pass
+    return platform.processor()
+
+
+def environment() -> dict:
+    """结果附带运行环境，跨机器对比时一眼能看出不可比"""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                                capture_output=True, text=True, timeout=5).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        commit = ""
+    return {
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_model": cpu_model(),
+        "cpus": os.cpu_count(),
+        "commit": commit,
+        "timestamp": time.time(),
+    }
+
+
+def flatten(results: dict, prefix: str = "") -> Dict[str, float]:
+    """嵌套结果 -> {"storage.n1000.list_page.p50_ms": 0.42, ...}（只保留数值）"""
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}.{key}" if prefix else str(key)
+        if isinstance(value, dict):
+            flat.update(flatten(value, name))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+def compare(current: dict, baseline: dict, tolerance: float = 0.15) -> List[dict]:
+    """
+    逐项对比 suites 下的指标，返回每项的变化；
+    变差超过 tolerance（相对值）的标记为 regression
+    """
+    cur = flatten(current.get("suites", {}))
+    base = flatten(baseline.get("suites", {}))
+    rows = []
+    for name in sorted(cur.keys() & base.keys()):
+        leaf = name.rsplit(".", 1)[-1]
+        if leaf not in COMPARED_METRICS or not base[name]:
+            continue
+        change = (cur[name] - base[name]) / base[name]
+        worse = -change if leaf in HIGHER_IS_BETTER else change
+        if leaf.endswith("_ms") and abs(cur[name] - base[name]) < NOISE_FLOOR_MS:
+            worse = 0.0
+        rows.append({
+            "metric": name,
+            "baseline": base[name],
+            "current": cur[name],
+            "change": round(change, 4),
+            "regression": worse > tolerance,
+            "improvement": worse < -tolerance,
+        })
+    return rows
+
+
+def load(path: str) -> Optional[dict]:
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def dump(results: dict, path: str) -> None:
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+        f.write("\n")
+
+
+def print_comparison(rows: List[dict], only_changes: bool = False) -> None:
+    for row in rows:
+        if only_changes and not (row["regression"] or row["improvement"]):
+            continue
+        mark = "REGRESSION" if row["regression"] else ("improved" if row["improvement"] else "")
+        print(f"  {row['metric']:<60} {row['baseline']:>12.4g} -> {row['current']:<12.4g} "
+              f"{row['change'] * 100:+7.1f}%  {mark}")
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+运行全部基准，结果写成 JSON，并与保存的基线逐项对比
+用法:
+    python benchmarks/run.py                         # 标准规模，结果写到 benchmarks/results/<时间>.json
+    python benchmarks/run.py --quick                 # 小规模冒烟（CI 或改动后快速自查）
+    python benchmarks/run.py --save-baseline         # 把本次结果存为该规模的基线
+    python benchmarks/run.py --baseline old.json --fail-on-regression
+基线默认是 benchmarks/baselines/<profile>.json（随仓库提交，environment 字段记录了录制它的机器和提交）
+基线与机器强相关：只和同一台机器、同一规模（profile）的结果比较；换机器后先在本机 --save-baseline 重录
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from benchmarks import bench_api, bench_parser, bench_storage
+from benchmarks.harness import ROOT, baseline_path, compare, dump, environment, load, print_comparison
+
+PROFILES = {
+    "quick": {
+        "parser": [(20, 2000), (200, 5000)],
+        "parser_repeat": 3,
+        "storage_sizes": [10, 1000],
+        "storage_repeat": 50,
+        "api_docs": 200,
+        "api_requests": 200,
+        "api_concurrency": 8,
+    },
+    "standard": {
+        "parser": [(20, 2000), (200, 5000), (1000, 5000)],
+        "parser_repeat": 5,
+        "storage_sizes": [10, 1000, 10000],
+        "storage_repeat": 200,
+        "api_docs": 1000,
+        "api_requests": 1000,
+        "api_concurrency": 16,
+    },
+    "full": {
+        "parser": [(20, 2000), (200, 5000), (1000, 5000), (2000, 20000)],
+        "parser_repeat": 5,
+        "storage_sizes": [10, 1000, 10000, 100000],
+        "storage_repeat": 500,
+        "api_docs": 10000,
+        "api_requests": 5000,
+        "api_concurrency": 32,
+    },
+}
+SUITES = ("parser", "storage", "api")
+
+
+def run_suites(profile: dict, suites, corpus_dir=None) -> dict:
+    results = {}
+    if "parser" in suites:
+        results["parser"] = {
+            f"t{turns}x{chars}": bench_parser.run(turns, chars, profile["parser_repeat"])
+            for turns, chars in profile["parser"]
+        }
+    if "storage" in suites:
+        results["storage"] = bench_storage.run(profile["storage_sizes"], profile["storage_repeat"],
+                                               corpus_dir=corpus_dir)
+    if "api" in suites:
+        # 放在最后：它会导入 server.main 并把目录配置指向临时语料库
+        results["api"] = bench_api.run(profile["api_docs"], profile["api_requests"], profile["api_concurrency"])
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run InsightPipe benchmarks")
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="standard")
+    parser.add_argument("--quick", action="store_const", const="quick", dest="profile")
+    parser.add_argument("--suite", action="append", choices=SUITES, help="run only these suites (repeatable)")
+    parser.add_argument("--output", help="result file (default: benchmarks/results/<timestamp>.json)")
+    parser.add_argument("--baseline", help="baseline to compare against (default: benchmarks/baselines/<profile>.json)")
+    parser.add_argument("--save-baseline", action="store_true", help="also write the results to --baseline")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="relative change counted as regression")
+    parser.add_argument("--fail-on-regression", action="store_true", help="exit 1 if any metric regressed")
+    parser.add_argument("--corpus-dir", help="keep storage corpora here and reuse them across runs")
+    args = parser.parse_args()
+
+    suites = args.suite or SUITES
+    args.baseline = args.baseline or baseline_path(args.profile)
+    started = time.time()
+    results = {
+        "profile": args.profile,
+        "environment": environment(),
+        "suites": run_suites(PROFILES[args.profile], suites, args.corpus_dir),
+    }
+    results["elapsed_s"] = round(time.time() - started, 1)
+
+    output = args.output or os.path.join(
+        ROOT, "benchmarks", "results", time.strftime("%Y%m%d-%H%M%S", time.localtime(started)) + ".json")
+    dump(results, output)
+    print(f"results: {output} ({results['elapsed_s']} s)")
+
+    if args.save_baseline:
+        dump(results, args.baseline)
+        print(f"baseline saved: {args.baseline}")
+        return
+
+    baseline = load(args.baseline)
+    if baseline is None:
+        print(f"no baseline at {args.baseline} (run with --save-baseline to create one)")
+        return
+    if baseline.get("profile") != results["profile"]:
+        print(f"warning: baseline profile is {baseline.get('profile')!r}, this run is {results['profile']!r}")
+    recorded = baseline.get("environment", {})
+    if any(recorded.get(key) != results["environment"][key] for key in ("machine", "cpu_model", "cpus")):
+        print(f"warning: baseline was recorded on a different machine "
+              f"({recorded.get('cpu_model') or recorded.get('machine')}, {recorded.get('cpus')} CPUs); "
+              f"re-record it here with --save-baseline before trusting regressions")
+
+    rows = compare(results, baseline, args.tolerance)
+    regressions = [row for row in rows if row["regression"]]
+    improvements = [row for row in rows if row["improvement"]]
+    print(f"compared {len(rows)} metrics against {baseline['environment'].get('commit') or 'baseline'}: "
+          f"{len(regressions)} regressions, {len(improvements)} improvements (tolerance {args.tolerance:.0%})")
+    print_comparison(rows, only_changes=True)
+    if regressions and args.fail_on_regression:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
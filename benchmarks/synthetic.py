@@ -0,0 +1,70 @@
+"""合成测试数据：batchexecute 响应、docs/ 语料库"""
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from server.services.conversation import render_document, render_turns
+
+USER_WORDS = ["什么是", "第一性原理", "为什么", "如何", "理解", "向量", "索引", "缓存", "并发", "Python"]
+MODEL_WORDS = ["因为", "首先", "其次", "数据", "结构", "算法", "例如", "总结", "性能", "延迟", "吞吐"]
+
+
+def _text(words, chars, rng):
+    parts = []
+    length = 0
+    while length < chars:
+        word = rng.choice(words)
+        parts.append(word)
+        length += len(word) + 1
+    return " ".join(parts)
+
+
+def make_turns(turns: int, turn_chars: int, rng: random.Random) -> list:
+    return [
+        {"user": f"问题 {i}: " + _text(USER_WORDS, max(20, turn_chars // 10), rng),
+         "model": f"回答 {i}:\n\n" + _text(MODEL_WORDS, turn_chars, rng)}
+        for i in range(turns)
+    ]
+
+
+def make_batchexecute(turns: int = 20, turn_chars: int = 2000, title: str = "合成对话", seed: int = 0) -> str:
+    """生成一个 rt=c 格式的 batchexecute 响应，结构与 ujx1Bf 分享接口一致"""
+    rng = random.Random(seed)
+    conv = []
+    for i, turn in enumerate(make_turns(turns, turn_chars, rng)):
+        user, model = turn["user"], turn["model"]
+        conv.append([["c_" + str(i), "r_" + str(i)], None, [[user]], [[[f"rc_{i}", [model]]]]])
+    inner = json.dumps([[None, conv, [None, title]]], ensure_ascii=False)
+    frame = json.dumps([["wrb.fr", "ujx1Bf", inner, None, None, None, "generic"]], ensure_ascii=False)
+    trailer = json.dumps([["di", 231], ["af.httprm", 231, "-1", 12]])
+    return f")]}}'\n\n{len(frame)}\n{frame}\n{len(trailer)}\n{trailer}\n"
+
+
+def make_document(index: int, turns: int = 5, turn_chars: int = 800, seed: int = 0) -> tuple:
+    """生成一篇与导入结果同布局的对话文档，返回 (文件名, Markdown)"""
+    rng = random.Random(seed * 1_000_003 + index)
+    title = f"合成对话 {index} " + _text(USER_WORDS, 12, rng)
+    body = render_turns(make_turns(turns, turn_chars, rng))
+    return f"bench{index:06d}_{index % 97}.md", render_document(title, body, turns)
+
+
+def make_corpus(docs_dir: str, count: int, turns: int = 5, turn_chars: int = 800, seed: int = 0) -> list:
+    """
+    在 docs_dir 写入 count 篇合成文档（已存在同名文件时跳过，方便复用大语料库）
+    mtime 依次错开，使按时间排序的列表有确定的顺序；返回文件名列表
+    """
+    os.makedirs(docs_dir, exist_ok=True)
+    base = time.time() - count
+    filenames = []
+    for i in range(count):
+        filename, text = make_document(i, turns, turn_chars, seed)
+        path = os.path.join(docs_dir, filename)
+        if not os.path.exists(path):
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(text)
+            os.utime(path, (base + i, base + i))
+        filenames.append(filename)
+    return filenames
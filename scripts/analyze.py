@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+批量洞察分析：把 docs/ 里的对话交给 LLM 分析，结果保存为 <原文件名>.insights.md
+- 超出 token 预算的长对话按消息边界分段分析后合并
+- 结果按 (提示词, 对话内容) 的哈希缓存：重跑时只处理新增或修改过的对话
+- 后端：OpenAI 兼容接口（--api-base / INSIGHT_API_BASE），或本地桩后端 --backend stub
+服务端运行时会通过目录对账自动发现新的洞察文档并更新索引
+用法: python scripts/analyze.py [文件名 ...] [--all] [--backend stub] [--concurrency 8] [--max-tokens 6000]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from server.services.doc_store import DocStore
+from server.services.revisions import RevisionStore
+from server.services.insights import (
+    DEFAULT_MAX_TOKENS, InsightCache, InsightPipeline, create_backend, is_insight_doc
+)
+
+# Configuration
+DOCS_DIR = os.path.join(os.path.dirname(__file__), '../docs')
+REVISIONS_DIR = os.path.join(os.path.dirname(__file__), '../.insightpipe/revisions')
+INSIGHTS_DB = os.path.join(os.path.dirname(__file__), '../.insightpipe/insights.db')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Analyze conversations in docs/ and save linked insight docs")
+    parser.add_argument('filenames', nargs='*', help="documents to analyze (file names inside docs/)")
+    parser.add_argument('--all', action='store_true', help="分析 docs/ 下的全部对话")
+    parser.add_argument('--docs-dir', default=DOCS_DIR)
+    parser.add_argument('--backend', choices=['openai', 'stub'], help="默认读取 INSIGHT_BACKEND")
+    parser.add_argument('--api-base', help="OpenAI 兼容接口地址，例如 https://api.openai.com/v1")
+    parser.add_argument('--model', help="模型名（默认 INSIGHT_MODEL 或 gpt-4o-mini）")
+    parser.add_argument('--concurrency', type=int, help="同时进行的请求数（默认 INSIGHT_MAX_CONCURRENCY 或 4）")
+    parser.add_argument('--max-tokens', type=int, default=DEFAULT_MAX_TOKENS, help="单次请求的 token 预算")
+    parser.add_argument('--refresh', action='store_true', help="忽略缓存，重新请求后端")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if not os.path.isdir(args.docs_dir):
+        print(f"❌ 目录不存在: {args.docs_dir}")
+        sys.exit(1)
+    try:
+        backend = create_backend(args.backend, model=args.model, api_base=args.api_base,
+                                 max_concurrency=args.concurrency)
+    except ValueError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+
+    revisions = RevisionStore(REVISIONS_DIR)
+    doc_store = DocStore(args.docs_dir, revisions=revisions)
+    filenames = args.filenames
+    if args.all:
+        filenames = sorted(name for name in doc_store.layout.scan() if not is_insight_doc(name))
+    if not filenames:
+        print("❌ 请指定要分析的文件名，或使用 --all")
+        sys.exit(1)
+
+    cache = InsightCache(INSIGHTS_DB)
+    pipeline = InsightPipeline(
+        backend, cache,
+        read=doc_store.read,
+        save=lambda filename, content: doc_store.write(filename, content),
+        max_tokens=args.max_tokens,
+    )
+    print(f"🧠 后端: {backend.identity}，并发 {backend.max_concurrency}，待分析 {len(filenames)} 篇")
+    start = time.perf_counter()
+
+    def progress(done, total):
+        if done == total or done % 10 == 0:
+            print(f"   ... {done}/{total}")
+
+    async def run():
+        try:
+            return await pipeline.run(filenames, refresh=args.refresh, progress=progress)
+        finally:
+            await backend.aclose()
+
+    result = asyncio.run(run())
+    cache.close()
+    revisions.close()
+
+    for doc in result["documents"]:
+        if doc["status"] == "failed":
+            print(f"⚠️  {doc['filename']} 分析失败: {doc['error']}")
+        elif doc["status"] == "missing":
+            print(f"⚠️  {doc['filename']} 不存在")
+    counts = result["counts"]
+    elapsed = time.perf_counter() - start
+    print(f"📊 分析 {counts['analyzed']} 篇，未变化跳过 {counts['unchanged']} 篇，失败 {counts['failed']} 篇；"
+          f"请求后端 {counts['completions']} 次，命中缓存 {counts['cached']} 次，耗时 {elapsed:.1f}s")
+    if counts["failed"] or counts["missing"]:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,29 +1,47 @@
+import argparse
 import sys
 import os
 import pyperclip
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from server.services.prompt_templates import TemplateEngine
+
 # Configuration
-TEMPLATE_PATH = os.path.join(os.path.dirname(__file__), '../templates/base_prompt.txt')
+TEMPLATES_DIR = os.path.join(os.path.dirname(__file__), '../templates')
+DEFAULT_TEMPLATE = 'base_prompt.txt'
 
-def load_template(path):
-    try:
-        with open(path, 'r', encoding='utf-8') as f:
-            return f.read()
-    except FileNotFoundError:
-        print(f"Error: Template file not found at {path}")
-        sys.exit(1)
+def parse_args():
+    parser = argparse.ArgumentParser(usage='python ask.py "Your question here"')
+    parser.add_argument('question', nargs='*')
+    parser.add_argument('-t', '--template', default=DEFAULT_TEMPLATE, help="Template file in templates/")
+    parser.add_argument('--var', action='append', default=[], metavar='NAME=VALUE',
+                        help="Extra placeholder value, e.g. --var LEVEL=beginner")
+    parser.add_argument('--list', action='store_true', help="List available templates and exit")
+    return parser.parse_args()
 
 def main():
-    if len(sys.argv) < 2:
+    args = parse_args()
+    engine = TemplateEngine(TEMPLATES_DIR)
+
+    if args.list:
+        for template in engine.list_templates():
+            print(f"{template['name']}: {', '.join(template['placeholders']) or '-'}")
+        return
+
+    if not args.question:
         print("Usage: python ask.py \"Your question here\"")
         sys.exit(1)
 
-    user_input = " ".join(sys.argv[1:])
-    template_content = load_template(TEMPLATE_PATH)
-    
-    # Replace placeholder
-    final_prompt = template_content.replace("{{USER_INPUT}}", user_input)
-    
+    user_input = " ".join(args.question)
+    values = dict(item.split('=', 1) for item in args.var if '=' in item)
+    values["USER_INPUT"] = user_input
+
+    try:
+        final_prompt = engine.render(args.template, values)
+    except FileNotFoundError:
+        print(f"Error: Template file not found at {os.path.join(TEMPLATES_DIR, args.template)}")
+        sys.exit(1)
+
     # Copy to clipboard
     try:
         pyperclip.copy(final_prompt)
@@ -1,11 +1,20 @@
-import requests
+import argparse
 import json
-import re
 import os
+import random
+import re
+import statistics
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
 
 # --- CONFIGURATION (The "Golden" Session) ---
-BASE_URL = "https://gemini.google.com/_/BardChatUi/data/batchexecute"
+BASE_URL = os.environ.get(
+    "GEMINI_BATCHEXECUTE_URL",
+    "https://gemini.google.com/_/BardChatUi/data/batchexecute"
+)
 
 # Minimal Params (Proved to work in Test 2)
 QUERY_PARAMS_TEMPLATE = {
@@ -22,55 +31,235 @@ HEADERS = {
 }
 
 DATA_DIR = "gemini_data_samples"
+STATE_FILE = ".harvest_state.jsonl"
+
+# Status codes worth retrying: rate limiting and transient server errors
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
 
 def extract_id(url):
     match = re.search(r'share/([a-zA-Z0-9]+)', url)
     return match.group(1) if match else None
 
-def process_link(url):
-    share_id = extract_id(url)
-    if not share_id:
-        print(f"❌ Invalid Link: {url}")
-        return
-
-    print(f"\n🔄 Fetching Raw Data for ID: {share_id}...")
-    
-    params = QUERY_PARAMS_TEMPLATE.copy()
-    params["source-path"] = f"/share/{share_id}"
-    
-    # Payload Construction
-    inner_req = f'[null,"{share_id}",[4]]'
-    payload = {
-        "f.req": f'[[["ujx1Bf","{inner_req.replace('"', '\\"')}",null,"generic"]]]',
-        "at": ""
-    }
-    
-    try:
-        resp = requests.post(BASE_URL, params=params, data=payload, headers=HEADERS, timeout=15)
-        
+
+class TokenBucket:
+    """Thread-safe token bucket: `rate` requests per second with bursts up to `capacity`."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class Checkpoint:
+    """Append-only JSONL log of finished share IDs, so a crashed run can resume."""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.done = set()
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # torn last line from a crash
+                    if record.get("status") == 200:
+                        self.done.add(record["share_id"])
+
+    def record(self, share_id, status, size, attempts):
+        entry = {"share_id": share_id, "status": status, "bytes": size,
+                 "attempts": attempts, "ts": time.time()}
+        with self.lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            if status == 200:
+                self.done.add(share_id)
+
+
+def write_atomic(path, text):
+    """Write to a temp file then rename, so readers never see a half-written dump."""
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class Harvester:
+    def __init__(self, args):
+        self.args = args
+        self.bucket = TokenBucket(args.rate, max(1.0, args.burst))
+        self.checkpoint = Checkpoint(os.path.join(args.out, STATE_FILE))
+        self.local = threading.local()
+        self.stats_lock = threading.Lock()
+        self.latencies = []
+        self.bytes_total = 0
+        self.retries = 0
+        self.failures = {}
+
+    def session(self):
+        # One keep-alive session per worker thread
+        if not hasattr(self.local, "session"):
+            self.local.session = requests.Session()
+            self.local.session.headers.update(HEADERS)
+        return self.local.session
+
+    def backoff(self, attempt, retry_after=None):
+        if retry_after is not None:
+            return retry_after
+        # Exponential backoff with full jitter
+        ceiling = min(self.args.max_backoff, self.args.base_backoff * (2 ** attempt))
+        return random.uniform(0, ceiling)
+
+    def fetch(self, share_id):
+        params = QUERY_PARAMS_TEMPLATE.copy()
+        params["source-path"] = f"/share/{share_id}"
+
+        # Payload Construction
+        inner_req = f'[null,"{share_id}",[4]]'
+        payload = {
+            "f.req": f'[[["ujx1Bf","{inner_req.replace(chr(34), chr(92) + chr(34))}",null,"generic"]]]',
+            "at": ""
+        }
+
+        attempt = 0
+        while True:
+            self.bucket.acquire()
+            start = time.perf_counter()
+            retry_after = None
+            try:
+                resp = self.session().post(self.args.base_url, params=params, data=payload,
+                                           timeout=self.args.timeout)
+                status = resp.status_code
+                if status not in RETRYABLE_STATUS:
+                    elapsed = time.perf_counter() - start
+                    return resp, status, elapsed, attempt + 1
+                header = resp.headers.get("retry-after")
+                if header and header.isdigit():
+                    retry_after = float(header)
+                reason = f"HTTP {status}"
+            except requests.RequestException as e:
+                reason = type(e).__name__
+
+            if attempt >= self.args.max_retries:
+                raise RuntimeError(f"gave up after {attempt + 1} attempts ({reason})")
+            with self.stats_lock:
+                self.retries += 1
+            time.sleep(self.backoff(attempt, retry_after))
+            attempt += 1
+
+    def process_link(self, url):
+        share_id = extract_id(url)
+        if not share_id:
+            print(f"❌ Invalid Link: {url}")
+            return "invalid"
+        if share_id in self.checkpoint.done:
+            return "skipped"
+
+        try:
+            resp, status, elapsed, attempts = self.fetch(share_id)
+        except Exception as e:
+            print(f"❌ {share_id}: {e}")
+            with self.stats_lock:
+                self.failures[share_id] = str(e)
+            self.checkpoint.record(share_id, None, 0, self.args.max_retries + 1)
+            return "failed"
+
         # Save RAW response regardless of status code
-        filename = f"{DATA_DIR}/{share_id}_raw.txt"
-        with open(filename, "w", encoding="utf-8") as f:
-            f.write(resp.text)
-            
-        print(f"💾 Saved raw response to {filename} (Status: {resp.status_code}, Size: {len(resp.text)} chars)")
+        filename = os.path.join(self.args.out, f"{share_id}_raw.txt")
+        write_atomic(filename, resp.text)
+        size = len(resp.content)
+        self.checkpoint.record(share_id, status, size, attempts)
+
+        with self.stats_lock:
+            self.latencies.append(elapsed)
+            self.bytes_total += size
+            if status != 200:
+                self.failures[share_id] = f"HTTP {status}"
+
+        print(f"💾 {share_id} -> {filename} (Status: {status}, Size: {size} bytes, "
+              f"{elapsed * 1000:.0f} ms, attempts: {attempts})")
+        return "ok" if status == 200 else "failed"
+
+    def run(self, links):
+        counts = {"ok": 0, "failed": 0, "skipped": 0, "invalid": 0}
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.args.workers) as pool:
+            futures = [pool.submit(self.process_link, link) for link in links]
+            for future in as_completed(futures):
+                counts[future.result()] += 1
+        elapsed = time.perf_counter() - start
+        self.summary(counts, elapsed)
+        return counts
+
+    def summary(self, counts, elapsed):
+        fetched = counts["ok"] + counts["failed"]
+        print("---------------------------------------------------")
+        print(f"📊 ok={counts['ok']} failed={counts['failed']} skipped={counts['skipped']} "
+              f"invalid={counts['invalid']} retries={self.retries}")
+        print(f"⏱  {elapsed:.1f}s total, {fetched / elapsed if elapsed else 0:.2f} links/s, "
+              f"{self.bytes_total / 1e6 / elapsed if elapsed else 0:.2f} MB/s")
+        if self.latencies:
+            ordered = sorted(self.latencies)
+
+            def pct(p):
+                return ordered[min(len(ordered) - 1, int(p * len(ordered)))] * 1000
+
+            print(f"📈 latency p50={pct(0.50):.0f}ms p90={pct(0.90):.0f}ms p99={pct(0.99):.0f}ms "
+                  f"max={ordered[-1] * 1000:.0f}ms mean={statistics.mean(ordered) * 1000:.0f}ms")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Concurrently harvest raw Gemini share responses")
+    parser.add_argument("--links", default=os.path.join(DATA_DIR, "links.txt"))
+    parser.add_argument("--out", default=DATA_DIR)
+    parser.add_argument("--base-url", default=BASE_URL, help="batchexecute endpoint (point at a mock for testing)")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--rate", type=float, default=2.0, help="requests per second (token bucket refill)")
+    parser.add_argument("--burst", type=float, default=4.0, help="token bucket capacity")
+    parser.add_argument("--max-retries", type=int, default=5)
+    parser.add_argument("--base-backoff", type=float, default=1.0)
+    parser.add_argument("--max-backoff", type=float, default=60.0)
+    parser.add_argument("--timeout", type=float, default=15.0)
+    return parser.parse_args()
 
-    except Exception as e:
-        print(f"❌ Exception: {e}")
 
 def main():
-    if not os.path.exists(DATA_DIR):
-        os.makedirs(DATA_DIR)
-        
-    with open(f"{DATA_DIR}/links.txt", "r") as f:
+    args = parse_args()
+    if not os.path.exists(args.out):
+        os.makedirs(args.out)
+
+    with open(args.links, "r") as f:
         links = [l.strip() for l in f.readlines() if l.strip()]
-    
-    print(f"🧪 Starting Batch Download on {len(links)} links...")
+    # Drop duplicate share IDs so two workers never fetch the same conversation
+    seen = set()
+    links = [l for l in links if not (extract_id(l) in seen or seen.add(extract_id(l)))]
+
+    harvester = Harvester(args)
+    print(f"🧪 Starting Batch Download on {len(links)} links "
+          f"({args.workers} workers, {args.rate}/s, {len(harvester.checkpoint.done)} already done)...")
     print("---------------------------------------------------")
-    
-    for link in links:
-        process_link(link)
-        time.sleep(1) # Be polite
+    harvester.run(links)
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+离线批量导入对话导出文件（Google Takeout 下载包、JSON 数组、JSONL，可为 zip/gzip）
+流式解析，不整体加载导出文件；转换在进程池中进行，按批写入 docs/
+服务端运行时会通过目录对账自动发现新文档并更新索引
+用法: python scripts/import_export.py takeout.zip [more.json ...] --workers 4 [--overwrite]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from server.services.doc_store import DocStore
+from server.services.revisions import RevisionStore
+from server.services.takeout import WRITE_BATCH, iter_export_items, run_import, write_batch
+from server.services.turn_store import TurnStore
+
+# Configuration
+DOCS_DIR = os.path.join(os.path.dirname(__file__), '../docs')
+REVISIONS_DIR = os.path.join(os.path.dirname(__file__), '../.insightpipe/revisions')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Import Gemini/Takeout conversation exports into docs/")
+    parser.add_argument('paths', nargs='+', help="export files (.json/.jsonl, optionally .gz, or a Takeout .zip)")
+    parser.add_argument('--docs-dir', default=DOCS_DIR)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help="转换进程数，1 表示在当前进程内串行处理")
+    parser.add_argument('--batch-size', type=int, default=WRITE_BATCH, help="每批写入的文档数")
+    parser.add_argument('--overwrite', action='store_true', help="覆盖同名文档（默认跳过）")
+    parser.add_argument('--no-revisions', action='store_true', help="不记录版本历史（首次大批量导入时更快）")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    os.makedirs(args.docs_dir, exist_ok=True)
+    revisions = None if args.no_revisions else RevisionStore(REVISIONS_DIR)
+    doc_store = DocStore(args.docs_dir, revisions=revisions)
+    turn_store = TurnStore(args.docs_dir)
+    start = time.perf_counter()
+
+    def write(docs):
+        counts, saved = write_batch(doc_store, turn_store, docs, args.overwrite)
+        print(f"💾 写入 {counts['saved']} 篇，已存在跳过 {counts['exists']} 篇")
+        return counts
+
+    totals = {}
+    for path in args.paths:
+        print(f"📦 {path}")
+        try:
+            with open(path, 'rb') as f:
+                counts = run_import(iter_export_items(f), write, workers=args.workers, batch_size=args.batch_size)
+        except (OSError, ValueError) as e:
+            print(f"❌ {path} 失败: {e}")
+            continue
+        for key, value in counts.items():
+            totals[key] = totals.get(key, 0) + value
+
+    if revisions is not None:
+        revisions.close()
+    elapsed = time.perf_counter() - start
+    print(f"📊 条目 {totals.get('items', 0)}，转换 {totals.get('converted', 0)}，"
+          f"非对话跳过 {totals.get('invalid', 0)}，写入 {totals.get('saved', 0)}，"
+          f"已存在 {totals.get('exists', 0)}，耗时 {elapsed:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+本地 batchexecute stub 服务器：回放 gemini_data_samples/ 下录制的 *_raw.txt 响应
+用法:
+    python scripts/mock_gemini_server.py --port 8899
+    GEMINI_BATCHEXECUTE_URL=http://127.0.0.1:8899/_/BardChatUi/data/batchexecute python3 -m uvicorn server.main:app
+"""
+import argparse
+import os
+import random
+import re
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+DATA_DIR = "gemini_data_samples"
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    data_dir = DATA_DIR
+    latency = 0.0
+    fail_rate = 0.0
+
+    def do_POST(self):
+        # 读掉请求体，保持keep-alive连接可复用
+        length = int(self.headers.get("content-length") or 0)
+        if length:
+            self.rfile.read(length)
+
+        query = parse_qs(urlparse(self.path).query)
+        source_path = query.get("source-path", [""])[0]
+        match = re.search(r'share/([a-zA-Z0-9]+)', source_path)
+        raw_path = os.path.join(self.data_dir, f"{match.group(1)}_raw.txt") if match else None
+
+        if self.latency:
+            time.sleep(self.latency)
+
+        if self.fail_rate and random.random() < self.fail_rate:
+            # 模拟限流/上游故障，用于测试重试逻辑
+            self._reply(random.choice((429, 503)), b"try again later")
+            return
+
+        if not raw_path or not os.path.exists(raw_path):
+            self._reply(404, b"not found")
+            return
+
+        with open(raw_path, "rb") as f:
+            body = f.read()
+        self._reply(200, body)
+
+    def _reply(self, status, body):
+        self.send_response(status)
+        self.send_header("content-type", "application/json; charset=utf-8")
+        self.send_header("content-length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded batchexecute responses")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8899)
+    parser.add_argument("--data-dir", default=DATA_DIR)
+    parser.add_argument("--latency", type=float, default=0.0, help="每个响应的人工延迟（秒）")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="随机返回 429/503 的比例")
+    args = parser.parse_args()
+
+    MockHandler.data_dir = args.data_dir
+    MockHandler.latency = args.latency
+    MockHandler.fail_rate = args.fail_rate
+    # HTTP/1.1 才能保持连接复用
+    MockHandler.protocol_version = "HTTP/1.1"
+
+    server = ThreadingHTTPServer((args.host, args.port), MockHandler)
+    print(f"🧪 Mock batchexecute on http://{args.host}:{args.port}/_/BardChatUi/data/batchexecute")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
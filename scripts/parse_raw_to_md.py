@@ -3,89 +3,32 @@
 解析 Gemini raw 数据文件，生成 Markdown 格式的对话记录
 修复了 AI 回答路径解析失败的问题
 """
+import argparse
+import hashlib
 import json
-import re
 import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from server.services.batchexecute import PARSER_VERSION, PayloadNotFoundError, parse_lines, parse_text
+
+MANIFEST_FILE = '.parse_manifest.json'
+# 解析器或输出格式变化时，旧 manifest 里的记录全部作废，所有文件重新转换
+MANIFEST_VERSION = f"{PARSER_VERSION}-1"
 
 def parse_raw_file(raw_path):
-    """解析 raw 文件，返回对话列表"""
+    """解析 raw 文件，返回对话列表（按行流式读取，与服务端共用解析器）"""
     with open(raw_path, 'r', encoding='utf-8') as f:
-        content = f.read()
-    
-    # 找到包含 wrb.fr 的行
-    lines = content.split('\n')
-    target_line = None
-    
-    # 取最后一行包含 wrb.fr 的（通常包含最全的历史）
-    for line in reversed(lines):
-        if 'wrb.fr' in line:
-            match = re.search(r'(\[\["wrb\.fr".*)$', line)
-            if match:
-                target_line = match.group(1)
-                break
-    
-    if not target_line:
-        raise ValueError("未找到 wrb.fr 数据行")
-    
-    try:
-        outer_data = json.loads(target_line)
-        inner_json_str = outer_data[0][2]
-        inner_data = json.loads(inner_json_str)
-    except Exception as e:
-        raise ValueError(f"JSON 解析失败: {e}")
-    
-    # 提取标题
-    title = "Gemini 对话记录"
-    try:
-        if len(inner_data[0]) > 2:
-            title_node = inner_data[0][2]
-            if isinstance(title_node, list) and len(title_node) > 1:
-                title = str(title_node[1])
-            else:
-                title = str(title_node)
-    except: pass
-    
-    conv_list = inner_data[0][1]
-    turns = []
-    
-    for item in conv_list:
-        if not isinstance(item, list) or len(item) < 4:
-            continue
-        
-        user_text = None
-        model_text = None
-        
-        # 1. User 文本 - item[2][0][0]
-        try:
-            user_text = item[2][0][0]
-        except: pass
-        
-        # 2. Model 文本 - 尝试多级深度搜索
-        # 路径 A (常见): item[3][0][0][1][0]
-        # 路径 B (简化): item[3][0][1][0]
         try:
-            candidates_container = item[3]
-            if isinstance(candidates_container, list) and len(candidates_container) > 0:
-                first_node = candidates_container[0]
-                if isinstance(first_node, list) and len(first_node) > 0:
-                    # 尝试更深的路径 A: item[3][0][0][1][0]
-                    content_node = first_node[0]
-                    if isinstance(content_node, list) and len(content_node) > 1 and isinstance(content_node[1], list):
-                        model_text = content_node[1][0]
-                    # 尝试路径 B: item[3][0][1][0]
-                    elif len(first_node) > 1 and isinstance(first_node[1], list):
-                        model_text = first_node[1][0]
-        except: pass
-
-        if user_text or model_text:
-            turns.append({
-                'user': user_text,
-                'model': model_text
-            })
+            conversation = parse_lines(f, default_title="Gemini 对话记录")
+        except PayloadNotFoundError:
+            raise ValueError("未找到 wrb.fr 数据行")
     
     return {
-        'title': title,
-        'turns': turns
+        'title': conversation.title,
+        'turns': list(conversation.iter_turns())
     }
 
 def save_as_markdown(data, output_path):
@@ -103,24 +46,127 @@ def save_as_markdown(data, output_path):
         
         lines.append("---\n\n")
     
-    with open(output_path, 'w', encoding='utf-8') as f:
+    # 先写临时文件再原子替换，中途崩溃不会留下半截的 Markdown
+    tmp_path = f"{output_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
         f.writelines(lines)
+    os.replace(tmp_path, output_path)
+
+def convert_raw_file(job):
+    """
+    进程池任务：哈希 + 解析 + 写出单个 raw 文件
+    内容哈希与上次一致且输出仍在时直接跳过（例如文件只是被 touch 过）
+    """
+    raw_path, md_path, previous_hash = job
+    with open(raw_path, 'rb') as f:
+        raw_bytes = f.read()
+    digest = hashlib.sha256(raw_bytes).hexdigest()
+    if digest == previous_hash and os.path.exists(md_path):
+        return {'status': 'unchanged', 'hash': digest}
+
+    try:
+        conversation = parse_text(raw_bytes.decode('utf-8'), default_title="Gemini 对话记录")
+        data = {'title': conversation.title, 'turns': list(conversation.iter_turns())}
+        save_as_markdown(data, md_path)
+    except PayloadNotFoundError:
+        return {'status': 'failed', 'hash': digest, 'error': "未找到 wrb.fr 数据行"}
+    except Exception as e:
+        return {'status': 'failed', 'hash': digest, 'error': str(e)}
+    return {'status': 'converted', 'hash': digest, 'turns': len(data['turns']), 'title': data['title']}
+
+def load_manifest(data_dir):
+    """manifest: inputs = raw文件名 -> [size, mtime_ns, 内容哈希]，outputs = 内容哈希 -> 输出文件名"""
+    path = os.path.join(data_dir, MANIFEST_FILE)
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest.get('version') == MANIFEST_VERSION:
+            return manifest
+    except (OSError, ValueError):
+        pass
+    return {'version': MANIFEST_VERSION, 'inputs': {}, 'outputs': {}}
+
+def save_manifest(data_dir, manifest):
+    path = os.path.join(data_dir, MANIFEST_FILE)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+def iter_pending(data_dir, manifest, force=False):
+    """
+    生成器：边扫描目录边产出需要处理的任务
+    size/mtime 与 manifest 一致且输出存在的文件直接跳过，连哈希都不用算
+    """
+    with os.scandir(data_dir) as it:
+        for entry in it:
+            if not entry.name.endswith('_raw.txt') or not entry.is_file():
+                continue
+            stats = entry.stat()
+            md_file = entry.name.replace('_raw.txt', '_parsed.md')
+            md_path = os.path.join(data_dir, md_file)
+            known = manifest['inputs'].get(entry.name)
+            if (not force and known and known[0] == stats.st_size and known[1] == stats.st_mtime_ns
+                    and manifest['outputs'].get(known[2]) == md_file and os.path.exists(md_path)):
+                yield entry.name, None, (stats.st_size, stats.st_mtime_ns)
+                continue
+            previous_hash = None if force or not known else known[2]
+            yield entry.name, (entry.path, md_path, previous_hash), (stats.st_size, stats.st_mtime_ns)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Convert *_raw.txt dumps to Markdown")
+    parser.add_argument('--data-dir', default='gemini_data_samples')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help="进程数，1 表示在当前进程内串行处理")
+    parser.add_argument('--force', action='store_true', help="忽略 manifest，全部重新转换")
+    return parser.parse_args()
 
 def main():
-    data_dir = 'gemini_data_samples'
-    raw_files = [f for f in os.listdir(data_dir) if f.endswith('_raw.txt')]
-    
-    for raw_file in raw_files:
-        raw_path = os.path.join(data_dir, raw_file)
+    args = parse_args()
+    data_dir = args.data_dir
+    manifest = load_manifest(data_dir)
+    counts = {'converted': 0, 'unchanged': 0, 'failed': 0}
+    start = time.perf_counter()
+
+    def record(raw_file, signature, result):
+        counts[result['status']] += 1
+        if result['status'] == 'failed':
+            manifest['inputs'].pop(raw_file, None)
+            print(f"❌ {raw_file} 失败: {result['error']}")
+            return
         md_file = raw_file.replace('_raw.txt', '_parsed.md')
-        md_path = os.path.join(data_dir, md_file)
-        
-        try:
-            data = parse_raw_file(raw_path)
-            save_as_markdown(data, md_path)
-            print(f"✅ {raw_file} -> {len(data['turns'])} 轮 (标题: {data['title']})")
-        except Exception as e:
-            print(f"❌ {raw_file} 失败: {e}")
+        manifest['inputs'][raw_file] = [signature[0], signature[1], result['hash']]
+        manifest['outputs'][result['hash']] = md_file
+        if result['status'] == 'converted':
+            print(f"✅ {raw_file} -> {result['turns']} 轮 (标题: {result['title']})")
+
+    if args.workers <= 1:
+        for raw_file, job, signature in iter_pending(data_dir, manifest, args.force):
+            if job is None:
+                counts['unchanged'] += 1
+            else:
+                record(raw_file, signature, convert_raw_file(job))
+    else:
+        # 限制在途任务数量：扫描、解析、写出三者重叠进行，内存占用与目录大小无关
+        max_in_flight = args.workers * 4
+        in_flight = {}
+        with ProcessPoolExecutor(max_workers=args.workers) as pool:
+            for raw_file, job, signature in iter_pending(data_dir, manifest, args.force):
+                if job is None:
+                    counts['unchanged'] += 1
+                    continue
+                in_flight[pool.submit(convert_raw_file, job)] = (raw_file, signature)
+                if len(in_flight) >= max_in_flight:
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        record(*in_flight.pop(future), future.result())
+            for future in list(in_flight):
+                record(*in_flight.pop(future), future.result())
+
+    save_manifest(data_dir, manifest)
+    elapsed = time.perf_counter() - start
+    print(f"📊 转换 {counts['converted']}，未变化跳过 {counts['unchanged']}，失败 {counts['failed']}，"
+          f"耗时 {elapsed:.1f}s")
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+在线切换 docs/ 的目录布局（平铺 <-> 按文件名哈希分片），服务端可以照常运行
+1. 写入新布局到 docs/.layout.json：各进程随即按新布局写入，读取会回退查找旧位置
+2. 逐个把文档移到新位置（与 API 写入共用同一把文件锁；rename 保留 mtime，索引不会重建）
+3. 再扫描一遍处理迁移期间落在旧位置的文档，完成后不再回退查找，并删除空的分片目录
+4. 轮次旁路文件（docs/.turns/）随文档布局迁移；旧版本平铺在 docs/.locks/ 下的锁文件被清理
+中断后用同样的参数重新运行即可继续
+用法: python scripts/reshard.py --to sharded [--to 2x2] [--to flat] | --status
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from server.services.doc_layout import parse_spec
+from server.services.doc_store import DocStore
+from server.services.turn_store import TurnStore
+
+# Configuration
+DOCS_DIR = os.path.join(os.path.dirname(__file__), '../docs')
+# 每移动这么多篇打印一次进度
+PROGRESS_EVERY = 1000
+# 扫描-移动的最多轮数（每轮只处理上一轮期间写到旧位置的文档）
+MAX_PASSES = 5
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Reshard the docs/ directory without downtime")
+    parser.add_argument('--docs-dir', default=DOCS_DIR)
+    parser.add_argument('--to', help="target layout: flat, sharded (2 levels x 1 hex char) or <depth>x<width>")
+    parser.add_argument('--status', action='store_true', help="只显示当前布局和不在正确位置的文档数")
+    parser.add_argument('--throttle', type=float, default=0.0,
+                        help="每移动一篇后暂停的秒数（降低对线上服务的 IO 影响）")
+    return parser.parse_args()
+
+
+def misplaced(store):
+    layout = store.layout
+    return [filename for filename, (path, _) in layout.scan().items() if path != layout.path(filename)]
+
+
+def describe(config):
+    if config["depth"] == 0:
+        return "flat"
+    return f"sharded {config['depth']}x{config['width']}"
+
+
+def show_status(store):
+    config = store.layout.config()
+    documents = len(store.layout.scan())
+    pending = len(misplaced(store))
+    print(f"📁 {store.docs_dir}")
+    print(f"🧭 布局: {describe(config)}，文档 {documents} 篇，待迁移 {pending} 篇")
+    if config["previous"]:
+        print(f"⏳ 迁移未完成，仍回退查找: {', '.join(describe(p) for p in config['previous'])}")
+
+
+def main():
+    args = parse_args()
+    if not os.path.isdir(args.docs_dir):
+        print(f"❌ 目录不存在: {args.docs_dir}")
+        sys.exit(1)
+    store = DocStore(args.docs_dir)
+    if args.status or not args.to:
+        show_status(store)
+        return
+
+    try:
+        spec = parse_spec(args.to)
+    except ValueError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+
+    start = time.perf_counter()
+    config = store.layout.set_layout(spec["depth"], spec["width"])
+    print(f"🧭 新布局: {describe(config)}（此后的写入直接落到新位置）")
+
+    moved = 0
+    for attempt in range(1, MAX_PASSES + 1):
+        pending = misplaced(store)
+        if not pending:
+            break
+        print(f"🚚 第 {attempt} 轮: {len(pending)} 篇待迁移")
+        for filename in pending:
+            try:
+                if store.relocate(filename):
+                    moved += 1
+            except OSError as e:
+                print(f"⚠️  {filename} 迁移失败: {e}")
+            if moved and moved % PROGRESS_EVERY == 0:
+                print(f"   ... 已迁移 {moved} 篇")
+            if args.throttle:
+                time.sleep(args.throttle)
+
+    remaining = misplaced(store)
+    if remaining:
+        print(f"⚠️  仍有 {len(remaining)} 篇不在新位置（可能正被频繁写入），稍后重新运行本脚本")
+        sys.exit(1)
+
+    # 旁路文件可以随时重建，不需要文档锁；迁移期间读取会回退查找旧位置
+    sidecars = TurnStore(args.docs_dir).relocate_all()
+    store.layout.finish_migration()
+    removed_dirs = store.layout.remove_empty_dirs()
+    removed_locks = store.remove_legacy_locks()
+    elapsed = time.perf_counter() - start
+    print(f"✅ 迁移完成: 移动 {moved} 篇、旁路文件 {sidecars} 个，清理空目录 {removed_dirs} 个、"
+          f"旧锁文件 {removed_locks} 个，耗时 {elapsed:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -2,8 +2,15 @@ import sys
 import os
 import datetime
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from server.services.doc_store import DocStore, DocumentConflictError
+from server.services.revisions import RevisionStore
+from server.services.dedup_index import DedupIndex
+
 # Configuration
 DOCS_DIR = os.path.join(os.path.dirname(__file__), '../docs')
+REVISIONS_DIR = os.path.join(os.path.dirname(__file__), '../.insightpipe/revisions')
+DEDUP_DB = os.path.join(os.path.dirname(__file__), '../.insightpipe/dedup.db')
 
 def sanitize_filename(name):
     """Sanitize input to be safe for filenames."""
@@ -31,6 +38,19 @@ def get_multiline_input():
         lines.append(line)
     return "\n".join(lines)
 
+def report_duplicates(filename, content):
+    """Warn when the same (or nearly the same) content is already in the knowledge base"""
+    try:
+        dedup = DedupIndex(DOCS_DIR, DEDUP_DB)
+        duplicates = dedup.check(content, exclude=filename)
+        dedup.close()
+    except Exception:
+        return  # 查重只是提示，失败不影响保存
+    for other in duplicates["exact"]:
+        print(f"⚠️  Same content as: {other}")
+    for other in duplicates["near"]:
+        print(f"⚠️  Nearly identical to: {other['filename']} (distance {other['distance']})")
+
 def main():
     if len(sys.argv) < 2:
         print("Usage: python save.py \"Topic Name\"")
@@ -41,13 +61,16 @@ def main():
     timestamp = datetime.datetime.now().strftime("%Y-%m-%d")
     
     filename = f"{safe_name}.md"
-    filepath = os.path.join(DOCS_DIR, filename)
 
     ensure_docs_dir()
+    # Same storage layer as the API server: atomic writes + per-file locks + revision history
+    store = DocStore(DOCS_DIR, revisions=RevisionStore(REVISIONS_DIR))
+    filepath = store.path(filename)
 
     # Check if file exists to avoid accidental overwrite
-    mode = 'w'
-    if os.path.exists(filepath):
+    # Remember which version was confirmed, so a concurrent edit is not silently clobbered
+    expected_hash = store.hash(filename)
+    if expected_hash is not None:
         print(f"⚠️  File '{filename}' already exists.")
         choice = input("Overwrite? (y/n): ").lower()
         if choice != 'y':
@@ -63,10 +86,17 @@ def main():
 
     # Save content
     # Optional: Prepend Frontmatter or metadata here if desired
-    with open(filepath, mode, encoding='utf-8') as f:
-        f.write(content)
+    try:
+        store.write(filename, content, overwrite=expected_hash is not None, expected_hash=expected_hash)
+    except FileExistsError:
+        print(f"⚠️  '{filename}' was created by someone else in the meantime. File not saved.")
+        sys.exit(1)
+    except DocumentConflictError:
+        print(f"⚠️  '{filename}' was modified by someone else in the meantime. File not saved.")
+        sys.exit(1)
         
     print(f"\n✅ Content saved to: {filepath}")
+    report_duplicates(filename, content)
 
 if __name__ == "__main__":
     main()
@@ -1,12 +1,157 @@
-from fastapi import FastAPI, HTTPException, Body
+from fastapi import FastAPI, HTTPException, Body, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import FileResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
+import asyncio
+import json
+import multiprocessing
 import os
+import re
+import signal
 import sys
-from typing import List, Optional
-from datetime import datetime
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+import contextlib
+from contextlib import asynccontextmanager
 
-app = FastAPI(title="InsightPipe Backend")
+from .services import (
+    GeminiService, GeminiCache, DocIndex, SearchIndex, VectorIndex, ImportJobQueue, TemplateEngine,
+    DocCache, TurnIndex, TurnStore, DocStore, RevisionStore, DedupIndex, ChangeFeed
+)
+from .services.batchexecute import PARSER_VERSION
+from .services.conversation import count_turns, render_turns_document
+from .services.doc_cache import (
+    DEFAULT_MAX_BYTES as DOC_CACHE_BYTES, MIN_COMPRESS_SIZE, choose_encoding, encode_body, etag_matches, etag_to_hash, make_etag,
+    representation_etag
+)
+from .services.doc_store import DocumentConflictError, content_hash
+from .services.doc_archive import SPOOL_MAX_MEMORY, iter_archive_members, iter_tar_gz, iter_zip
+from .services.takeout import iter_export_items, run_import, write_batch
+from .services.change_feed import ChangeLog, sse_stream
+from .services.leader import LeaderLock
+from .services.turn_index import iter_file_range
+from .services.upstream import UpstreamBusyError, UpstreamError
+from .services.insights import ANALYSIS_PROMPT, InsightCache, InsightPipeline, create_backend, is_insight_doc
+from .services.metrics import IMPORT_TURNS, REGISTRY, MetricsMiddleware, MetricsSpool, span
+
+# Configuration
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TEMPLATES_DIR = os.path.join(BASE_DIR, 'templates')
+# 可用环境变量指向别的目录（基准测试用临时语料库）
+DOCS_DIR = os.environ.get("INSIGHTPIPE_DOCS_DIR", os.path.join(BASE_DIR, 'docs'))
+# 本地运行状态（缓存、索引等），可随时删除重建
+STATE_DIR = os.environ.get("INSIGHTPIPE_STATE_DIR", os.path.join(BASE_DIR, '.insightpipe'))
+SAMPLES_DIR = os.path.join(BASE_DIR, 'gemini_data_samples')
+# 生产模式的 worker 进程数（start.sh / python -m server.main 读取；各 worker 据此划分进程内缓存的内存额度）
+WORKERS = max(1, int(os.environ.get("INSIGHTPIPE_WORKERS", "1")))
+# 平滑关闭时等待进行中请求的最长秒数
+GRACEFUL_SHUTDOWN_TIMEOUT = int(os.environ.get("INSIGHTPIPE_GRACEFUL_SHUTDOWN_TIMEOUT", "30"))
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    loop = asyncio.get_running_loop()
+    # Gemini抓取缓存（多个 worker 共用同一个 SQLite）
+    # 解析结果按解析器版本存放，升级解析器后由缓存的原始文本重新解析
+    GeminiService.cache = GeminiCache(os.path.join(STATE_DIR, 'gemini_cache'), parser_version=PARSER_VERSION,
+                                      parse=GeminiService._parse_response)
+    # 变更事件推送给订阅者所在的事件循环；共享日志中的新事件（包括其他 worker 发布的）由后台线程分发
+    change_feed.bind(loop)
+    change_feed.add_listener(_invalidate_remote_changes)
+    change_feed.start()
+    # 收到关闭信号时先结束 SSE 长连接，否则服务器要等到超时才能关闭
+    restore_signals = _close_feed_on_shutdown_signal()
+    # 文档元数据索引由各 worker 共用：只有 leader 在启动时全量对账一次（此时还没挂接回调，
+    # 冷启动的全部文档交给各索引自己的后台同步），之后由 leader 的后台线程跟踪外部修改
+    is_leader = leader.try_acquire()
+    if is_leader:
+        await asyncio.to_thread(doc_index.reconcile)
+    # 全文索引等跟随元数据索引发现的外部变化增量更新
+    doc_index.add_listener(search_index.apply_changes)
+    doc_index.add_listener(vector_index.apply_changes)
+    doc_index.add_listener(doc_cache.apply_changes)
+    doc_index.add_listener(turn_index.apply_changes)
+    doc_index.add_listener(turn_store.apply_changes)
+    doc_index.add_listener(dedup_index.apply_changes)
+    # 磁盘上的外部修改（scripts/save.py、手动编辑）也推送到变更订阅
+    doc_index.add_listener(_publish_disk_changes)
+    metrics_spool.start()
+    # 全局性的后台工作只由一个 worker 负责；它退出后由其他 worker 接管
+    if is_leader:
+        await _start_leader_tasks()
+    else:
+        leader.watch(lambda: asyncio.run_coroutine_threadsafe(_start_leader_tasks(), loop).result())
+    yield
+    change_feed.close()
+    restore_signals()
+    # 先停掉本 worker 作为 leader 的后台工作，最后才释放 leader 锁：
+    # 锁一释放其他 worker 就会接管，并把仍处于 running 状态的任务重新排队
+    leader.stop_watching()
+    await import_jobs.stop()
+    doc_index.stop()
+    await asyncio.to_thread(_join_leader_syncs)
+    leader.release()
+    change_feed.stop()
+    metrics_spool.stop()
+    await _close_insight_pipeline()
+    # 释放Gemini共享连接池
+    await GeminiService.aclose()
+    GeminiService.cache.close()
+    GeminiService.cache = None
+
+async def _start_leader_tasks():
+    """只在 leader 上运行：样本预热、索引全量对账、目录对账线程、后台导入任务"""
+    # 用 batch_validate.py 录制的样本预热Gemini缓存（逐个读取、解析样本，放到线程里做，不阻塞事件循环）
+    await asyncio.to_thread(GeminiService.cache.seed_from_dir, SAMPLES_DIR, GeminiService._parse_response)
+    # 全文/向量/查重索引：后台对账（冷启动时并行重建）
+    _leader_syncs[:] = [
+        search_index.start_background_sync(),
+        vector_index.start_background_sync(),
+        dedup_index.start_background_sync(),
+    ]
+    doc_index.start()
+    # 后台导入任务：恢复上次未完成的任务，并执行各 worker 提交的任务
+    await import_jobs.start()
+
+# leader 启动的索引对账线程；关闭时等它们结束（有上限）再释放 leader 锁
+_leader_syncs: List[threading.Thread] = []
+
+def _join_leader_syncs():
+    deadline = time.monotonic() + GRACEFUL_SHUTDOWN_TIMEOUT
+    for thread in _leader_syncs:
+        thread.join(timeout=max(0.0, deadline - time.monotonic()))
+    _leader_syncs.clear()
+
+def _close_feed_on_shutdown_signal():
+    """
+    在 uvicorn 的 SIGINT/SIGTERM 处理函数之前插入一步：结束所有 SSE 订阅
+    uvicorn 收到信号后会等现有连接结束才执行 lifespan 的关闭逻辑，事件流不主动结束就会拖到超时
+    返回恢复原处理函数的回调
+    """
+    if threading.current_thread() is not threading.main_thread():
+        return lambda: None  # 测试客户端等在其他线程运行 lifespan，无法设置信号处理
+    previous = {}
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        handler = signal.getsignal(sig)
+        if not callable(handler):
+            continue
+
+        def close_then_forward(signum, frame, handler=handler):
+            change_feed.close()
+            handler(signum, frame)
+
+        previous[sig] = handler
+        signal.signal(sig, close_then_forward)
+
+    def restore():
+        for sig, handler in previous.items():
+            signal.signal(sig, handler)
+
+    return restore
+
+app = FastAPI(title="InsightPipe Backend", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -14,34 +159,83 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Total-Count", "X-Last-Event-ID", "ETag", "X-Turn-Count", "X-Turn-Range", "Content-Range"],
 )
-
-# Configuration
-BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-TEMPLATES_DIR = os.path.join(BASE_DIR, 'templates')
-DOCS_DIR = os.path.join(BASE_DIR, 'docs')
+# 最外层：按路由模板统计请求耗时（见 GET /metrics）
+app.add_middleware(MetricsMiddleware)
 
 # Ensure docs directory exists
 if not os.path.exists(DOCS_DIR):
     os.makedirs(DOCS_DIR)
 
+# 所有文档路径解析与写入都经过存储层（原子写入 + 按文件名加锁）
+revision_store = RevisionStore(os.path.join(STATE_DIR, 'revisions'))
+doc_store = DocStore(DOCS_DIR, revisions=revision_store)
+doc_index = DocIndex(DOCS_DIR, os.path.join(STATE_DIR, 'doc_index.db'))
+search_index = SearchIndex(DOCS_DIR, os.path.join(STATE_DIR, 'search_index.db'))
+vector_index = VectorIndex(DOCS_DIR, os.path.join(STATE_DIR, 'vectors'))
+dedup_index = DedupIndex(DOCS_DIR, os.path.join(STATE_DIR, 'dedup.db'))
+# 变更事件经共享日志分发：多 worker 时任一 worker 的订阅者都能收到所有写入，事件 id 全局一致
+change_feed = ChangeFeed(log=ChangeLog(os.path.join(STATE_DIR, 'changes.db')))
+template_engine = TemplateEngine(TEMPLATES_DIR)
+# 进程内缓存：多 worker 时按 worker 数划分内存额度（按 mtime/size 校验，其他 worker 的写入不会读到旧内容）
+doc_cache = DocCache(DOCS_DIR, max_bytes=DOC_CACHE_BYTES // WORKERS)
+turn_store = TurnStore(DOCS_DIR)
+turn_index = TurnIndex(DOCS_DIR, turn_store=turn_store)
+leader = LeaderLock(os.path.join(STATE_DIR, 'leader.lock'))
+metrics_spool = MetricsSpool(os.path.join(STATE_DIR, 'metrics'), REGISTRY)
+
 class PromptRequest(BaseModel):
     user_input: str
     template_name: str = "base_prompt.txt"
+    variables: Dict[str, str] = {}
+
+class PromptBatchRequest(BaseModel):
+    template_name: str = "base_prompt.txt"
+    inputs: List[str] = []
+    items: List[Dict[str, str]] = []
 
 class SaveDocRequest(BaseModel):
     title: str
     content: str
     overwrite: bool = False
+    # Optimistic concurrency: hash (ETag) of the version the client edited; If-Match works too
+    expected_hash: Optional[str] = None
+
+class BatchGetRequest(BaseModel):
+    filenames: List[str]
+
+class BatchSaveRequest(BaseModel):
+    items: List[SaveDocRequest]
 
 class DocMetadata(BaseModel):
     filename: str
     title: str
     created_at: str
+    mtime: float
     size: int
 
+class SemanticSearchRequest(BaseModel):
+    queries: List[str]
+    k: int = 10
+
 class GeminiImportRequest(BaseModel):
     url: str
+    force_refresh: bool = False
+
+class GeminiImportJobRequest(BaseModel):
+    url: Optional[str] = None
+    urls: List[str] = []
+    auto_save: bool = False
+    overwrite: bool = True
+    force_refresh: bool = False
+
+class InsightJobRequest(BaseModel):
+    filenames: List[str] = []
+    # Analyze every document (insight docs themselves are skipped)
+    all: bool = False
+    # Ignore the result cache and re-query the backend
+    refresh: bool = False
 
 class GeminiImportResponse(BaseModel):
     success: bool
@@ -50,13 +244,24 @@ class GeminiImportResponse(BaseModel):
     prompt: str
     filename: str
     turn_count: int
+    # Already-indexed documents with the same or nearly the same content
+    duplicates: Optional[dict] = None
 
-def get_template_content(template_name: str) -> str:
-    template_path = os.path.join(TEMPLATES_DIR, template_name)
-    if not os.path.exists(template_path):
-        raise FileNotFoundError(f"Template '{template_name}' not found.")
-    with open(template_path, 'r', encoding='utf-8') as f:
-        return f.read()
+def cached_response(request: Request, body: bytes, etag: str, encoded=None, headers=None) -> Response:
+    """
+    带ETag的条件响应：If-None-Match 命中返回 304，否则按 Accept-Encoding 压缩
+    encoded(encoding) 可提供已缓存的压缩体，避免重复压缩
+    """
+    encoding = choose_encoding(request.headers.get("accept-encoding")) if len(body) >= MIN_COMPRESS_SIZE else None
+    tag = representation_etag(etag, encoding)
+    # 浏览器每次都带 If-None-Match 重新验证，未变化时只传回 304
+    headers = {**(headers or {}), "ETag": tag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+    if etag_matches(request.headers.get("if-none-match"), tag):
+        return Response(status_code=304, headers=headers)
+    if encoding:
+        body = encoded(encoding) if encoded else encode_body(body, encoding)
+        headers["Content-Encoding"] = encoding
+    return Response(content=body, media_type="application/json", headers=headers)
 
 def sanitize_filename(name: str) -> str:
     keepcharacters = (' ','.','_')
@@ -64,129 +269,581 @@ def sanitize_filename(name: str) -> str:
 
 @app.get("/health")
 def health_check():
-    return {"status": "ok", "version": "0.1.0"}
+    return {"status": "ok", "version": "0.1.0", "worker": os.getpid(), "leader": leader.is_leader,
+            "gemini": GeminiService.upstream_status()}
 
 @app.post("/api/prompt/generate")
 def generate_prompt(request: PromptRequest):
     try:
-        template_content = get_template_content(request.template_name)
-        final_prompt = template_content.replace("{{USER_INPUT}}", request.user_input)
+        values = {**request.variables, "USER_INPUT": request.user_input}
+        final_prompt = template_engine.render(request.template_name, values)
         return {"prompt": final_prompt}
     except FileNotFoundError:
         raise HTTPException(status_code=404, detail=f"Template {request.template_name} not found")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/api/prompt/generate-batch")
+def generate_prompt_batch(request: PromptBatchRequest):
+    """一次渲染多个输入：inputs 填充 {{USER_INPUT}}，items 可填充任意命名占位符"""
+    values_list = [{"USER_INPUT": text} for text in request.inputs] + request.items
+    if not values_list:
+        raise HTTPException(status_code=400, detail="inputs or items required")
+    try:
+        return {"prompts": template_engine.render_many(request.template_name, values_list)}
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail=f"Template {request.template_name} not found")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/prompt/templates")
+def list_templates():
+    try:
+        return {"templates": template_engine.list_templates()}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+def write_document(filename: str, content: str, overwrite: bool,
+                   expected_hash: Optional[str] = None) -> Tuple[str, Optional[dict]]:
+    """
+    原子写入文档并同步各索引，返回 (路径, 与其他文档的重复情况)
+    文件已存在且不允许覆盖时抛出 FileExistsError；expected_hash 不符时抛出 DocumentConflictError
+    """
+    digest = doc_store.write(filename, content, overwrite=overwrite, expected_hash=expected_hash)
+    duplicates = _after_document_saved(filename, _pop_recent_import(digest))
+    return doc_store.path(filename), duplicates
+
+def _after_document_saved(filename: str, parsed: Optional[Tuple[str, list]] = None) -> Optional[dict]:
+    if parsed is not None:
+        # 原样保存的导入结果：轮次旁路文件直接由解析结果生成
+        turn_store.write(filename, *parsed)
+    else:
+        # 其他内容在首次按轮次访问时扫描一遍生成
+        turn_store.remove(filename)
+    duplicates = _sync_indexes(filename)
+    _publish_changes(upserted=[filename], source="api")
+    return duplicates
+
+def _sync_indexes(filename: str) -> Optional[dict]:
+    """文档写入后更新各缓存与索引，返回与其他文档的重复情况"""
+    doc_cache.invalidate(filename)
+    turn_index.invalidate(filename)
+    doc_index.upsert(filename)
+    search_index.index_document(filename)
+    vector_index.upsert(filename)
+    return dedup_index.index_document(filename)
+
+def _after_document_deleted(filename: str):
+    doc_cache.invalidate(filename)
+    turn_index.invalidate(filename)
+    turn_store.remove(filename)
+    doc_index.remove(filename)
+    search_index.remove_document(filename)
+    vector_index.remove(filename)
+    dedup_index.remove_document(filename)
+    _publish_changes(removed=[filename], source="api")
+
+# 最近导入的解析结果（按生成的Markdown的内容哈希），保存时据此生成轮次旁路文件，不必再扫描文本
+RECENT_IMPORTS_MAX = 64
+_recent_imports: "OrderedDict[str, Tuple[str, list]]" = OrderedDict()
+_recent_imports_lock = threading.Lock()
+
+def _remember_import(markdown: str, title: str, turns: list):
+    with _recent_imports_lock:
+        _recent_imports[content_hash(markdown.encode("utf-8"))] = (title, turns)
+        while len(_recent_imports) > RECENT_IMPORTS_MAX:
+            _recent_imports.popitem(last=False)
+
+def _pop_recent_import(digest: str) -> Optional[Tuple[str, list]]:
+    with _recent_imports_lock:
+        return _recent_imports.pop(digest, None)
+
+def _publish_changes(upserted: List[str] = (), removed: List[str] = (), source: str = "api"):
+    """发布元数据增量：upserted 带最新元数据，removed 只有文件名"""
+    docs = [meta for meta in map(doc_index.get, upserted) if meta is not None]
+    change_feed.publish("docs", {
+        "upserted": docs,
+        "removed": list(removed),
+        "source": source,
+        "total": doc_index.count(),
+    })
+
+def _invalidate_remote_changes(event: dict, local: bool):
+    """其他 worker 写入/删除文档后，失效本进程的缓存（本进程的写入已在写入路径上处理）"""
+    if local or event.get("type") != "docs":
+        return
+    for filename in [doc["filename"] for doc in event.get("upserted", [])] + event.get("removed", []):
+        doc_cache.invalidate(filename)
+        turn_index.invalidate(filename)
+
+def _publish_disk_changes(diff: Dict[str, List[str]]):
+    """DocIndex 对账回调：把外部修改转换成变更事件"""
+    _publish_changes(upserted=diff.get("added", []) + diff.get("changed", []),
+                     removed=diff.get("removed", []), source="disk")
+
 @app.post("/api/docs/save")
-def save_document(request: SaveDocRequest):
+def save_document(request: SaveDocRequest, http_request: Request, response: Response):
     try:
         safe_name = sanitize_filename(request.title)
         if not safe_name:
              raise HTTPException(status_code=400, detail="Invalid title provided")
              
         filename = f"{safe_name}.md"
-        filepath = os.path.join(DOCS_DIR, filename)
-        
-        if os.path.exists(filepath) and not request.overwrite:
-            raise HTTPException(status_code=409, detail=f"File '{filename}' already exists.")
-            
-        with open(filepath, 'w', encoding='utf-8') as f:
-            f.write(request.content)
-            
-        return {"message": "Document saved successfully", "path": filepath}
+        expected_hash = request.expected_hash or etag_to_hash(http_request.headers.get("if-match"))
+        filepath, duplicates = write_document(filename, request.content, request.overwrite, expected_hash)
+        doc_hash = content_hash(request.content.encode("utf-8"))
+
+        response.headers["ETag"] = f'"{doc_hash}"'
+        return {"message": "Document saved successfully", "path": filepath, "hash": doc_hash,
+                "duplicates": duplicates}
+    except FileExistsError:
+        raise HTTPException(status_code=409, detail=f"File '{filename}' already exists.")
+    except DocumentConflictError as e:
+        raise HTTPException(status_code=412, detail={
+            "message": f"File '{filename}' was modified by someone else.",
+            "current_hash": e.current_hash,
+        })
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/docs", response_model=List[DocMetadata])
-def list_documents():
-    docs = []
-    try:
-        for filename in os.listdir(DOCS_DIR):
-            if filename.endswith(".md"):
-                filepath = os.path.join(DOCS_DIR, filename)
-                stats = os.stat(filepath)
-                created_at = datetime.fromtimestamp(stats.st_mtime).strftime("%Y-%m-%d %H:%M:%S")
-                
-                # Try to extract a title from the file content if possible, simplistic approach
-                # Or just use filename as title for metadata list
-                title = filename.replace(".md", "")
-                
-                docs.append(DocMetadata(
-                    filename=filename,
-                    title=title,
-                    created_at=created_at,
-                    size=stats.st_size
-                ))
-        # Sort by most recent
-        docs.sort(key=lambda x: x.created_at, reverse=True)
-        return docs
+def list_documents(
+    request: Request,
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    offset: int = Query(0, ge=0),
+    sort: str = Query("mtime", pattern="^(mtime|name|size)$"),
+    order: str = Query("desc", pattern="^(asc|desc)$"),
+    since: Optional[float] = Query(None, description="Unix timestamp; only docs modified after it"),
+):
+    try:
+        # The listing only changes when the index does, so the ETag is derived from
+        # the index version plus the query; a revalidation hit skips the query entirely
+        etag = make_etag(f"{doc_index.version}:{limit}:{offset}:{sort}:{order}:{since}".encode())
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            return cached_response(request, b"", etag)
+
+        # Served from the metadata index; total count goes into a header for pagination
+        docs = doc_index.list(limit=limit, offset=offset, sort=sort,
+                              descending=(order == "desc"), since=since)
+        body = json.dumps(docs, ensure_ascii=False).encode("utf-8")
+        # X-Last-Event-ID lets a client subscribe to /api/docs/events right after this listing without gaps
+        return cached_response(request, body, etag, headers={
+            "X-Total-Count": str(doc_index.count(since=since)),
+            "X-Last-Event-ID": str(change_feed.last_id),
+        })
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/docs/events")
+async def document_events(request: Request, since: Optional[int] = Query(None, description="Last seen event id")):
+    """
+    Server-Sent Events feed of library changes: each `docs` event carries upserted metadata and
+    removed filenames, so clients patch their list instead of re-fetching it. Reconnecting clients
+    resume from Last-Event-ID; a `reset` event means the gap was too large and the list must be reloaded.
+    """
+    header = request.headers.get("last-event-id")
+    last_event_id = int(header) if header and header.isdigit() else since
+    return StreamingResponse(
+        sse_stream(change_feed, last_event_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+MAX_BATCH_ITEMS = 1000
+
+@app.post("/api/docs/batch-get")
+def batch_get_documents(request: BatchGetRequest):
+    """Fetch many documents in one round trip; the cached JSON bodies are stitched together as-is"""
+    if len(request.filenames) > MAX_BATCH_ITEMS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_ITEMS} filenames per request")
+    bodies, hashes, missing = [], {}, []
+    try:
+        for filename in dict.fromkeys(request.filenames):
+            if not doc_store.is_valid_name(filename):
+                missing.append(filename)
+                continue
+            try:
+                entry = doc_cache.get(filename)
+            except FileNotFoundError:
+                missing.append(filename)
+                continue
+            bodies.append(entry.body)
+            hashes[filename] = etag_to_hash(entry.etag)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    body = b"".join([
+        b'{"documents":[', b",".join(bodies), b'],"hashes":',
+        json.dumps(hashes).encode("utf-8"), b',"missing":',
+        json.dumps(missing, ensure_ascii=False).encode("utf-8"), b"}",
+    ])
+    return Response(content=body, media_type="application/json")
+
+@app.post("/api/docs/batch-save")
+def batch_save_documents(request: BatchSaveRequest):
+    """Save many documents; each item gets its own result instead of failing the whole batch"""
+    if len(request.items) > MAX_BATCH_ITEMS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_ITEMS} items per request")
+    results = []
+    for item in request.items:
+        safe_name = sanitize_filename(item.title)
+        if not safe_name:
+            results.append({"title": item.title, "status": "invalid", "detail": "Invalid title provided"})
+            continue
+        filename = f"{safe_name}.md"
+        result = {"title": item.title, "filename": filename}
+        try:
+            _, duplicates = write_document(filename, item.content, item.overwrite, item.expected_hash)
+            result.update(status="saved", hash=content_hash(item.content.encode("utf-8")), duplicates=duplicates)
+        except FileExistsError:
+            result.update(status="exists", detail=f"File '{filename}' already exists.")
+        except DocumentConflictError as e:
+            result.update(status="conflict", current_hash=e.current_hash)
+        except Exception as e:
+            result.update(status="error", detail=str(e))
+        results.append(result)
+    saved = sum(1 for result in results if result["status"] == "saved")
+    return {"saved": saved, "failed": len(results) - saved, "results": results}
+
+@app.get("/api/docs/export")
+def export_documents(format: str = Query("tar", pattern="^(tar|zip)$")):
+    """Stream the whole docs/ store as .tar.gz or .zip, built incrementally while it is sent"""
+    try:
+        filenames = [doc["filename"] for doc in doc_index.list(sort="name", descending=False)]
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    files = ((filename, doc_store.locate(filename)) for filename in filenames)
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+    if format == "zip":
+        stream, media_type, name = iter_zip(files), "application/zip", f"insightpipe-docs-{stamp}.zip"
+    else:
+        stream, media_type, name = iter_tar_gz(files), "application/gzip", f"insightpipe-docs-{stamp}.tar.gz"
+    return StreamingResponse(stream, media_type=media_type,
+                             headers={"Content-Disposition": f'attachment; filename="{name}"'})
+
+def _import_archive(spool, overwrite: bool) -> dict:
+    counts = {"saved": 0, "skipped": 0, "errors": 0}
+    skipped = []
+    for filename, data in iter_archive_members(spool):
+        if not doc_store.is_valid_name(filename):
+            counts["errors"] += 1
+            continue
+        try:
+            write_document(filename, data.decode("utf-8"), overwrite)
+            counts["saved"] += 1
+        except FileExistsError:
+            counts["skipped"] += 1
+            skipped.append(filename)
+        except UnicodeDecodeError:
+            counts["errors"] += 1
+    return {**counts, "skipped_files": skipped[:MAX_BATCH_ITEMS]}
+
+@app.post("/api/docs/import")
+async def import_documents(request: Request, overwrite: bool = Query(False)):
+    """
+    Restore from an archive produced by /api/docs/export (tar, tar.gz or zip) sent as the raw request body.
+    The body is spooled to a temporary file, so memory stays flat however large the archive is.
+    """
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_MEMORY)
+    try:
+        async for chunk in request.stream():
+            spool.write(chunk)
+        return await asyncio.to_thread(_import_archive, spool, overwrite)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        spool.close()
+
+# 导出文件转换用的进程数；服务进程里有多个线程，子进程用 spawn 启动，避免 fork 继承锁状态
+EXPORT_IMPORT_WORKERS = int(os.environ.get("EXPORT_IMPORT_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+def _import_export(spool, overwrite: bool, workers: int) -> dict:
+    def write(docs):
+        counts, saved = write_batch(doc_store, turn_store, docs, overwrite)
+        for doc in saved:
+            _sync_indexes(doc["filename"])
+        # 一批只发布一个变更事件
+        if saved:
+            _publish_changes(upserted=[doc["filename"] for doc in saved], source="import")
+        return counts
+
+    context = multiprocessing.get_context("spawn") if workers > 1 else None
+    # 显式关闭条目生成器：出错时也要在 spool 关闭之前释放它持有的文件包装
+    with contextlib.closing(iter_export_items(spool)) as items:
+        return run_import(items, write, workers=workers, mp_context=context)
+
+@app.post("/api/import/export")
+async def import_conversation_export(
+    request: Request,
+    overwrite: bool = Query(False),
+    workers: int = Query(EXPORT_IMPORT_WORKERS, ge=1, le=32),
+):
+    """
+    Offline bulk import of conversation exports (Takeout zip, JSON array, JSONL; optionally gzipped)
+    sent as the raw request body. The body is spooled to disk and stream-parsed, conversations are
+    converted on a process pool and written to docs/ in batches.
+    """
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_MEMORY)
+    try:
+        async for chunk in request.stream():
+            spool.write(chunk)
+        return await asyncio.to_thread(_import_export, spool, overwrite, workers)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        spool.close()
+
+@app.get("/api/search")
+def search_documents(
+    q: str = Query(..., min_length=1),
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0),
+):
+    try:
+        start = time.perf_counter()
+        results = search_index.search(q, limit=limit, offset=offset)
+        took_ms = round((time.perf_counter() - start) * 1000, 2)
+        return {"query": q, "results": results, "took_ms": took_ms}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/api/semantic-search")
+def semantic_search(request: SemanticSearchRequest):
+    if not request.queries:
+        raise HTTPException(status_code=400, detail="At least one query is required")
+    if not 1 <= request.k <= 100:
+        raise HTTPException(status_code=400, detail="k must be between 1 and 100")
+    try:
+        results = vector_index.search(request.queries, k=request.k)
+        return {"results": [{"query": q, "matches": m} for q, m in zip(request.queries, results)]}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/related/{filename}")
+def related_documents(filename: str, k: int = Query(10, ge=1, le=100)):
+    if not doc_store.is_valid_name(filename):
+        raise HTTPException(status_code=400, detail="Invalid filename")
+    try:
+        return {"filename": filename, "related": vector_index.related(filename, k=k)}
+    except KeyError:
+        raise HTTPException(status_code=404, detail="File not indexed")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/docs/{filename}")
-def get_document(filename: str):
+def get_document(filename: str, request: Request):
     # Basic security check to prevent directory traversal
-    if ".." in filename or "/" in filename or "\\" in filename:
-         raise HTTPException(status_code=400, detail="Invalid filename")
+    if not doc_store.is_valid_name(filename):
+        raise HTTPException(status_code=400, detail="Invalid filename")
     
-    filepath = os.path.join(DOCS_DIR, filename)
-    if not os.path.exists(filepath):
+    try:
+        # Hot documents come from the in-process LRU (revalidated by mtime/size)
+        entry = doc_cache.get(filename)
+    except FileNotFoundError:
         raise HTTPException(status_code=404, detail="File not found")
-        
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
     try:
-        with open(filepath, 'r', encoding='utf-8') as f:
-            content = f.read()
-        return {"filename": filename, "content": content}
+        return cached_response(request, entry.body, entry.etag,
+                               encoded=lambda encoding: doc_cache.encoded(entry, encoding))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.delete("/api/docs/{filename}")
-def delete_document(filename: str):
-    # Basic security check
-    if ".." in filename or "/" in filename or "\\" in filename:
-         raise HTTPException(status_code=400, detail="Invalid filename")
-    
-    filepath = os.path.join(DOCS_DIR, filename)
+TURNS_RE = re.compile(r"^(\d+)(?:-(\d*))?$")
+
+@app.get("/api/docs/{filename}/raw")
+def get_document_raw(
+    filename: str,
+    turns: Optional[str] = Query(None, description="Turn range, e.g. 10-20, 10- or 10 (0 includes the title block)"),
+):
+    """
+    Serve the Markdown file itself without loading it into memory.
+    Whole-file reads go through FileResponse (HTTP Range, zero-copy send where the server supports it);
+    ?turns= streams just the requested turns using the per-document heading offset index.
+    """
+    if not doc_store.is_valid_name(filename):
+        raise HTTPException(status_code=400, detail="Invalid filename")
+
+    filepath = doc_store.locate(filename)
     if not os.path.exists(filepath):
         raise HTTPException(status_code=404, detail="File not found")
-        
+
+    if turns is None:
+        return FileResponse(filepath, media_type="text/markdown; charset=utf-8")
+
+    match = TURNS_RE.match(turns.strip())
+    if not match:
+        raise HTTPException(status_code=400, detail="Invalid turns range")
     try:
-        os.remove(filepath)
-        return {"message": f"File {filename} deleted successfully"}
+        offsets = turn_index.get(filename)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="File not found")
+
+    first = int(match.group(1))
+    last = int(match.group(2)) if match.group(2) else (offsets.turn_count if match.group(2) is not None else first)
+    if last < first or first > offsets.turn_count:
+        raise HTTPException(status_code=416, detail=f"Document has {offsets.turn_count} turns",
+                            headers={"X-Turn-Count": str(offsets.turn_count)})
+
+    last = min(last, offsets.turn_count)
+    start, end = offsets.byte_range(first, last)
+    headers = {
+        "X-Turn-Count": str(offsets.turn_count),
+        "X-Turn-Range": f"{first}-{last}",
+        "Content-Length": str(end - start),
+    }
+    return StreamingResponse(iter_file_range(filepath, start, end),
+                             media_type="text/markdown; charset=utf-8", headers=headers)
+
+TURN_SUMMARY_FIELDS = ("title", "turn_count", "message_count", "user_bytes", "model_bytes", "source")
+
+def _load_turns(filename: str) -> Tuple[dict, List[dict]]:
+    if not doc_store.is_valid_name(filename):
+        raise HTTPException(status_code=400, detail="Invalid filename")
+    try:
+        return turn_store.load(filename)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="File not found")
+
+@app.get("/api/docs/{filename}/turns")
+def list_document_turns(filename: str, role: Optional[str] = Query(None, pattern="^(user|model)$")):
+    """
+    Per-message layout (turn, role, byte offset, length) from the structured turn sidecar;
+    the Markdown itself is not read
+    """
+    header, records = _load_turns(filename)
+    if role is not None:
+        records = [record for record in records if record["role"] == role]
+    return {"filename": filename, **{key: header[key] for key in TURN_SUMMARY_FIELDS}, "messages": records}
+
+@app.get("/api/docs/{filename}/turns/{turn}")
+def get_document_turn(filename: str, turn: int, role: Optional[str] = Query(None, pattern="^(user|model)$")):
+    """Text of one turn (optionally one role); only that turn's bytes are read from the document"""
+    header, records = _load_turns(filename)
+    if turn < 1 or turn > header["turn_count"]:
+        raise HTTPException(status_code=404, detail=f"Document has {header['turn_count']} turns",
+                            headers={"X-Turn-Count": str(header["turn_count"])})
+    selected = [record for record in records
+                if record["turn"] == turn and (role is None or record["role"] == role)]
+    try:
+        messages = turn_store.read_texts(filename, selected)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="File not found")
+    return {"filename": filename, "turn": turn, "turn_count": header["turn_count"], "messages": messages}
+
+@app.get("/api/turns/stats")
+def get_turn_stats():
+    """Corpus-wide turn statistics from the sidecar summaries (one short line per document)"""
+    try:
+        filenames = [doc["filename"] for doc in doc_index.list()]
+        return turn_store.stats(filenames)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-def get_analysis_prompt() -> str:
-    """返回标准的对话分析Prompt模板"""
-    return """你是一个专业的对话分析师。我上传了一段Gemini对话记录。
-
-**任务**：提取这段对话中的核心洞察（Insights）。
+@app.get("/api/docs/{filename}/revisions")
+def list_document_revisions(filename: str):
+    if not doc_store.is_valid_name(filename):
+        raise HTTPException(status_code=400, detail="Invalid filename")
+    try:
+        revisions = revision_store.list(filename)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    if not revisions:
+        raise HTTPException(status_code=404, detail="No revisions for this file")
+    return {"filename": filename, "revisions": revisions}
 
-**输出格式**：
-## 对话概览
-- 主题：[一句话概括]
-- 核心问题：[用户想解决什么]
+@app.get("/api/docs/{filename}/revisions/{rev}")
+def get_document_revision(filename: str, rev: int):
+    if not doc_store.is_valid_name(filename):
+        raise HTTPException(status_code=400, detail="Invalid filename")
+    try:
+        revision = revision_store.get(filename, rev)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    if revision is None:
+        raise HTTPException(status_code=404, detail="Revision not found")
+    return revision
 
-## 关键洞察（3-5条）
-1. [洞察标题]
-   - 证据：[AI给出的数据/案例]
-   - 启发：[可迁移的思维模式]
+@app.get("/api/docs/{filename}/diff")
+def diff_document_revisions(
+    filename: str,
+    from_rev: int = Query(..., alias="from", ge=1),
+    to_rev: Optional[int] = Query(None, alias="to", ge=1, description="Defaults to the latest revision"),
+    context: int = Query(3, ge=0, le=100),
+):
+    if not doc_store.is_valid_name(filename):
+        raise HTTPException(status_code=400, detail="Invalid filename")
+    try:
+        if to_rev is None:
+            latest = revision_store.list(filename)
+            to_rev = latest[0]["rev"] if latest else from_rev
+        diff = revision_store.diff(filename, from_rev, to_rev, context=context)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    if diff is None:
+        raise HTTPException(status_code=404, detail="Revision not found")
+    return {"filename": filename, "from": from_rev, "to": to_rev, "diff": diff}
 
-2. [洞察标题]
-   - 证据：[具体支撑]
-   - 启发：[实际应用]
+@app.delete("/api/docs/{filename}")
+def delete_document(filename: str, request: Request):
+    # Basic security check
+    if not doc_store.is_valid_name(filename):
+        raise HTTPException(status_code=400, detail="Invalid filename")
+    
+    try:
+        doc_store.delete(filename, expected_hash=etag_to_hash(request.headers.get("if-match")))
+        _after_document_deleted(filename)
+        return {"message": f"File {filename} deleted successfully"}
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="File not found")
+    except DocumentConflictError as e:
+        raise HTTPException(status_code=412, detail={
+            "message": f"File '{filename}' was modified by someone else.",
+            "current_hash": e.current_hash,
+        })
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
-## 可执行建议
-[如果有具体行动计划，在此总结]
+def get_analysis_prompt() -> str:
+    """返回标准的对话分析Prompt模板（批量洞察分析使用同一份）"""
+    return ANALYSIS_PROMPT
 
-**注意**：
-- 忽略客套话和重复内容
-- 优先提取有数据支撑的结论
-- 关注"为什么"而不仅是"是什么"
-- 如果涉及敏感话题，客观总结事实部分即可
-"""
+def build_import_response(share_id: str, result: dict) -> GeminiImportResponse:
+    """把抓取解析结果整理成导入响应（标题、完整Markdown、文件名、轮数）"""
+    # 处理标题（确保是字符串）
+    title = result.get('title', 'Gemini对话记录')
+    if isinstance(title, list):
+        title = str(title[1]) if len(title) > 1 else str(title[0])
+    
+    # 轮数直接取自解析结果（与轮次索引、旁路文件的划分规则一致）
+    turns = result.get('turns') or []
+    turn_count = count_turns(turns)
+    IMPORT_TURNS.observe(turn_count)
+    
+    # 生成完整的Markdown内容
+    with span("render"):
+        md_content = render_turns_document(title, turns, turn_count)
+    _remember_import(md_content, title, turns)
+    
+    # 生成安全的文件名
+    safe_title = sanitize_filename(title)[:30]
+    filename = f"{share_id}_{safe_title}.md"
+    
+    return GeminiImportResponse(
+        success=True,
+        title=title,
+        markdown=md_content,
+        prompt=get_analysis_prompt(),
+        filename=filename,
+        turn_count=turn_count
+    )
 
 @app.post("/api/import/gemini", response_model=GeminiImportResponse)
 async def import_gemini_conversation(request: GeminiImportRequest):
@@ -195,53 +852,221 @@ async def import_gemini_conversation(request: GeminiImportRequest):
     返回解析后的Markdown内容和推荐的分析Prompt
     """
     try:
-        # 导入GeminiService
-        from .services import GeminiService
-        
         # 提取share ID
         share_id = GeminiService.extract_id(request.url)
         if not share_id:
             raise HTTPException(status_code=400, detail="无效的Gemini分享链接")
         
-        # 获取对话数据
-        result = GeminiService.fetch_conversation(request.url)
-        
-        # 处理标题（确保是字符串）
-        title = result.get('title', 'Gemini对话记录')
-        if isinstance(title, list):
-            title = str(title[1]) if len(title) > 1 else str(title[0])
-        
-        # 计算轮数
-        turn_count = result['content'].count('## 🙋‍♂️ User')
-        
-        # 生成完整的Markdown内容
-        md_content = f"""# {title}
-
-*共 {turn_count} 轮对话*
----
-
-{result['content']}
-"""
-        
-        # 生成安全的文件名
-        safe_title = sanitize_filename(title)[:30]
-        filename = f"{share_id}_{safe_title}.md"
-        
-        return GeminiImportResponse(
-            success=True,
-            title=title,
-            markdown=md_content,
-            prompt=get_analysis_prompt(),
-            filename=filename,
-            turn_count=turn_count
+        # 获取对话数据（异步，走共享连接池，不阻塞其他请求）
+        result = await GeminiService.fetch_conversation_async(
+            request.url, force_refresh=request.force_refresh
         )
+        response = build_import_response(share_id, result)
+        # 提示是否已导入过（标题变化、文件名不同也能发现）
+        response.duplicates = await asyncio.to_thread(dedup_index.check, response.markdown)
+        return response
         
     except HTTPException:
         raise
+    except UpstreamError as e:
+        # 上游保护：排队已满 -> 429，熔断打开 -> 503；都带 Retry-After，客户端据此退避
+        raise HTTPException(
+            status_code=429 if isinstance(e, UpstreamBusyError) else 503,
+            detail=f"导入失败: {str(e)}",
+            headers={"Retry-After": str(e.retry_after)},
+        )
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"导入失败: {str(e)}")
 
+# 后台任务遇到熔断/排队已满时按 Retry-After 等待后重试的次数（交互式请求则直接失败）
+JOB_UPSTREAM_RETRIES = 5
+
+async def fetch_for_job(url: str, force_refresh: bool, report) -> dict:
+    for attempt in range(JOB_UPSTREAM_RETRIES + 1):
+        try:
+            return await GeminiService.fetch_conversation_async(url, force_refresh=force_refresh)
+        except UpstreamError as e:
+            if attempt == JOB_UPSTREAM_RETRIES:
+                raise
+            report("waiting_upstream", 0.1)
+            await asyncio.sleep(e.retry_after)
+
+async def run_import_job(job: dict, report) -> dict:
+    """后台任务：抓取 + 解析 +（可选）保存到 docs/"""
+    options = job["payload"]
+    share_id = GeminiService.extract_id(options["url"])
+    if not share_id:
+        raise ValueError("无效的Gemini分享链接")
+
+    report("fetching", 0.1)
+    result = await fetch_for_job(options["url"], options.get("force_refresh", False), report)
+    report("rendering", 0.6)
+    response = build_import_response(share_id, result)
+
+    saved_path = None
+    if options.get("auto_save"):
+        report("saving", 0.8)
+        try:
+            saved_path, duplicates = await asyncio.to_thread(
+                write_document, response.filename, response.markdown, options.get("overwrite", True)
+            )
+        except FileExistsError:
+            raise ValueError(f"File '{response.filename}' already exists.")
+    else:
+        duplicates = await asyncio.to_thread(dedup_index.check, response.markdown)
+
+    return {
+        "title": response.title,
+        "filename": response.filename,
+        "turn_count": response.turn_count,
+        "saved": saved_path is not None,
+        "path": saved_path,
+        "duplicates": duplicates,
+    }
+
+async def run_job(job: dict, report) -> dict:
+    """后台任务按类型分发：gemini 导入 / insights 洞察分析"""
+    if job["kind"] == "insights":
+        return await run_insight_job(job, report)
+    return await run_import_job(job, report)
+
+import_jobs = ImportJobQueue(
+    os.path.join(STATE_DIR, 'import_jobs.db'),
+    run_job,
+    workers=int(os.environ.get("IMPORT_JOB_WORKERS", "4")),
+)
+
+@app.post("/api/import/gemini/jobs")
+def submit_import_jobs(request: GeminiImportJobRequest):
+    """提交一个或一批导入任务，立即返回任务ID"""
+    urls = ([request.url] if request.url else []) + request.urls
+    if not urls:
+        raise HTTPException(status_code=400, detail="至少需要一个Gemini分享链接")
+    invalid = [url for url in urls if not GeminiService.extract_id(url)]
+    if invalid:
+        raise HTTPException(status_code=400, detail=f"无效的Gemini分享链接: {', '.join(invalid)}")
+
+    options = {
+        "auto_save": request.auto_save,
+        "overwrite": request.overwrite,
+        "force_refresh": request.force_refresh,
+    }
+    return import_jobs.submit("gemini", [{"url": url, **options} for url in urls])
+
+@app.get("/api/duplicates")
+def list_duplicates(
+    min_size: int = Query(2, ge=2),
+    near: bool = Query(True, description="Also group near-duplicates (SimHash)"),
+    turns: bool = Query(False, description="Also list conversation turns shared by several documents"),
+    limit: int = Query(100, ge=1, le=1000),
+):
+    try:
+        clusters = dedup_index.clusters(min_size=min_size, include_near=near)
+        result = {"clusters": clusters[:limit], "total": len(clusters)}
+        if turns:
+            result["shared_turns"] = dedup_index.shared_turns(limit=limit)
+        return result
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/import/jobs")
+def list_import_jobs(
+    batch_id: Optional[str] = None,
+    status: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=1000),
+):
+    return {"jobs": import_jobs.list(batch_id=batch_id, status=status, limit=limit),
+            "counts": import_jobs.counts()}
+
+@app.get("/api/import/jobs/{job_id}")
+def get_import_job(job_id: str):
+    job = import_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+# 洞察分析流水线：后端由环境变量配置（见 services/insights.create_backend），首次使用时创建
+_insight_pipeline: Optional[InsightPipeline] = None
+_insight_pipeline_lock = threading.Lock()
+
+def get_insight_pipeline() -> InsightPipeline:
+    """未配置分析后端时抛出 ValueError"""
+    global _insight_pipeline
+    with _insight_pipeline_lock:
+        if _insight_pipeline is None:
+            _insight_pipeline = InsightPipeline(
+                create_backend(),
+                InsightCache(os.path.join(STATE_DIR, 'insights.db')),
+                read=doc_store.read,
+                save=lambda filename, content: write_document(filename, content, overwrite=True),
+            )
+        return _insight_pipeline
+
+async def _close_insight_pipeline():
+    global _insight_pipeline
+    if _insight_pipeline is not None:
+        await _insight_pipeline.backend.aclose()
+        _insight_pipeline.cache.close()
+        _insight_pipeline = None
+
+async def run_insight_job(job: dict, report) -> dict:
+    """后台任务：分析一批文档，结果保存为洞察文档（<原文件名>.insights.md）"""
+    options = job["payload"]
+    pipeline = get_insight_pipeline()
+    filenames = options.get("filenames")
+    if filenames is None:
+        filenames = [doc["filename"] for doc in doc_index.list(sort="name", descending=False)]
+
+    report("analyzing", 0.0)
+    return await pipeline.run(
+        filenames,
+        refresh=options.get("refresh", False),
+        progress=lambda done, total: report("analyzing", done / total),
+    )
+
+@app.post("/api/insights/jobs")
+def submit_insight_job(request: InsightJobRequest):
+    """Queue a batch insight analysis; returns the job id (poll /api/import/jobs/{id})"""
+    if not request.all and not request.filenames:
+        raise HTTPException(status_code=400, detail="Provide filenames or set all=true")
+    invalid = [name for name in request.filenames if not doc_store.is_valid_name(name)]
+    if invalid:
+        raise HTTPException(status_code=400, detail=f"Invalid filename: {', '.join(invalid)}")
+    try:
+        get_insight_pipeline()
+    except ValueError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+    payload = {
+        # None：执行时再列出全部文档（包括提交之后新增的）
+        "filenames": None if request.all else request.filenames,
+        "refresh": request.refresh,
+    }
+    return import_jobs.submit("insights", [payload])
+
+@app.get("/api/docs/{filename}/insights")
+def get_document_insights(filename: str):
+    """Linked insight doc of a document and whether it matches the current content"""
+    if not doc_store.is_valid_name(filename) or is_insight_doc(filename):
+        raise HTTPException(status_code=400, detail="Invalid filename")
+    try:
+        pipeline = get_insight_pipeline()
+    except ValueError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    try:
+        return pipeline.status(filename)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="File not found")
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    """Prometheus text exposition format (version 0.0.4)"""
+    # 多 worker 时汇总所有存活 worker 的数据
+    return PlainTextResponse(metrics_spool.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 
 if __name__ == "__main__":
+    # python -m server.main；INSIGHTPIPE_WORKERS=N 时以多进程模式运行
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8817)
+    uvicorn.run("server.main:app" if WORKERS > 1 else app, host="0.0.0.0", port=8817,
+                workers=WORKERS, timeout_graceful_shutdown=GRACEFUL_SHUTDOWN_TIMEOUT)
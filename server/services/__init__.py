@@ -1,3 +1,17 @@
 from .gemini_service import GeminiService
+from .gemini_cache import GeminiCache
+from .doc_index import DocIndex
+from .search_index import SearchIndex
+from .vector_index import VectorIndex
+from .import_jobs import ImportJobQueue
+from .prompt_templates import TemplateEngine
+from .doc_cache import DocCache
+from .turn_index import TurnIndex
+from .turn_store import TurnStore
+from .doc_store import DocStore
+from .doc_layout import DocLayout
+from .revisions import RevisionStore
+from .dedup_index import DedupIndex
+from .change_feed import ChangeFeed
 
-__all__ = ['GeminiService']
+__all__ = ['GeminiService', 'GeminiCache', 'DocIndex', 'SearchIndex', 'VectorIndex', 'ImportJobQueue', 'TemplateEngine', 'DocCache', 'TurnIndex', 'TurnStore', 'DocStore', 'DocLayout', 'RevisionStore', 'DedupIndex', 'ChangeFeed']
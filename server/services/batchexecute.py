@@ -0,0 +1,345 @@
+"""
+batchexecute (rt=c) 响应的流式单遍解析器，服务端与 scripts/ 共用
+
+响应格式:
+    )]}'
+    <长度>
+    [["wrb.fr","ujx1Bf","<内层JSON字符串>",...]]
+    <长度>
+    [["di",...],["af.httprm",...]]
+
+- iter_frames / find_payload 按长度头逐帧消费输入行，只保留最后一个 wrb.fr 帧
+- parse_payload 只解码外层一次拿到内层字符串，之后在内层字符串上逐项 raw_decode，
+  对话轮次通过 Conversation.iter_turns() 惰性产出，不构建整棵嵌套树
+"""
+import json
+import re
+from typing import AsyncIterable, AsyncIterator, Iterable, Iterator, List, Optional
+
+from .conversation import DEFAULT_TITLE
+from .metrics import span
+
+# 解析逻辑有实质变化时递增，离线转换的 manifest 会据此整体失效
+PARSER_VERSION = 3
+XSSI_PREFIX = ")]}'"
+PAYLOAD_RE = re.compile(r'(\[\["wrb\.fr".*)$', re.S)
+
+_decoder = json.JSONDecoder()
+_WS = " \t\n\r"
+
+
+class PayloadNotFoundError(ValueError):
+    """响应中没有 wrb.fr 数据帧"""
+
+
+def iter_lines(chunks: Iterable[str]) -> Iterator[str]:
+    """
+    把文本块流切成行，只按 '\n' 切分
+    （httpx/requests 的按行迭代会按 str.splitlines 在 U+2028 等字符处断开，会切坏数据帧）
+    """
+    buffer: List[str] = []
+    for chunk in chunks:
+        lines = _split_chunk(chunk, buffer)
+        if lines is not None:
+            yield from lines
+    if buffer:
+        yield "".join(buffer)
+
+
+async def aiter_lines(chunks: AsyncIterable[str]) -> AsyncIterator[str]:
+    """iter_lines 的异步版本，用于 httpx 的 aiter_text()"""
+    buffer: List[str] = []
+    async for chunk in chunks:
+        lines = _split_chunk(chunk, buffer)
+        if lines is not None:
+            for line in lines:
+                yield line
+    if buffer:
+        yield "".join(buffer)
+
+
+def _split_chunk(chunk: str, buffer: List[str]) -> Optional[List[str]]:
+    """
+    把一个文本块并入行缓冲：没有换行时只追加（避免对超长数据帧反复拼接/扫描），
+    有换行时返回完整的行，并把末尾不完整的部分留在缓冲里
+    """
+    if "\n" not in chunk:
+        buffer.append(chunk)
+        return None
+    head, *rest = chunk.split("\n")
+    buffer.append(head)
+    lines = ["".join(buffer)]
+    lines.extend(rest[:-1])
+    buffer.clear()
+    if rest[-1]:
+        buffer.append(rest[-1])
+    return lines
+
+
+def _is_length_header(line: str) -> bool:
+    return line.isdigit()
+
+
+def iter_frames(lines: Iterable[str]) -> Iterator[str]:
+    """把响应行切分成帧：每帧以一行长度头开始，到下一个长度头（或结尾）为止"""
+    frame: List[str] = []
+    for line in lines:
+        line = line.rstrip("\r\n")
+        if _is_length_header(line):
+            if frame:
+                yield "\n".join(frame)
+            frame = []
+        elif line and line != XSSI_PREFIX:
+            frame.append(line)
+    if frame:
+        yield "\n".join(frame)
+
+
+def _select_payload(frame: str) -> Optional[str]:
+    if 'wrb.fr' not in frame:
+        return None
+    match = PAYLOAD_RE.search(frame)
+    return match.group(1) if match else None
+
+
+def find_payload(lines: Iterable[str]) -> str:
+    """返回最后一个 wrb.fr 帧（通常包含最全的历史），只在内存中保留这一帧"""
+    payload = None
+    for frame in iter_frames(lines):
+        candidate = _select_payload(frame)
+        if candidate is not None:
+            payload = candidate
+    if payload is None:
+        raise PayloadNotFoundError("Could not find data payload in response")
+    return payload
+
+
+async def afind_payload(lines: AsyncIterable[str]) -> str:
+    """find_payload 的异步版本，直接消费 HTTP 响应流（配合 aiter_lines(resp.aiter_text())）"""
+    payload = None
+    frame: List[str] = []
+    async for line in lines:
+        line = line.rstrip("\r\n")
+        if _is_length_header(line):
+            candidate = _select_payload("\n".join(frame)) if frame else None
+            if candidate is not None:
+                payload = candidate
+            frame = []
+        elif line and line != XSSI_PREFIX:
+            frame.append(line)
+    if frame:
+        candidate = _select_payload("\n".join(frame))
+        if candidate is not None:
+            payload = candidate
+    if payload is None:
+        raise PayloadNotFoundError("Could not find data payload in response")
+    return payload
+
+
+def wrap_payload(payload: str) -> str:
+    """把单个数据帧重新包装成最小的 rt=c 响应（缓存原始响应时使用）"""
+    return "".join(wrap_payload_parts(payload))
+
+
+def wrap_payload_parts(payload: str) -> List[str]:
+    """wrap_payload 的分段形式：逐段写入文件时不必先拼出整个响应的副本"""
+    return [f"{XSSI_PREFIX}\n\n{len(payload)}\n", payload, "\n"]
+
+
+# ---- 内层JSON的惰性导航 ----
+
+def _skip_ws(s: str, i: int) -> int:
+    while i < len(s) and s[i] in _WS:
+        i += 1
+    return i
+
+
+def _enter_array(s: str, i: int) -> int:
+    i = _skip_ws(s, i)
+    if i >= len(s) or s[i] != '[':
+        raise ValueError(f"Expected array at offset {i}")
+    return _skip_ws(s, i + 1)
+
+
+def _next_element(s: str, i: int) -> Optional[int]:
+    """值结束后：遇到 ',' 返回下一个元素的位置，遇到 ']' 返回 None"""
+    i = _skip_ws(s, i)
+    if i < len(s) and s[i] == ',':
+        return _skip_ws(s, i + 1)
+    return None
+
+
+def _skip_array(s: str, i: int) -> int:
+    """跳过一个数组，返回其后的位置（逐元素解码后立即丢弃）"""
+    i = _enter_array(s, i)
+    if s[i] == ']':
+        return i + 1
+    while True:
+        _, end = _decoder.raw_decode(s, i)
+        nxt = _next_element(s, end)
+        if nxt is None:
+            return _skip_ws(s, end) + 1
+        i = nxt
+
+
+def _decode_title(s: str, after_conv: int, default_title: str) -> str:
+    """标题节点 inner[0][2] 紧跟在对话列表之后"""
+    try:
+        title_start = _next_element(s, after_conv)
+        if title_start is None:
+            return default_title
+        title_node, _ = _decoder.raw_decode(s, title_start)
+        if isinstance(title_node, list) and len(title_node) > 1:
+            return str(title_node[1])
+        return str(title_node)
+    except ValueError:
+        return default_title
+
+
+def extract_turn(item) -> Optional[dict]:
+    """从对话列表的单个元素中提取 {user, model}，两者都没有时返回None"""
+    if not isinstance(item, list) or len(item) < 4:
+        return None
+
+    user_text = None
+    model_text = None
+
+    # 提取User内容: item[2][0][0]
+    try:
+        user_text = item[2][0][0]
+    except (IndexError, KeyError, TypeError):
+        pass
+
+    # 提取Model内容 - 尝试多种路径
+    try:
+        candidates = item[3]
+        if isinstance(candidates, list) and len(candidates) > 0:
+            first_node = candidates[0]
+            if isinstance(first_node, list) and len(first_node) > 0:
+                # 尝试路径 A: item[3][0][0][1][0]
+                content_node = first_node[0]
+                if isinstance(content_node, list) and len(content_node) > 1 and isinstance(content_node[1], list):
+                    model_text = content_node[1][0]
+                # 尝试路径 B: item[3][0][1][0]
+                elif len(first_node) > 1 and isinstance(first_node[1], list):
+                    model_text = first_node[1][0]
+    except (IndexError, KeyError, TypeError):
+        pass
+
+    if user_text or model_text:
+        return {'user': user_text, 'model': model_text}
+    return None
+
+
+class Conversation:
+    """
+    解析后的对话：轮次按需从内层JSON字符串中逐个解码；
+    标题位于对话列表之后，先遍历轮次再取标题时无需再扫一遍
+    """
+
+    def __init__(self, inner: str, conv_start: int, default_title: str = DEFAULT_TITLE):
+        self._inner = inner
+        self._conv_start = conv_start
+        self._conv_end: Optional[int] = None
+        self._default_title = default_title
+        self._title: Optional[str] = None
+
+    @property
+    def title(self) -> str:
+        if self._title is None:
+            end = self._conv_end
+            if end is None:
+                end = _skip_array(self._inner, self._conv_start)
+            self._title = _decode_title(self._inner, end, self._default_title)
+        return self._title
+
+    def iter_turns(self) -> Iterator[dict]:
+        s = self._inner
+        i = _enter_array(s, self._conv_start)
+        if s[i] == ']':
+            self._conv_end = i + 1
+            return
+        while True:
+            item, end = _decoder.raw_decode(s, i)
+            turn = extract_turn(item)
+            if turn is not None:
+                yield turn
+            nxt = _next_element(s, end)
+            if nxt is None:
+                self._conv_end = _skip_ws(s, end) + 1
+                return
+            i = nxt
+
+    def to_dict(self) -> dict:
+        """
+        {'title', 'turns'}；正文 Markdown 不在这里生成（需要时用 conversation.render_turns），
+        否则结果里会同时有轮次和正文两份完整内容
+        """
+        with span("parse.turns"):
+            turns = list(self.iter_turns())
+            title = self.title
+        return {
+            "title": title,
+            "turns": turns,
+        }
+
+
+def parse_payload(payload: str, default_title: str = DEFAULT_TITLE) -> Conversation:
+    """
+    解码 wrb.fr 帧：外层只解码一次取出内层字符串，
+    再定位对话列表 inner[0][1] 的起点；对话列表与标题都留待惰性解码
+    """
+    with span("parse.decode"):
+        return _parse_payload(payload, default_title)
+
+
+def _parse_payload(payload: str, default_title: str) -> Conversation:
+    try:
+        outer = json.loads(payload)
+        inner = outer[0][2]
+        del outer
+    except json.JSONDecodeError as e:
+        raise ValueError(f"Failed to decode JSON response: {str(e)}")
+    except (IndexError, KeyError, TypeError):
+        raise ValueError("Parsing error: unexpected payload frame layout")
+    if not isinstance(inner, str):
+        raise ValueError("Parsing error: payload frame carries no conversation data")
+
+    try:
+        # inner = [[<0>, <对话列表>, <标题节点>, ...], ...]
+        i = _enter_array(inner, 0)
+        i = _enter_array(inner, i)
+        _, i = _decoder.raw_decode(inner, i)
+        conv_start = _next_element(inner, i)
+        if conv_start is None or inner[conv_start:conv_start + 1] != '[':
+            raise ValueError("conversation list not found")
+    except json.JSONDecodeError as e:
+        raise ValueError(f"Failed to decode JSON response: {str(e)}")
+    except ValueError as e:
+        raise ValueError(f"Parsing error: {str(e)}")
+
+    return Conversation(inner, conv_start, default_title)
+
+
+def parse_lines(lines: Iterable[str], default_title: str = DEFAULT_TITLE) -> Conversation:
+    """从任意行迭代器（文件对象、HTTP流）解析对话"""
+    with span("parse.frames"):
+        payload = find_payload(lines)
+    return parse_payload(payload, default_title)
+
+
+def parse_text(raw_text: str, default_title: str = DEFAULT_TITLE) -> Conversation:
+    """从完整响应文本解析对话（按行迭代，不再整体 split 出行列表）"""
+    return parse_lines(_iter_text_lines(raw_text), default_title)
+
+
+def _iter_text_lines(text: str) -> Iterator[str]:
+    """逐行切片（只按 '\n'），不像 StringIO 那样先复制整个文本"""
+    start = 0
+    while True:
+        end = text.find("\n", start)
+        if end == -1:
+            yield text[start:]
+            return
+        yield text[start:end]
+        start = end + 1
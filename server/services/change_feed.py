@@ -0,0 +1,318 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from typing import AsyncIterator, Callable, List, Optional, Set, Tuple
+
+# 每个订阅者最多积压的事件数，超过说明客户端太慢，让它重新拉取全量列表
+SUBSCRIBER_QUEUE_SIZE = 1000
+# 没有事件时定期发送注释行，防止代理断开空闲连接
+HEARTBEAT_INTERVAL = 15.0
+# 共享日志模式下轮询新事件的间隔（本进程发布的事件会立即唤醒轮询，不受此限制）
+POLL_INTERVAL = 0.2
+# 每追加这么多条事件清理一次超出保留条数的旧事件
+TRIM_EVERY = 100
+
+# 关闭订阅的哨兵（服务关闭时结束所有 SSE 流）
+_CLOSED = object()
+
+# 事件监听回调：(事件, 是否由本进程发布)
+EventListener = Callable[[dict, bool], None]
+
+
+class ChangeLog:
+    """
+    跨进程共享的变更日志（SQLite WAL），多 worker 部署时由 ChangeFeed 使用
+    - 各进程把事件追加到同一个文件，事件 id 就是日志序号，在所有 worker 之间一致，
+      客户端断线后重连到任意 worker 都能按 Last-Event-ID 补发
+    - 只保留最近 retention 条
+    """
+
+    def __init__(self, db_path: str, retention: int = 10000):
+        self.db_path = db_path
+        self.retention = retention
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._db = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        # AUTOINCREMENT：清理旧事件后序号也不会被复用
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS events (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                type TEXT NOT NULL,
+                origin INTEGER NOT NULL,
+                ts REAL NOT NULL,
+                data TEXT NOT NULL
+            )
+        """)
+        self._db.commit()
+
+    def append(self, event_type: str, data: dict, origin: int) -> dict:
+        ts = time.time()
+        payload = json.dumps(data, ensure_ascii=False)
+        with self._lock:
+            cursor = self._db.execute(
+                "INSERT INTO events (type, origin, ts, data) VALUES (?, ?, ?, ?)", (event_type, origin, ts, payload)
+            )
+            event_id = cursor.lastrowid
+            if event_id % TRIM_EVERY == 0:
+                self._db.execute("DELETE FROM events WHERE id <= ?", (event_id - self.retention,))
+            self._db.commit()
+        return {"id": event_id, "type": event_type, "ts": ts, **data}
+
+    def read(self, after_id: int, until_id: Optional[int] = None, limit: int = 1000) -> List[Tuple[dict, int]]:
+        """after_id 之后的事件（按 id 升序），返回 [(事件, 发布进程的 pid)]"""
+        sql = "SELECT id, type, origin, ts, data FROM events WHERE id > ?"
+        params: tuple = (after_id,)
+        if until_id is not None:
+            sql += " AND id <= ?"
+            params += (until_id,)
+        with self._lock:
+            rows = self._db.execute(sql + " ORDER BY id LIMIT ?", params + (limit,)).fetchall()
+        return [({"id": event_id, "type": event_type, "ts": ts, **json.loads(data)}, origin)
+                for event_id, event_type, origin, ts, data in rows]
+
+    def last_id(self) -> int:
+        """分配过的最大序号（包括已清理的事件）"""
+        with self._lock:
+            row = self._db.execute("SELECT seq FROM sqlite_sequence WHERE name = 'events'").fetchone()
+        return row[0] if row else 0
+
+    def oldest_id(self) -> Optional[int]:
+        with self._lock:
+            row = self._db.execute("SELECT MIN(id) FROM events").fetchone()
+        return row[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+class ChangeFeed:
+    """
+    文档库变更事件的发布/订阅（供 SSE 端点使用）
+    - 发布方可以在任意线程（同步端点的线程池、DocIndex 的对账线程）
+    - 事件带单调递增的 id，断线重连时按 Last-Event-ID 补发；缺口太大时发送 reset 让客户端重新拉取列表
+    - 不带 log 时事件只在本进程内分发，最近 history 条保存在内存环形缓冲区中
+    - 带 ChangeLog 时事件写入共享日志，由后台线程轮询后分发给本进程的订阅者和监听者，
+      多个 worker 的订阅者看到同样的事件序列（见 start/stop）
+    """
+
+    def __init__(self, history: int = 1000, log: Optional[ChangeLog] = None,
+                 poll_interval: float = POLL_INTERVAL):
+        self._lock = threading.Lock()
+        self._history = deque(maxlen=history)
+        self._history_size = history
+        self._log = log
+        self._poll_interval = poll_interval
+        # 内存模式：id 从启动时的毫秒时间戳开始，重启后旧的 Last-Event-ID 不会被误认为已同步
+        # 共享日志模式：已分发到的日志位置
+        self._next_id = (log.last_id() if log is not None else int(time.time() * 1000)) + 1
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._subscribers: Set[asyncio.Queue] = set()
+        self._listeners: List[EventListener] = []
+        self._closed = False
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def bind(self, loop: asyncio.AbstractEventLoop) -> None:
+        """绑定订阅者所在的事件循环（应用启动时调用）"""
+        self._loop = loop
+
+    def add_listener(self, callback: EventListener) -> None:
+        """注册事件监听（例如其他 worker 写入文档后失效本进程的缓存），在分发线程中调用"""
+        self._listeners.append(callback)
+
+    @property
+    def last_id(self) -> int:
+        with self._lock:
+            return self._next_id - 1
+
+    def publish(self, event_type: str, data: dict) -> dict:
+        """发布一个事件，线程安全"""
+        if self._log is not None:
+            event = self._log.append(event_type, data, os.getpid())
+            self._wake.set()
+            return event
+        with self._lock:
+            event = {"id": self._next_id, "type": event_type, "ts": time.time(), **data}
+            self._next_id += 1
+            self._history.append(event)
+            subscribers = list(self._subscribers)
+        self._dispatch(subscribers, event, local=True)
+        return event
+
+    # ---- 共享日志的轮询 ----
+
+    def start(self) -> None:
+        """共享日志模式：启动轮询线程（内存模式下无需调用）"""
+        if self._log is None or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="change-feed-tail", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def poll(self) -> int:
+        """把共享日志中的新事件分发给本进程，返回分发的条数"""
+        pid = os.getpid()
+        delivered = 0
+        while True:
+            rows = self._log.read(self._next_id - 1)
+            if not rows:
+                return delivered
+            for event, origin in rows:
+                with self._lock:
+                    self._next_id = event["id"] + 1
+                    subscribers = list(self._subscribers)
+                self._dispatch(subscribers, event, local=origin == pid)
+                delivered += 1
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self._wake.wait(self._poll_interval)
+            self._wake.clear()
+            try:
+                self.poll()
+            except Exception:
+                # 日志暂时不可用（例如被其他进程锁住）不影响服务，下一轮重试
+                pass
+
+    # ---- 分发 ----
+
+    def _dispatch(self, subscribers: List[asyncio.Queue], event: dict, local: bool) -> None:
+        for listener in self._listeners:
+            try:
+                listener(event, local)
+            except Exception:
+                pass
+        if self._loop is not None and subscribers:
+            try:
+                self._loop.call_soon_threadsafe(self._deliver, subscribers, event)
+            except RuntimeError:
+                pass  # 事件循环已关闭
+
+    def _deliver(self, subscribers: List[asyncio.Queue], event) -> None:
+        for queue in subscribers:
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                if event is _CLOSED:
+                    # 关闭信号不能丢：腾出位置
+                    queue.get_nowait()
+                    queue.put_nowait(event)
+                    continue
+                # 太慢的订阅者：清空积压并要求它重新同步
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait({"id": event["id"], "type": "reset"})
+
+    def close(self) -> None:
+        """
+        结束所有订阅（服务关闭时调用，线程安全，可在信号处理函数中调用）：
+        SSE 长连接随之结束，平滑关闭不必等到超时；之后的订阅立即结束
+        """
+        with self._lock:
+            self._closed = True
+            subscribers = list(self._subscribers)
+        if self._loop is not None and subscribers:
+            try:
+                self._loop.call_soon_threadsafe(self._deliver, subscribers, _CLOSED)
+            except RuntimeError:
+                pass
+
+    # ---- 订阅 ----
+
+    def replay(self, last_event_id: int, until_id: Optional[int] = None) -> Optional[List[dict]]:
+        """last_event_id 之后（到 until_id 为止）的事件；已无法补全缺口时返回 None"""
+        if self._log is not None:
+            return self._replay_log(last_event_id, until_id)
+        with self._lock:
+            if last_event_id == self._next_id - 1:
+                return []
+            if last_event_id > self._next_id - 1:
+                return None  # 来自上一次运行的 id
+            oldest = self._history[0]["id"] if self._history else self._next_id
+            if last_event_id < oldest - 1:
+                return None
+            return [event for event in self._history
+                    if event["id"] > last_event_id and (until_id is None or event["id"] <= until_id)]
+
+    def _replay_log(self, last_event_id: int, until_id: Optional[int]) -> Optional[List[dict]]:
+        until_id = self._log.last_id() if until_id is None else until_id
+        if last_event_id > self._log.last_id():
+            return None  # 日志被清空过，来自更早的 id
+        if last_event_id >= until_id:
+            return []  # 客户端在其他 worker 上已经看到更新的事件
+        if until_id - last_event_id > self._history_size:
+            return None
+        oldest = self._log.oldest_id()
+        if oldest is None or last_event_id < oldest - 1:
+            return None
+        return [event for event, _ in self._log.read(last_event_id, until_id, limit=self._history_size)]
+
+    async def subscribe(self, last_event_id: Optional[int] = None,
+                        heartbeat: Optional[float] = None) -> AsyncIterator[Optional[dict]]:
+        """
+        异步迭代事件：先补发断线期间的事件，再实时推送
+        设置 heartbeat 时，空闲超过该秒数产出一次 None（用于保活）；close() 之后迭代结束
+        """
+        queue: asyncio.Queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        with self._lock:
+            if self._closed:
+                return
+            self._subscribers.add(queue)
+            current = self._next_id - 1
+        try:
+            # 已经实时推送过的事件不再重复：订阅前的由 replay 负责，
+            # 客户端在其他 worker 上看到的更新事件（id 大于本进程的进度）直接跳过
+            seen = current
+            if last_event_id is not None:
+                missed = self.replay(last_event_id, current)
+                if missed is None:
+                    yield {"id": current, "type": "reset"}
+                else:
+                    seen = max(current, last_event_id)
+                    for event in missed:
+                        yield event
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=heartbeat)
+                except asyncio.TimeoutError:
+                    yield None
+                    continue
+                if event is _CLOSED:
+                    return
+                if event["id"] > seen or event["type"] == "reset":
+                    yield event
+        finally:
+            with self._lock:
+                self._subscribers.discard(queue)
+
+    @property
+    def subscriber_count(self) -> int:
+        with self._lock:
+            return len(self._subscribers)
+
+
+async def sse_stream(feed: ChangeFeed, last_event_id: Optional[int] = None,
+                     heartbeat: float = HEARTBEAT_INTERVAL) -> AsyncIterator[str]:
+    """把事件编码为 text/event-stream"""
+    # 告诉浏览器断线后多久重连
+    yield "retry: 3000\n\n"
+    async for event in feed.subscribe(last_event_id, heartbeat=heartbeat):
+        if event is None:
+            yield ": keep-alive\n\n"
+            continue
+        payload = json.dumps(event, ensure_ascii=False)
+        yield f"id: {event['id']}\nevent: {event['type']}\ndata: {payload}\n\n"
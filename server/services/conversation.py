@@ -0,0 +1,118 @@
+from typing import Iterable, Iterator, Tuple
+
+# 服务端生成的对话Markdown布局（导入、离线导入、轮次索引共用）
+USER_HEADING = "## 🙋‍♂️ User"
+AI_HEADING = "## 🤖 AI"
+DEFAULT_TITLE = "Gemini对话记录"
+
+
+def iter_turn_markdown(turns: Iterable[dict]) -> Iterator[str]:
+    """逐段产出每轮对话的Markdown片段（段与段之间用换行拼接）"""
+    for turn in turns:
+        if turn.get('user'):
+            yield f"{USER_HEADING}\n\n{turn['user']}\n"
+        if turn.get('model'):
+            yield f"{AI_HEADING}\n\n{turn['model']}\n"
+        yield "---\n"
+
+
+def iter_turn_parts(turns: Iterable[dict]) -> Iterator[str]:
+    """
+    与 "\n".join(iter_turn_markdown(turns)) 逐字相同的片段序列，但消息正文直接引用原字符串、不复制，
+    一次 "".join 即得到整篇正文（大对话生成文档时不会先生成每段的副本）
+    """
+    user_heading = f"{USER_HEADING}\n\n"
+    ai_heading = f"{AI_HEADING}\n\n"
+    first = True
+    for turn in turns:
+        for heading, key in ((user_heading, 'user'), (ai_heading, 'model')):
+            text = turn.get(key)
+            if text:
+                if not first:
+                    yield "\n"
+                first = False
+                yield heading
+                yield text
+                yield "\n"
+        if not first:
+            yield "\n"
+        first = False
+        yield "---\n"
+
+
+def render_turns(turns: Iterable[dict]) -> str:
+    """对话正文"""
+    return "".join(iter_turn_parts(turns))
+
+
+def render_document(title: str, content: str, turn_count: int) -> str:
+    """完整的对话文档（标题 + 轮数 + 正文），即 /api/import/gemini 返回的 markdown"""
+    return f"{document_preamble(title, turn_count)}{content}\n"
+
+
+def render_turns_document(title: str, turns: Iterable[dict], turn_count: int) -> str:
+    """由轮次直接生成 render_document(title, render_turns(turns), turn_count)，不产生正文的中间副本"""
+    parts = [document_preamble(title, turn_count)]
+    parts.extend(iter_turn_parts(turns))
+    parts.append("\n")
+    return "".join(parts)
+
+
+def document_preamble(title: str, turn_count: int) -> str:
+    """正文之前的部分（标题、轮数、分隔线）"""
+    return f"# {title}\n\n*共 {turn_count} 轮对话*\n---\n\n"
+
+
+class TurnCounter:
+    """
+    按消息序列划分轮次：User 开始新的一轮；AI 在上一轮已有回复（或还没有任何轮次）时单独成一轮
+    轮次索引、旁路文件与导入时的轮数统计都用这一条规则，保证编号一致
+    """
+
+    def __init__(self):
+        self.count = 0
+        self._has_model = True
+
+    def feed(self, role: str) -> int:
+        """登记一条消息，返回它所属的轮次（1起）"""
+        if role == "user" or self._has_model:
+            self.count += 1
+        self._has_model = role == "model"
+        return self.count
+
+
+def count_turns(turns: Iterable[dict]) -> int:
+    counter = TurnCounter()
+    for turn in turns:
+        for role in ("user", "model"):
+            if turn.get(role):
+                counter.feed(role)
+    return counter.count
+
+
+def iter_message_layout(turns: Iterable[dict], start: int = 0) -> Iterator[Tuple[int, str, int, int, int]]:
+    """
+    按 render_turns 的输出逐字节推算每条消息的位置，无需回头扫描生成的Markdown
+    产出 (轮次, 角色, 标题偏移, 正文偏移, 正文字节数)；start 为正文在文档中的起始偏移
+    """
+    headings = {"user": len(USER_HEADING.encode("utf-8")), "model": len(AI_HEADING.encode("utf-8"))}
+    counter = TurnCounter()
+    pos = start
+    first = True
+    for turn in turns:
+        for role in ("user", "model"):
+            text = turn.get(role)
+            if not text:
+                continue
+            if not first:
+                pos += 1  # 段与段之间的换行
+            first = False
+            body = pos + headings[role] + 2
+            length = len(text.encode("utf-8"))
+            yield counter.feed(role), role, pos, body, length
+            pos = body + length + 1
+        if not first:
+            pos += 1
+        first = False
+        pos += len("---\n")
+
@@ -0,0 +1,353 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import unicodedata
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .conversation import AI_HEADING, USER_HEADING
+from .doc_layout import DocLayout
+from .search_index import TOKENIZER_VERSION, tokenize
+
+SIMHASH_BITS = 64
+# 64位指纹切成4段，汉明距离<=3 的两个指纹至少有一段完全相同（抽屉原理），按段精确查找即可
+BANDS = 4
+BAND_BITS = SIMHASH_BITS // BANDS
+DEFAULT_MAX_DISTANCE = 3
+# 特征太少时 SimHash 不可靠，不做近似查重
+MIN_FEATURES = 8
+# 太短的轮次（如“谢谢”）重复没有意义
+MIN_TURN_CHARS = 20
+
+WHITESPACE_RE = re.compile(r"\s+")
+_BIT_SHIFTS = np.arange(SIMHASH_BITS, dtype=np.uint64)
+
+
+def normalize(text: str) -> str:
+    """NFKC + 合并空白；去掉开头的 # 标题行（重新导入时标题可能变化）"""
+    text = unicodedata.normalize("NFKC", text).strip()
+    if text.startswith("# "):
+        text = text.split("\n", 1)[1] if "\n" in text else ""
+    return WHITESPACE_RE.sub(" ", text).strip()
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:32]
+
+
+def _feature_hash(feature: str) -> int:
+    return int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def simhash(tokens: List[str]) -> Optional[int]:
+    """以相邻词对为特征、出现次数为权重的64位 SimHash；特征过少时返回 None"""
+    features: Dict[str, int] = {}
+    for i in range(len(tokens) - 1):
+        feature = tokens[i] + " " + tokens[i + 1]
+        features[feature] = features.get(feature, 0) + 1
+    if len(features) < MIN_FEATURES:
+        return None
+
+    hashes = np.fromiter((_feature_hash(f) for f in features), dtype=np.uint64, count=len(features))
+    weights = np.fromiter(features.values(), dtype=np.float64, count=len(features))
+    bits = ((hashes[:, None] >> _BIT_SHIFTS) & np.uint64(1)).astype(np.float64)
+    votes = weights @ (bits * 2 - 1)
+    return int(sum(1 << i for i in range(SIMHASH_BITS) if votes[i] > 0))
+
+
+def bands(fingerprint: int) -> List[int]:
+    mask = (1 << BAND_BITS) - 1
+    return [(fingerprint >> (i * BAND_BITS)) & mask for i in range(BANDS)]
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+def _to_signed(value: int) -> int:
+    """SQLite INTEGER 是有符号64位"""
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def _to_unsigned(value: int) -> int:
+    return value + (1 << 64) if value < 0 else value
+
+
+def split_turns(text: str) -> List[str]:
+    """按 User/AI 标题切分对话轮次（规则同 TurnIndex），返回各轮原文"""
+    turns: List[List[str]] = []
+    has_ai = True
+    for line in text.split("\n"):
+        heading = line.rstrip("\r")
+        if heading == USER_HEADING or (heading == AI_HEADING and has_ai):
+            turns.append([])
+            has_ai = heading == AI_HEADING
+        elif heading == AI_HEADING:
+            has_ai = True
+        if turns:
+            turns[-1].append(line)
+    return ["\n".join(lines) for lines in turns]
+
+
+class Fingerprint:
+    """一篇文档的查重特征：规范化内容哈希、SimHash、各轮次哈希"""
+
+    def __init__(self, text: str):
+        normalized = normalize(text)
+        self.content_hash = text_hash(normalized)
+        self.simhash = simhash(tokenize(normalized))
+        self.turn_hashes: List[Tuple[int, str]] = []
+        for turn_no, turn in enumerate(split_turns(text), start=1):
+            body = normalize(turn)
+            if len(body) >= MIN_TURN_CHARS:
+                self.turn_hashes.append((turn_no, text_hash(body)))
+
+
+class DedupIndex:
+    """
+    文档与对话轮次的查重索引（SQLite）
+    - 完全重复：规范化内容的哈希，按索引等值查找
+    - 近似重复：64位 SimHash 分4段建索引，只比较至少一段相同的候选，与文档总数无关
+    - 轮次重复：每轮规范化文本的哈希
+    save/import 时 O(1) 查询；与 SearchIndex 一样按 mtime/size 对账并跟随 DocIndex 的变化
+    """
+
+    def __init__(self, docs_dir: str, db_path: str, max_distance: int = DEFAULT_MAX_DISTANCE):
+        self.docs_dir = docs_dir
+        self.layout = DocLayout(docs_dir)
+        self.db_path = db_path
+        self.max_distance = max_distance
+        self._lock = threading.RLock()
+
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._db = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        if self._db.execute("PRAGMA user_version").fetchone()[0] != TOKENIZER_VERSION:
+            # 切词规则变化后旧的 SimHash 不可比：清空，由 sync 重建
+            for table in ("dedup_docs", "dedup_turns"):
+                self._db.execute(f"DROP TABLE IF EXISTS {table}")
+            self._db.execute(f"PRAGMA user_version = {TOKENIZER_VERSION}")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS dedup_docs (
+                filename TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                content_hash TEXT NOT NULL,
+                simhash INTEGER,
+                b0 INTEGER, b1 INTEGER, b2 INTEGER, b3 INTEGER
+            )
+        """)
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS dedup_turns (
+                hash TEXT NOT NULL,
+                filename TEXT NOT NULL,
+                turn_no INTEGER NOT NULL
+            )
+        """)
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_dedup_hash ON dedup_docs(content_hash)")
+        for i in range(BANDS):
+            self._db.execute(f"CREATE INDEX IF NOT EXISTS idx_dedup_b{i} ON dedup_docs(b{i})")
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_dedup_turn_hash ON dedup_turns(hash)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_dedup_turn_file ON dedup_turns(filename)")
+        self._db.commit()
+
+    # ---- 维护 ----
+
+    def index_document(self, filename: str) -> Optional[dict]:
+        """
+        （重新）索引单个文档，并返回它与其他文档的重复情况（见 check）
+        文件已不存在时从索引中删除并返回 None
+        """
+        path = self.layout.locate(filename)
+        try:
+            stats = os.stat(path)
+            with open(path, "r", encoding="utf-8", errors="replace") as f:
+                text = f.read()
+        except OSError:
+            self.remove_document(filename)
+            return None
+
+        fingerprint = Fingerprint(text)
+        with self._lock:
+            report = self._check(fingerprint, exclude=filename)
+            self._write(filename, stats.st_size, stats.st_mtime_ns, fingerprint)
+            self._db.commit()
+        return report
+
+    def remove_document(self, filename: str) -> None:
+        with self._lock:
+            self._delete(filename)
+            self._db.commit()
+
+    def apply_changes(self, diff: Dict[str, List[str]]) -> None:
+        """应用 DocIndex.reconcile 返回的差异"""
+        for filename in diff.get("added", []) + diff.get("changed", []):
+            self.index_document(filename)
+        for filename in diff.get("removed", []):
+            self.remove_document(filename)
+
+    def sync(self) -> Dict[str, int]:
+        """与磁盘对账：只重新计算 size/mtime 变化的文档"""
+        on_disk = {
+            filename: (stats.st_size, stats.st_mtime_ns)
+            for filename, (_, stats) in self.layout.scan().items()
+        }
+
+        with self._lock:
+            indexed = {
+                row[0]: (row[1], row[2])
+                for row in self._db.execute("SELECT filename, size, mtime_ns FROM dedup_docs")
+            }
+        stale = [name for name, sig in on_disk.items() if indexed.get(name) != sig]
+        removed = [name for name in indexed if name not in on_disk]
+        for name in stale:
+            self.index_document(name)
+        with self._lock:
+            for name in removed:
+                self._delete(name)
+            self._db.commit()
+        return {"indexed": len(stale), "removed": len(removed), "total": len(on_disk)}
+
+    def start_background_sync(self) -> threading.Thread:
+        thread = threading.Thread(target=self.sync, name="dedup-index-sync", daemon=True)
+        thread.start()
+        return thread
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+    # ---- 查询 ----
+
+    def check(self, text: str, exclude: Optional[str] = None) -> dict:
+        """
+        查找与给定内容重复的已索引文档
+        返回 {'exact': [filename], 'near': [{filename, distance}], 'turns': [{turn, filename, turn_no}]}
+        """
+        fingerprint = Fingerprint(text)
+        with self._lock:
+            return self._check(fingerprint, exclude)
+
+    def clusters(self, min_size: int = 2, include_near: bool = True) -> List[dict]:
+        """全库的重复簇：完全相同的内容哈希，加上 SimHash 距离不超过 max_distance 的近似重复"""
+        with self._lock:
+            rows = self._db.execute("SELECT filename, content_hash, simhash FROM dedup_docs").fetchall()
+            edges = []
+            if include_near:
+                for i in range(BANDS):
+                    edges.extend(self._db.execute(
+                        f"SELECT a.filename, b.filename, a.simhash, b.simhash FROM dedup_docs a "
+                        f"JOIN dedup_docs b ON a.b{i} = b.b{i} AND a.filename < b.filename "
+                        f"WHERE a.simhash IS NOT NULL"
+                    ).fetchall())
+
+        parent = {filename: filename for filename, _, _ in rows}
+
+        def find(name: str) -> str:
+            while parent[name] != name:
+                parent[name] = parent[parent[name]]
+                name = parent[name]
+            return name
+
+        def union(a: str, b: str) -> None:
+            parent[find(a)] = find(b)
+
+        first_by_hash: Dict[str, str] = {}
+        for filename, digest, _ in rows:
+            if digest in first_by_hash:
+                union(filename, first_by_hash[digest])
+            else:
+                first_by_hash[digest] = filename
+        for a, b, hash_a, hash_b in edges:
+            if hamming(_to_unsigned(hash_a), _to_unsigned(hash_b)) <= self.max_distance:
+                union(a, b)
+
+        groups: Dict[str, List[Tuple[str, str]]] = {}
+        for filename, digest, _ in rows:
+            groups.setdefault(find(filename), []).append((filename, digest))
+        clusters = []
+        for members in groups.values():
+            if len(members) < min_size:
+                continue
+            members.sort()
+            clusters.append({
+                "files": [filename for filename, _ in members],
+                "exact": len({digest for _, digest in members}) == 1,
+            })
+        clusters.sort(key=lambda cluster: (-len(cluster["files"]), cluster["files"][0]))
+        return clusters
+
+    def shared_turns(self, limit: int = 100) -> List[dict]:
+        """出现在多篇文档中的对话轮次"""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT hash, GROUP_CONCAT(filename || ':' || turn_no, '\n') FROM dedup_turns "
+                "GROUP BY hash HAVING COUNT(DISTINCT filename) > 1 "
+                "ORDER BY COUNT(*) DESC LIMIT ?", (limit,)
+            ).fetchall()
+        results = []
+        for digest, occurrences in rows:
+            places = [item.rsplit(":", 1) for item in occurrences.split("\n")]
+            results.append({
+                "hash": digest,
+                "occurrences": [{"filename": name, "turn_no": int(turn_no)} for name, turn_no in places],
+            })
+        return results
+
+    # ---- 内部 ----
+
+    def _check(self, fingerprint: Fingerprint, exclude: Optional[str]) -> dict:
+        exact = [
+            row[0] for row in self._db.execute(
+                "SELECT filename FROM dedup_docs WHERE content_hash = ? ORDER BY filename",
+                (fingerprint.content_hash,)
+            )
+            if row[0] != exclude
+        ]
+
+        near = []
+        if fingerprint.simhash is not None:
+            values = bands(fingerprint.simhash)
+            candidates = self._db.execute(
+                "SELECT filename, simhash FROM dedup_docs WHERE " +
+                " OR ".join(f"b{i} = ?" for i in range(BANDS)),
+                values
+            ).fetchall()
+            for filename, other in candidates:
+                if filename == exclude or filename in exact or other is None:
+                    continue
+                distance = hamming(fingerprint.simhash, _to_unsigned(other))
+                if distance <= self.max_distance:
+                    near.append({"filename": filename, "distance": distance})
+            near.sort(key=lambda item: (item["distance"], item["filename"]))
+
+        turns = []
+        for turn_no, digest in fingerprint.turn_hashes:
+            for filename, other_turn in self._db.execute(
+                "SELECT filename, turn_no FROM dedup_turns WHERE hash = ? ORDER BY filename, turn_no", (digest,)
+            ):
+                if filename != exclude:
+                    turns.append({"turn": turn_no, "filename": filename, "turn_no": other_turn})
+        return {"exact": exact, "near": near, "turns": turns}
+
+    def _write(self, filename: str, size: int, mtime_ns: int, fingerprint: Fingerprint) -> None:
+        self._delete(filename)
+        fp = fingerprint.simhash
+        band_values = [_to_signed(v) for v in bands(fp)] if fp is not None else [None] * BANDS
+        self._db.execute(
+            "INSERT INTO dedup_docs (filename, size, mtime_ns, content_hash, simhash, b0, b1, b2, b3) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (filename, size, mtime_ns, fingerprint.content_hash,
+             _to_signed(fp) if fp is not None else None, *band_values)
+        )
+        self._db.executemany(
+            "INSERT INTO dedup_turns (hash, filename, turn_no) VALUES (?, ?, ?)",
+            [(digest, filename, turn_no) for turn_no, digest in fingerprint.turn_hashes]
+        )
+
+    def _delete(self, filename: str) -> None:
+        self._db.execute("DELETE FROM dedup_docs WHERE filename = ?", (filename,))
+        self._db.execute("DELETE FROM dedup_turns WHERE filename = ?", (filename,))
@@ -0,0 +1,137 @@
+import os
+import tarfile
+import time
+import zipfile
+import zlib
+from typing import IO, Iterable, Iterator, Tuple
+
+# 流式读写的块大小
+CHUNK_SIZE = 64 * 1024
+# 导入时单个文档的大小上限，防止恶意归档（解压炸弹）撑爆内存
+MAX_MEMBER_SIZE = 64 * 1024 * 1024
+
+# 上传的归档在内存中缓冲的上限，超过后落到临时文件
+SPOOL_MAX_MEMORY = 8 * 1024 * 1024
+
+ARCHIVE_FORMATS = ("tar", "zip")
+
+
+class _Sink:
+    """只写的缓冲区：压缩器写进来，生成器再把积累的字节取走"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data: bytes) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _iter_file(fileobj: IO[bytes], size: int) -> Iterator[bytes]:
+    """读满 size 字节（文件在读取过程中变短时补零，保证与归档头一致）"""
+    remaining = size
+    while remaining > 0:
+        chunk = fileobj.read(min(CHUNK_SIZE, remaining))
+        if not chunk:
+            yield b"\0" * remaining
+            return
+        remaining -= len(chunk)
+        yield chunk
+
+
+def iter_tar_gz(files: Iterable[Tuple[str, str]]) -> Iterator[bytes]:
+    """
+    逐块生成 .tar.gz：files 为 (归档内名称, 磁盘路径)
+    直接拼 tar 头和数据块再过 gzip 流式压缩，内存占用与文件大小、数量无关
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31: gzip 格式
+    for arcname, path in files:
+        try:
+            f = open(path, "rb")
+        except FileNotFoundError:
+            continue  # 导出过程中被删除
+        with f:
+            # 打开后 fstat：原子替换不影响已打开的文件，大小与读到的内容一致
+            stats = os.fstat(f.fileno())
+            info = tarfile.TarInfo(arcname)
+            info.size = stats.st_size
+            info.mtime = int(stats.st_mtime)
+            info.mode = 0o644
+            yield compressor.compress(info.tobuf(format=tarfile.PAX_FORMAT, encoding="utf-8"))
+            for chunk in _iter_file(f, info.size):
+                yield compressor.compress(chunk)
+            padding = -info.size % tarfile.BLOCKSIZE
+            if padding:
+                yield compressor.compress(b"\0" * padding)
+    yield compressor.compress(b"\0" * (tarfile.BLOCKSIZE * 2))
+    yield compressor.flush()
+
+
+def iter_zip(files: Iterable[Tuple[str, str]]) -> Iterator[bytes]:
+    """逐块生成 .zip（不可 seek 的输出流，zipfile 会写数据描述符）"""
+    sink = _Sink()
+    with zipfile.ZipFile(sink, mode="w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for arcname, path in files:
+            try:
+                f = open(path, "rb")
+            except FileNotFoundError:
+                continue
+            with f:
+                stats = os.fstat(f.fileno())
+                info = zipfile.ZipInfo(arcname, date_time=time.localtime(stats.st_mtime)[:6])
+                info.compress_type = zipfile.ZIP_DEFLATED
+                info.external_attr = 0o644 << 16
+                with archive.open(info, mode="w", force_zip64=stats.st_size > 0x7FFFFFFF) as member:
+                    for chunk in _iter_file(f, stats.st_size):
+                        member.write(chunk)
+                        data = sink.drain()
+                        if data:
+                            yield data
+            data = sink.drain()
+            if data:
+                yield data
+    yield sink.drain()
+
+
+def iter_archive_members(fileobj: IO[bytes]) -> Iterator[Tuple[str, bytes]]:
+    """
+    读取上传的 tar(.gz/.bz2/.xz) 或 zip，逐个产出 (文件名, 内容)
+    只取 .md 普通文件，忽略目录结构（取 basename），超过 MAX_MEMBER_SIZE 的跳过
+    """
+    fileobj.seek(0)
+    if zipfile.is_zipfile(fileobj):
+        fileobj.seek(0)
+        with zipfile.ZipFile(fileobj) as archive:
+            for info in archive.infolist():
+                name = os.path.basename(info.filename)
+                if info.is_dir() or not name.endswith(".md") or info.file_size > MAX_MEMBER_SIZE:
+                    continue
+                with archive.open(info) as member:
+                    # 头里的大小不可信，按实际解压的字节数再判断一次
+                    data = member.read(MAX_MEMBER_SIZE + 1)
+                if len(data) <= MAX_MEMBER_SIZE:
+                    yield name, data
+        return
+
+    fileobj.seek(0)
+    try:
+        archive = tarfile.open(fileobj=fileobj, mode="r:*")
+    except tarfile.TarError:
+        raise ValueError("Unsupported archive format (expected tar, tar.gz or zip)")
+    with archive:
+        for info in archive:
+            name = os.path.basename(info.name)
+            if not info.isfile() or not name.endswith(".md") or info.size > MAX_MEMBER_SIZE:
+                continue
+            member = archive.extractfile(info)
+            if member is not None:
+                yield name, member.read()
+
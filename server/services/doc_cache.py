@@ -0,0 +1,214 @@
+import gzip
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from .doc_layout import DocLayout
+from .doc_store import content_hash
+
+try:
+    import brotli
+except ImportError:  # brotli 为可选依赖，缺失时只协商 gzip
+    brotli = None
+
+# 小于该字节数的响应不压缩（压缩收益抵不上CPU开销）
+MIN_COMPRESS_SIZE = 1024
+ENCODINGS = ("br", "gzip")
+# 缓存的默认内存上限（原文 + 各压缩版本）
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+
+def make_etag(data: bytes) -> str:
+    """强ETag：内容哈希（与 DocStore 的版本号一致，可直接用于 If-Match）"""
+    return '"' + content_hash(data) + '"'
+
+
+def etag_to_hash(etag: Optional[str]) -> Optional[str]:
+    """把 If-Match 头还原成 DocStore 的 expected_hash（"*" 原样保留）"""
+    if not etag:
+        return None
+    etag = etag.split(",")[0].strip()
+    return etag if etag == "*" else _strip_etag(etag).strip('"')
+
+
+def _strip_etag(tag: str) -> str:
+    """去掉 W/ 前缀和压缩后缀，得到内容本身的标识"""
+    tag = tag[2:] if tag.startswith("W/") else tag
+    for encoding in ENCODINGS:
+        suffix = f'-{encoding}"'
+        if tag.endswith(suffix):
+            return tag[:-len(suffix)] + '"'
+    return tag
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    If-None-Match 使用弱比较：支持逗号分隔列表和 *；
+    同一内容的不同压缩表示视为匹配（客户端缓存的是解码后的内容）
+    """
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    if "*" in candidates:
+        return True
+    bare = _strip_etag(etag)
+    return any(_strip_etag(tag) == bare for tag in candidates)
+
+
+def choose_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """按 Accept-Encoding 选择压缩方式：优先 br（已安装时），其次 gzip"""
+    if not accept_encoding:
+        return None
+    accepted = {}
+    for part in accept_encoding.split(","):
+        token, _, params = part.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[token.strip().lower()] = quality
+
+    def allowed(name: str) -> bool:
+        return accepted.get(name, accepted.get("*", 0.0)) > 0
+
+    if brotli is not None and allowed("br"):
+        return "br"
+    if allowed("gzip"):
+        return "gzip"
+    return None
+
+
+def encode_body(body: bytes, encoding: Optional[str]) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=5)
+    if encoding == "gzip":
+        return gzip.compress(body, compresslevel=6, mtime=0)
+    return body
+
+
+def representation_etag(etag: str, encoding: Optional[str]) -> str:
+    """不同 content-coding 是不同的表示，强ETag需要区分"""
+    return etag if not encoding else f'{etag[:-1]}-{encoding}"'
+
+
+class CachedDoc:
+    """一篇文档的 JSON 响应体及按需生成的压缩版本；ETag 取自文件内容本身"""
+
+    def __init__(self, filename: str, mtime_ns: int, size: int, raw: bytes):
+        self.filename = filename
+        self.mtime_ns = mtime_ns
+        self.size = size
+        self.etag = make_etag(raw)
+        self.body = json.dumps(
+            {"filename": filename, "content": raw.decode("utf-8")}, ensure_ascii=False
+        ).encode("utf-8")
+        self._encoded: Dict[str, bytes] = {}
+
+    @property
+    def nbytes(self) -> int:
+        return len(self.body) + sum(len(data) for data in self._encoded.values())
+
+    def encoded(self, encoding: Optional[str]) -> bytes:
+        if not encoding:
+            return self.body
+        data = self._encoded.get(encoding)
+        if data is None:
+            data = self._encoded[encoding] = encode_body(self.body, encoding)
+        return data
+
+
+class DocCache:
+    """
+    热门文档的进程内 LRU
+    - 命中时只做一次 stat 校验 mtime/size，外部修改也能立即发现
+    - save/delete 主动失效；DocIndex 对账发现的变化通过 apply_changes 失效
+    - 按条目数和总字节数（含压缩版本）双重限额淘汰
+    """
+
+    def __init__(self, docs_dir: str, max_entries: int = 256, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.docs_dir = docs_dir
+        self.layout = DocLayout(docs_dir)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, CachedDoc]" = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, filename: str) -> CachedDoc:
+        """返回文档的缓存条目；文件不存在时抛出 FileNotFoundError"""
+        filepath = self.layout.locate(filename)
+        try:
+            stats = os.stat(filepath)
+        except FileNotFoundError:
+            self.invalidate(filename)
+            raise
+
+        with self._lock:
+            entry = self._entries.get(filename)
+            if entry is not None and (entry.mtime_ns, entry.size) == (stats.st_mtime_ns, stats.st_size):
+                self._entries.move_to_end(filename)
+                self.hits += 1
+                return entry
+            self.misses += 1
+
+        with open(filepath, 'rb') as f:
+            raw = f.read()
+        entry = CachedDoc(filename, stats.st_mtime_ns, stats.st_size, raw)
+        self._store(entry)
+        return entry
+
+    def encoded(self, entry: CachedDoc, encoding: Optional[str]) -> bytes:
+        """取压缩后的响应体，并把新生成的压缩版本计入内存限额"""
+        before = entry.nbytes
+        data = entry.encoded(encoding)
+        grown = entry.nbytes - before
+        if grown:
+            with self._lock:
+                if self._entries.get(entry.filename) is entry:
+                    self._bytes += grown
+                    self._evict()
+        return data
+
+    def invalidate(self, filename: str) -> None:
+        with self._lock:
+            entry = self._entries.pop(filename, None)
+            if entry is not None:
+                self._bytes -= entry.nbytes
+
+    def apply_changes(self, diff: Dict[str, List[str]]) -> None:
+        """DocIndex 对账回调"""
+        for filename in diff.get("changed", []) + diff.get("removed", []):
+            self.invalidate(filename)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._bytes,
+                    "hits": self.hits, "misses": self.misses}
+
+    def _store(self, entry: CachedDoc) -> None:
+        if entry.nbytes > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(entry.filename, None)
+            if old is not None:
+                self._bytes -= old.nbytes
+            self._entries[entry.filename] = entry
+            self._bytes += entry.nbytes
+            self._evict()
+
+    def _evict(self) -> None:
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            _, entry = self._entries.popitem(last=False)
+            self._bytes -= entry.nbytes
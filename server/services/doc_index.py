@@ -0,0 +1,324 @@
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from .doc_layout import DocLayout
+
+# 允许的排序字段 -> SQL列
+SORT_COLUMNS = {
+    "mtime": "mtime",
+    "name": "filename",
+    "size": "size",
+}
+
+
+class DocIndex:
+    """
+    docs/ 目录的持久化元数据索引（SQLite）
+    - save/delete 通过 upsert/remove 同步更新
+    - 外部修改（scripts/save.py、手动编辑）由后台线程（只在 leader 上运行）发现：
+      每秒检查根目录和各分片目录的 mtime，只重新列出有变化的目录；
+      原地改写（不经过 rename，目录 mtime 不变）由每 reconcile_interval 秒一次的全量对账兜底
+    - 列表查询只走索引，代价与文档总数无关；索引库由各 worker 共用，首次建库后不需要每个 worker 再对账
+    """
+
+    def __init__(self, docs_dir: str, db_path: str, reconcile_interval: float = 60.0):
+        self.docs_dir = docs_dir
+        self.layout = DocLayout(docs_dir)
+        self.db_path = db_path
+        self.reconcile_interval = reconcile_interval
+        self._lock = threading.RLock()
+        # 对账（全量/增量）互相串行；下面两个字段是上次扫描看到的目录状态
+        self._scan_lock = threading.Lock()
+        self._dirs: Dict[str, int] = {}
+        self._dir_files: Dict[str, Set[str]] = {}
+        self._last_full = 0.0
+        self._reconciled = False
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._listeners: List[Callable[[Dict[str, List[str]]], None]] = []
+
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._db = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS docs (
+                filename TEXT PRIMARY KEY,
+                title TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime REAL NOT NULL,
+                mtime_ns INTEGER NOT NULL
+            )
+        """)
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_docs_mtime ON docs(mtime)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_docs_size ON docs(size)")
+        # 索引版本：每次内容变化递增（用于列表ETag）；存在库里，多个 worker 看到同一个值
+        self._db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        # 以首次建库的时间为初值，删库重建后不会与旧值冲突
+        self._db.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('version', ?)", (time.time_ns(),))
+        # 文档总数与 docs 表在同一事务里增减，列表总数不必每次 COUNT(*)；旧库首次打开时补算一次
+        if self._db.execute("SELECT 1 FROM meta WHERE key = 'doc_count'").fetchone() is None:
+            self._db.execute("INSERT OR IGNORE INTO meta (key, value) SELECT 'doc_count', COUNT(*) FROM docs")
+        self._db.commit()
+
+    # ---- 写入 ----
+
+    def upsert(self, filename: str) -> None:
+        """按磁盘上的当前状态刷新一条记录"""
+        try:
+            stats = os.stat(self.layout.locate(filename))
+        except FileNotFoundError:
+            self.remove(filename)
+            return
+        with self._lock:
+            self._write_row(filename, stats.st_size, stats.st_mtime_ns)
+            self._bump_version()
+            self._db.commit()
+
+    def remove(self, filename: str) -> None:
+        with self._lock:
+            self._delete_row(filename)
+            self._bump_version()
+            self._db.commit()
+
+    def reconcile(self) -> Dict[str, List[str]]:
+        """
+        全量对账：用 scandir 的 stat 结果（含各分片目录）与索引比较，修正新增/修改/删除的文件
+        返回 {'added': [...], 'changed': [...], 'removed': [...]}
+        """
+        with self._scan_lock:
+            dirs: Dict[str, int] = {}
+            on_disk = {}
+            dir_files: Dict[str, Set[str]] = {}
+            for filename, (path, stats) in self.layout.scan(dirs=dirs).items():
+                on_disk[filename] = (stats.st_size, stats.st_mtime_ns)
+                dir_files.setdefault(os.path.dirname(path), set()).add(filename)
+
+            diff = {"added": [], "changed": [], "removed": []}
+            with self._lock:
+                indexed = {
+                    row[0]: (row[1], row[2])
+                    for row in self._db.execute("SELECT filename, size, mtime_ns FROM docs")
+                }
+                for filename, (size, mtime_ns) in on_disk.items():
+                    known = indexed.pop(filename, None)
+                    if known == (size, mtime_ns):
+                        continue
+                    diff["added" if known is None else "changed"].append(filename)
+                    self._write_row(filename, size, mtime_ns)
+                for filename in indexed:
+                    diff["removed"].append(filename)
+                    self._delete_row(filename)
+                if any(diff.values()):
+                    self._bump_version()
+                self._db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('reconciled_at', ?)",
+                                 (time.time_ns(),))
+                self._db.commit()
+                self._reconciled = True
+            self._dirs, self._dir_files = dirs, dir_files
+            self._last_full = time.monotonic()
+        self._notify(diff)
+        return diff
+
+    def reconcile_changed_dirs(self) -> Dict[str, List[str]]:
+        """
+        增量对账：只重新列出 mtime 与上次扫描不同的目录（新建/删除/rename 文件都会改变所在目录的 mtime），
+        再逐个核对这些目录里出现或消失的文档；还没有做过全量对账时退回全量
+        """
+        if not self._dirs:
+            return self.reconcile()
+        with self._scan_lock:
+            pending = []
+            for directory, mtime_ns in self._dirs.items():
+                try:
+                    if os.stat(directory).st_mtime_ns != mtime_ns:
+                        pending.append(directory)
+                except FileNotFoundError:
+                    pending.append(directory)
+
+            affected: Set[str] = set()
+            while pending:
+                directory = pending.pop()
+                affected |= self._dir_files.pop(directory, set())
+                self._dirs.pop(directory, None)
+                try:
+                    mtime_ns = os.stat(directory).st_mtime_ns
+                    files, subdirs = self.layout.list_dir(directory, self._level(directory))
+                except FileNotFoundError:
+                    continue
+                self._dirs[directory] = mtime_ns
+                self._dir_files[directory] = set(files)
+                affected.update(files)
+                # 新出现的分片目录整个列一遍（其下的目录同样如此）
+                pending.extend(child for child in subdirs if child not in self._dirs)
+
+            diff = {"added": [], "changed": [], "removed": []}
+            if affected:
+                with self._lock:
+                    for filename in sorted(affected):
+                        try:
+                            stats = os.stat(self.layout.locate(filename))
+                            on_disk = (stats.st_size, stats.st_mtime_ns)
+                        except FileNotFoundError:
+                            on_disk = None
+                        row = self._db.execute(
+                            "SELECT size, mtime_ns FROM docs WHERE filename = ?", (filename,)
+                        ).fetchone()
+                        known = tuple(row) if row else None
+                        if on_disk == known:
+                            continue
+                        if on_disk is None:
+                            diff["removed"].append(filename)
+                            self._delete_row(filename)
+                        else:
+                            diff["added" if known is None else "changed"].append(filename)
+                            self._write_row(filename, *on_disk)
+                    if any(diff.values()):
+                        self._bump_version()
+                        self._db.commit()
+        self._notify(diff)
+        return diff
+
+    def add_listener(self, callback: Callable[[Dict[str, List[str]]], None]) -> None:
+        """注册对账回调，对账发现外部变化时以 diff 调用"""
+        self._listeners.append(callback)
+
+    # ---- 查询 ----
+
+    def list(self, limit: Optional[int] = None, offset: int = 0, sort: str = "mtime",
+             descending: bool = True, since: Optional[float] = None) -> List[dict]:
+        """分页列出文档元数据；since 为 Unix 时间戳，只返回之后修改过的文档"""
+        self._ensure_reconciled()
+        column = SORT_COLUMNS.get(sort)
+        if column is None:
+            raise ValueError(f"Unsupported sort field: {sort}")
+
+        where, params = self._where(since)
+        sql = (f"SELECT filename, title, size, mtime FROM docs{where} "
+               f"ORDER BY {column} {'DESC' if descending else 'ASC'}, filename")
+        if limit is not None:
+            sql += " LIMIT ? OFFSET ?"
+            params += (limit, offset)
+        elif offset:
+            sql += " LIMIT -1 OFFSET ?"
+            params += (offset,)
+
+        with self._lock:
+            rows = self._db.execute(sql, params).fetchall()
+        return [self._to_metadata(row) for row in rows]
+
+    def count(self, since: Optional[float] = None) -> int:
+        """文档数；不带 since 时直接读 meta 里维护的总数，带 since 时走 mtime 索引计数"""
+        self._ensure_reconciled()
+        with self._lock:
+            if since is None:
+                return self._db.execute("SELECT value FROM meta WHERE key = 'doc_count'").fetchone()[0]
+            where, params = self._where(since)
+            return self._db.execute(f"SELECT COUNT(*) FROM docs{where}", params).fetchone()[0]
+
+    @property
+    def version(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()[0]
+
+    def get(self, filename: str) -> Optional[dict]:
+        """单个文档的元数据（与 list 的条目格式相同）"""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT filename, title, size, mtime FROM docs WHERE filename = ?", (filename,)
+            ).fetchone()
+        return self._to_metadata(row) if row else None
+
+    @staticmethod
+    def _to_metadata(row) -> dict:
+        filename, title, size, mtime = row
+        return {
+            "filename": filename,
+            "title": title,
+            "created_at": datetime.fromtimestamp(mtime).strftime("%Y-%m-%d %H:%M:%S"),
+            "mtime": mtime,
+            "size": size,
+        }
+
+    # ---- 后台对账 ----
+
+    def start(self) -> None:
+        """启动后台对账线程：每秒增量对账有变化的目录，每 reconcile_interval 秒全量对账一次"""
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="doc-index-reconciler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def close(self) -> None:
+        self.stop()
+        with self._lock:
+            self._db.close()
+
+    def _run(self) -> None:
+        while not self._stop.wait(1.0):
+            try:
+                if time.monotonic() - self._last_full >= self.reconcile_interval:
+                    self.reconcile()
+                else:
+                    self.reconcile_changed_dirs()
+            except Exception:
+                # 对账失败不影响服务，下一轮重试
+                pass
+
+    def _ensure_reconciled(self) -> None:
+        """库里从来没有对账过（首次启动）时先对账一次；之后由 leader 维护，其他 worker 直接查询"""
+        if self._reconciled:
+            return
+        with self._lock:
+            done = self._db.execute("SELECT 1 FROM meta WHERE key = 'reconciled_at'").fetchone()
+        if done:
+            self._reconciled = True
+        else:
+            self.reconcile()
+
+    def _notify(self, diff: Dict[str, List[str]]) -> None:
+        if any(diff.values()):
+            for listener in self._listeners:
+                listener(diff)
+
+    def _level(self, directory: str) -> int:
+        relative = os.path.relpath(directory, self.docs_dir)
+        return 0 if relative == "." else len(relative.split(os.sep))
+
+    def _bump_version(self) -> None:
+        self._db.execute("UPDATE meta SET value = value + 1 WHERE key = 'version'")
+
+    def _write_row(self, filename: str, size: int, mtime_ns: int) -> None:
+        """插入或更新一条记录（调用方持有 _lock 并负责提交）；新增时文档总数加一"""
+        title = filename[:-len(".md")] if filename.endswith(".md") else filename
+        updated = self._db.execute(
+            "UPDATE docs SET title = ?, size = ?, mtime = ?, mtime_ns = ? WHERE filename = ?",
+            (title, size, mtime_ns / 1e9, mtime_ns, filename)
+        ).rowcount
+        if not updated:
+            self._db.execute(
+                "INSERT INTO docs (filename, title, size, mtime, mtime_ns) VALUES (?, ?, ?, ?, ?)",
+                (filename, title, size, mtime_ns / 1e9, mtime_ns)
+            )
+            self._db.execute("UPDATE meta SET value = value + 1 WHERE key = 'doc_count'")
+
+    def _delete_row(self, filename: str) -> None:
+        """删除一条记录（调用方持有 _lock 并负责提交）；确实删掉时文档总数减一"""
+        if self._db.execute("DELETE FROM docs WHERE filename = ?", (filename,)).rowcount:
+            self._db.execute("UPDATE meta SET value = value - 1 WHERE key = 'doc_count'")
+
+    @staticmethod
+    def _where(since: Optional[float]) -> Tuple[str, tuple]:
+        if since is None:
+            return "", ()
+        return " WHERE mtime > ?", (since,)
@@ -0,0 +1,222 @@
+import hashlib
+import json
+import os
+import threading
+from typing import Dict, List, Optional, Tuple
+
+# 布局配置文件（位于 docs/ 内，服务端各 worker 与命令行脚本共用；不存在即平铺）
+LAYOUT_FILE_NAME = ".layout.json"
+# 分片的默认参数：两级目录、每级 1 个十六进制字符，共 256 个叶子目录
+DEFAULT_DEPTH = 2
+DEFAULT_WIDTH = 1
+# 扫描时最多下探的目录层数（只进入名字全是十六进制字符的目录，.locks/.turns 等隐藏目录不受影响）
+MAX_SCAN_DEPTH = 4
+MAX_SHARD_WIDTH = 4
+
+FLAT = {"depth": 0, "width": 0}
+_HEX_CHARS = frozenset("0123456789abcdef")
+
+
+def shard_prefix(filename: str, depth: int, width: int) -> str:
+    """文件名 -> 分片子目录（如 "3/f"）；depth=0 表示平铺，返回空串"""
+    if depth <= 0:
+        return ""
+    digest = hashlib.sha256(filename.encode("utf-8")).hexdigest()
+    return os.path.join(*(digest[i * width:(i + 1) * width] for i in range(depth)))
+
+
+def validate_spec(depth: int, width: int) -> dict:
+    if depth == 0:
+        return dict(FLAT)
+    if not (1 <= depth <= MAX_SCAN_DEPTH and 1 <= width <= MAX_SHARD_WIDTH):
+        raise ValueError(f"Unsupported layout: depth={depth}, width={width}")
+    return {"depth": depth, "width": width}
+
+
+def _is_shard_dir_name(name: str) -> bool:
+    return 0 < len(name) <= MAX_SHARD_WIDTH and _HEX_CHARS.issuperset(name)
+
+
+class DocLayout:
+    """
+    docs/ 目录的文件布局：平铺，或按文件名哈希前缀分到子目录（docs/3/f/<文件名>）
+    - 对外的文件名不变，分片目录只是存储细节；文件名 -> 路径的映射全部经过这里
+    - 布局记录在 docs/.layout.json，每次解析路径时按 inode/mtime 检查是否变化，
+      scripts/reshard.py 切换布局后运行中的服务立即按新布局写入，不需要重启
+    - 迁移期间文档可能还在旧位置：读取依次尝试当前布局、迁移前的布局和平铺位置
+    - 附属文件（如 .turns 旁路文件）以 subdir 指定隐藏目录，在其下按同样的规则分片
+    """
+
+    def __init__(self, docs_dir: str):
+        self.docs_dir = docs_dir
+        self.config_path = os.path.join(docs_dir, LAYOUT_FILE_NAME)
+        self._lock = threading.Lock()
+        self._signature = None
+        self._config = {**FLAT, "previous": []}
+
+    # ---- 配置 ----
+
+    def config(self) -> dict:
+        """当前配置 {"depth", "width", "previous": [迁移前的布局, ...]}"""
+        try:
+            stats = os.stat(self.config_path)
+            signature = (stats.st_ino, stats.st_mtime_ns, stats.st_size)
+        except FileNotFoundError:
+            signature = None
+        with self._lock:
+            if signature != self._signature:
+                loaded = self._load() if signature is not None else {**FLAT, "previous": []}
+                # 配置损坏（例如被手动改坏）时沿用上次读到的布局，不会因此找不到文档
+                if loaded is not None:
+                    self._config = loaded
+                self._signature = signature
+            return self._config
+
+    def set_layout(self, depth: int, width: int) -> dict:
+        """
+        切换到新布局（此后的写入都落到新位置）；原布局记入 previous，直到 finish_migration
+        与当前布局相同时不做任何改变（中断的迁移可以重复执行）
+        """
+        spec = validate_spec(depth, width)
+        config = self.config()
+        current = {"depth": config["depth"], "width": config["width"]}
+        if spec == current:
+            return config
+        previous = [current] + [p for p in config["previous"] if p != current and p != spec]
+        self._save({**spec, "previous": previous})
+        return self.config()
+
+    def finish_migration(self) -> None:
+        """所有文档都已迁到当前布局：不再回退查找旧位置"""
+        config = self.config()
+        if not config["previous"]:
+            return
+        self._save({"depth": config["depth"], "width": config["width"], "previous": []})
+
+    # ---- 路径 ----
+
+    def path(self, filename: str, subdir: str = "") -> str:
+        """当前布局下的路径（写入位置）"""
+        config = self.config()
+        return self._path_for(filename, config["depth"], config["width"], subdir)
+
+    def candidates(self, filename: str, subdir: str = "") -> List[str]:
+        """文档可能所在的位置：当前布局、迁移前的布局、平铺（去重，按优先级排列）"""
+        config = self.config()
+        specs = [config] + config["previous"] + [FLAT]
+        paths: List[str] = []
+        for spec in specs:
+            path = self._path_for(filename, spec["depth"], spec["width"], subdir)
+            if path not in paths:
+                paths.append(path)
+        return paths
+
+    def locate(self, filename: str) -> str:
+        """文档实际所在的路径；哪里都没有时返回当前布局下的路径"""
+        paths = self.candidates(filename)
+        if len(paths) > 1:
+            for path in paths:
+                if os.path.isfile(path):
+                    return path
+        return paths[0]
+
+    def scan(self, subdir: str = "", suffix: str = ".md",
+             dirs: Optional[Dict[str, int]] = None) -> Dict[str, Tuple[str, os.stat_result]]:
+        """
+        列出全部文档（或 subdir 下以 suffix 结尾的附属文件）：文件名 -> (路径, stat)
+        同时遍历根目录和分片目录，迁移中途也能得到完整的列表；同名文件以当前布局下的那份为准
+        传入 dirs 时记录遍历过的每个目录在列出之前的 mtime_ns（供增量对账判断哪些目录有变化）
+        """
+        found: Dict[str, Tuple[str, os.stat_result]] = {}
+
+        def walk(directory: str, level: int) -> None:
+            if dirs is not None:
+                dirs[directory] = os.stat(directory).st_mtime_ns
+            files, subdirs = self.list_dir(directory, level, suffix)
+            for name, (path, stats) in files.items():
+                if name not in found or path == self.path(name, subdir):
+                    found[name] = (path, stats)
+            for child in subdirs:
+                walk(child, level + 1)
+
+        try:
+            walk(os.path.join(self.docs_dir, subdir) if subdir else self.docs_dir, 0)
+        except FileNotFoundError:
+            pass
+        return found
+
+    @staticmethod
+    def list_dir(directory: str, level: int,
+                 suffix: str = ".md") -> Tuple[Dict[str, Tuple[str, os.stat_result]], List[str]]:
+        """单个目录（不递归）：其中的文件 {文件名: (路径, stat)} 和可能是分片目录的子目录（level 为目录深度）"""
+        files: Dict[str, Tuple[str, os.stat_result]] = {}
+        subdirs: List[str] = []
+        with os.scandir(directory) as it:
+            for entry in it:
+                if entry.name.endswith(suffix) and entry.is_file():
+                    files[entry.name] = (entry.path, entry.stat())
+                elif (level < MAX_SCAN_DEPTH and _is_shard_dir_name(entry.name)
+                      and entry.is_dir(follow_symlinks=False)):
+                    subdirs.append(entry.path)
+        return files, subdirs
+
+    def remove_empty_dirs(self, subdir: str = "") -> int:
+        """
+        删除旧布局留下的空分片目录（迁回平铺或换分片参数之后），返回删除的目录数
+        符合当前布局的目录即使为空也保留：并发写入可能刚创建它、正要写入
+        """
+        config = self.config()
+        base = os.path.join(self.docs_dir, subdir)
+        removed = 0
+        for root, dirs, files in os.walk(base, topdown=False):
+            relative = os.path.relpath(root, base)
+            if relative == ".":
+                continue
+            parts = relative.split(os.sep)
+            if not all(_is_shard_dir_name(part) for part in parts):
+                continue
+            if len(parts) <= config["depth"] and all(len(part) == config["width"] for part in parts):
+                continue
+            try:
+                os.rmdir(root)
+                removed += 1
+            except OSError:
+                pass
+        return removed
+
+    # ---- 内部 ----
+
+    def _path_for(self, filename: str, depth: int, width: int, subdir: str = "") -> str:
+        return os.path.join(self.docs_dir, subdir, shard_prefix(filename, depth, width), filename)
+
+    def _load(self) -> Optional[dict]:
+        try:
+            with open(self.config_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            spec = validate_spec(int(data.get("depth", 0)), int(data.get("width", 0)))
+            previous = [validate_spec(int(p.get("depth", 0)), int(p.get("width", 0)))
+                        for p in data.get("previous", [])]
+        except (OSError, ValueError, TypeError, AttributeError):
+            return None
+        return {**spec, "previous": previous}
+
+    def _save(self, config: dict) -> None:
+        tmp_path = f"{self.config_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(config, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.config_path)
+
+
+def parse_spec(value: Optional[str]) -> dict:
+    """命令行参数 "flat" / "sharded" / "<depth>x<width>" -> 布局"""
+    if value in (None, "sharded"):
+        return validate_spec(DEFAULT_DEPTH, DEFAULT_WIDTH)
+    if value == "flat":
+        return dict(FLAT)
+    try:
+        depth, width = (int(part) for part in value.lower().split("x"))
+    except ValueError:
+        raise ValueError(f"Invalid layout: {value!r} (expected flat, sharded or <depth>x<width>)")
+    return validate_spec(depth, width)
@@ -0,0 +1,322 @@
+import hashlib
+import os
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from .doc_layout import DEFAULT_DEPTH, DEFAULT_WIDTH, DocLayout, shard_prefix
+
+try:
+    import fcntl
+except ImportError:  # Windows：只有进程内的锁
+    fcntl = None
+
+# 文件锁目录（位于 docs/ 内，服务端各 worker 与命令行脚本天然共用）
+LOCK_DIR_NAME = ".locks"
+# 锁文件固定按默认参数分片（.locks/3/f/<文件名>.lock），不随文档布局切换：
+# 迁移期间同一文件名在所有进程里始终对应同一个锁文件
+LOCK_SHARD = (DEFAULT_DEPTH, DEFAULT_WIDTH)
+
+
+def content_hash(data: bytes) -> str:
+    """文档内容的哈希（sha256前缀），同时用作 ETag 和乐观并发的版本号"""
+    return hashlib.sha256(data).hexdigest()[:32]
+
+
+class DocumentConflictError(Exception):
+    """乐观并发检查失败：文档已被其他写入者修改"""
+
+    def __init__(self, filename: str, current_hash: Optional[str]):
+        super().__init__(f"Document '{filename}' was modified concurrently")
+        self.filename = filename
+        self.current_hash = current_hash
+
+
+class DocStore:
+    """
+    docs/ 目录的存储层，API 与 scripts/save.py 共用
+    - 写入：临时文件 + fsync + os.replace，崩溃时不会留下半截文档
+    - 同一文件名的写入/删除串行化：进程内 threading 锁 + 跨进程 fcntl 文件锁
+      进程内的锁按引用计数，没人使用时即从表中移除；文档删除时连同锁文件一起删除
+    - expected_hash 提供乐观并发控制（对应 HTTP If-Match）
+    - 挂接 RevisionStore 时，在同一把锁下先记录磁盘上的旧内容、新内容落盘后再记录新版本，覆盖不会丢失旧内容
+    - 文件位置由 DocLayout 决定（平铺或哈希分片）；写入落到当前布局的位置，并清掉旧位置上的副本
+    """
+
+    def __init__(self, docs_dir: str, revisions=None):
+        self.docs_dir = docs_dir
+        self.revisions = revisions
+        self.layout = DocLayout(docs_dir)
+        self.lock_dir = os.path.join(docs_dir, LOCK_DIR_NAME)
+        self._locks_guard = threading.Lock()
+        # 文件名 -> [锁, 正在使用/等待它的线程数]
+        self._locks: Dict[str, List] = {}
+        os.makedirs(self.lock_dir, exist_ok=True)
+
+    # ---- 路径 ----
+
+    @staticmethod
+    def is_valid_name(filename: str) -> bool:
+        return bool(filename) and not (".." in filename or "/" in filename or "\\" in filename)
+
+    def path(self, filename: str) -> str:
+        """文档在当前布局下的磁盘路径（写入位置）；非法文件名抛出 ValueError"""
+        self._check_name(filename)
+        return self.layout.path(filename)
+
+    def locate(self, filename: str) -> str:
+        """文档实际所在的磁盘路径（迁移中途可能还在旧位置）；非法文件名抛出 ValueError"""
+        self._check_name(filename)
+        return self.layout.locate(filename)
+
+    def exists(self, filename: str) -> bool:
+        return os.path.isfile(self.locate(filename))
+
+    def _check_name(self, filename: str) -> None:
+        if not self.is_valid_name(filename):
+            raise ValueError(f"Invalid filename: {filename!r}")
+
+    # ---- 读取 ----
+
+    def read(self, filename: str) -> str:
+        with open(self.locate(filename), 'r', encoding='utf-8') as f:
+            return f.read()
+
+    def read_bytes(self, filename: str) -> Optional[bytes]:
+        """当前内容；文件不存在时返回 None"""
+        try:
+            with open(self.locate(filename), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def hash(self, filename: str) -> Optional[str]:
+        """当前内容的哈希；文件不存在时返回 None"""
+        data = self.read_bytes(filename)
+        return content_hash(data) if data is not None else None
+
+    # ---- 写入 ----
+
+    def lock_path(self, filename: str) -> str:
+        return os.path.join(self.lock_dir, shard_prefix(filename, *LOCK_SHARD), f"{filename}.lock")
+
+    @contextmanager
+    def lock(self, filename: str) -> Iterator[None]:
+        """同一文件名的互斥锁（进程内 + 跨进程）"""
+        with self._locks_guard:
+            entry = self._locks.setdefault(filename, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                if fcntl is None:
+                    yield
+                    return
+                lock_file = self._lock_file(filename)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+                    lock_file.close()
+        finally:
+            with self._locks_guard:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._locks[filename]
+
+    def _lock_file(self, filename: str):
+        """
+        打开并锁住锁文件；锁文件可能在等待期间被 delete 删除（持锁者删的），
+        此时锁住的是已脱离目录的旧 inode，需要重新打开路径上的新文件再锁
+        """
+        path = self.lock_path(filename)
+        while True:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            lock_file = open(path, 'a')
+            try:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+                if os.stat(path).st_ino == os.fstat(lock_file.fileno()).st_ino:
+                    return lock_file
+            except FileNotFoundError:
+                pass
+            except BaseException:
+                lock_file.close()
+                raise
+            lock_file.close()
+
+    def write(self, filename: str, content: str, overwrite: bool = True,
+              expected_hash: Optional[str] = None) -> str:
+        """
+        原子写入文档，返回新内容的哈希
+        - overwrite=False 且文件已存在：FileExistsError
+        - expected_hash 与当前内容不符：DocumentConflictError（"*" 表示只要求文件存在）
+        """
+        touched: Set[str] = set()
+        try:
+            return self._write(filename, content, overwrite, expected_hash, touched)
+        finally:
+            self._fsync_dirs(touched)
+
+    def write_many(self, items: Iterable[Tuple[str, str]], overwrite: bool = True) -> Dict[str, Optional[str]]:
+        """
+        批量写入 (文件名, 内容)：每个文件仍然各自原子落盘，目录只在最后 fsync 一次
+        返回 文件名 -> 新内容哈希；overwrite=False 时已存在的文件被跳过，对应的值为 None
+        """
+        results: Dict[str, Optional[str]] = {}
+        touched: Set[str] = set()
+        try:
+            for filename, content in items:
+                try:
+                    results[filename] = self._write(filename, content, overwrite, None, touched)
+                except FileExistsError:
+                    results[filename] = None
+        finally:
+            self._fsync_dirs(touched)
+        return results
+
+    def _write(self, filename: str, content: str, overwrite: bool, expected_hash: Optional[str],
+               touched: Set[str]) -> str:
+        """write 的主体（不同步目录，改动过的目录记入 touched）"""
+        self._check_name(filename)
+        data = content.encode('utf-8')
+        with self.lock(filename):
+            # 在锁内解析路径：与 relocate 串行，布局切换后不会写回旧位置
+            path = self.layout.path(filename)
+            old = self.read_bytes(filename) if expected_hash is not None or self.revisions is not None else None
+            if expected_hash is not None:
+                current = content_hash(old) if old is not None else None
+                if current is None or (expected_hash != "*" and expected_hash != current):
+                    raise DocumentConflictError(filename, current)
+            if not overwrite and (old is not None or self._exists_elsewhere(filename, path)):
+                raise FileExistsError(filename)
+
+            if self.revisions is not None and old is not None:
+                # 先保存磁盘上的旧内容（可能来自外部编辑）；记录失败则不写入
+                self.revisions.record(filename, old)
+
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            try:
+                with open(tmp_path, 'wb') as f:
+                    f.write(data)
+                    f.flush()
+                    os.fsync(f.fileno())
+                if overwrite:
+                    os.replace(tmp_path, path)
+                else:
+                    self._create_exclusive(tmp_path, path, filename)
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.unlink(tmp_path)
+                raise
+            touched.add(os.path.dirname(path))
+            if self.revisions is not None:
+                # 新内容落盘之后才记录版本：写入失败时历史里不会出现从未存在过的版本
+                # （这里记录失败时，下次写入/删除会把磁盘上的内容当作旧内容补记）
+                self.revisions.record(filename, data)
+            # 旧布局下的副本（迁移中途写入的文档）：新内容已落盘，删掉以免读到旧版本
+            for stale in self.layout.candidates(filename)[1:]:
+                if self._unlink(stale):
+                    touched.add(os.path.dirname(stale))
+        return content_hash(data)
+
+    def delete(self, filename: str, expected_hash: Optional[str] = None) -> None:
+        """删除文档；不存在时抛出 FileNotFoundError"""
+        self._check_name(filename)
+        with self.lock(filename):
+            old = self.read_bytes(filename) if expected_hash is not None or self.revisions is not None else None
+            if expected_hash is not None and expected_hash != "*" and old is not None:
+                current = content_hash(old)
+                if current != expected_hash:
+                    raise DocumentConflictError(filename, current)
+            if old is not None and self.revisions is not None:
+                # 删除前确保最后的内容在历史中
+                self.revisions.record(filename, old)
+            touched = {os.path.dirname(path) for path in self.layout.candidates(filename) if self._unlink(path)}
+            # 持锁时删除锁文件：等待者锁住旧 inode 后会发现它已被删除，改用新建的锁文件
+            if fcntl is not None:
+                self._unlink(self.lock_path(filename))
+            if not touched:
+                raise FileNotFoundError(filename)
+            self._fsync_dirs(touched)
+
+    def relocate(self, filename: str) -> bool:
+        """
+        把文档移到当前布局下的位置（scripts/reshard.py 使用）；已在正确位置或不存在时返回 False
+        rename 保留 inode 与 mtime，各索引按 size/mtime 对账，不会因为迁移而重建
+        """
+        self._check_name(filename)
+        with self.lock(filename):
+            target = self.layout.path(filename)
+            source = self.layout.locate(filename)
+            if source == target or not os.path.isfile(source):
+                return False
+            touched = {os.path.dirname(source), os.path.dirname(target)}
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.replace(source, target)
+            # 其他旧位置上若还有副本，都比刚移过来的这份更旧（写入总会清掉副本）
+            for stale in self.layout.candidates(filename)[1:]:
+                if self._unlink(stale):
+                    touched.add(os.path.dirname(stale))
+            self._fsync_dirs(touched)
+        return True
+
+    def remove_legacy_locks(self) -> int:
+        """
+        清理旧版本平铺在 .locks/ 根目录下的锁文件（scripts/reshard.py 使用），返回删除的个数
+        只删除当前没有被持有的（非阻塞加锁成功后再删除）
+        """
+        if fcntl is None:
+            return 0
+        removed = 0
+        with os.scandir(self.lock_dir) as it:
+            entries = [entry.path for entry in it if entry.name.endswith(".lock") and entry.is_file()]
+        for path in entries:
+            try:
+                with open(path, 'a') as lock_file:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    os.remove(path)
+                    removed += 1
+            except OSError:
+                continue
+        return removed
+
+    def _exists_elsewhere(self, filename: str, path: str) -> bool:
+        """旧布局的位置上是否有这篇文档（当前位置由 _create_exclusive 检查）"""
+        return any(os.path.isfile(other) for other in self.layout.candidates(filename) if other != path)
+
+    @staticmethod
+    def _unlink(path: str) -> bool:
+        try:
+            os.remove(path)
+            return True
+        except FileNotFoundError:
+            return False
+
+    @staticmethod
+    def _create_exclusive(tmp_path: str, path: str, filename: str) -> None:
+        """不覆盖地落盘：link 在目标已存在时失败，即使有不走本存储层的写入者也安全"""
+        if os.path.exists(path):
+            os.unlink(tmp_path)
+            raise FileExistsError(filename)
+        try:
+            os.link(tmp_path, path)
+        except FileExistsError:
+            os.unlink(tmp_path)
+            raise FileExistsError(filename)
+        except OSError:
+            # 文件系统不支持硬链接：已持有文件锁，退化为 replace
+            os.replace(tmp_path, path)
+            return
+        os.unlink(tmp_path)
+
+    @staticmethod
+    def _fsync_dirs(directories: Iterable[str]) -> None:
+        """持久化目录项（rename/unlink），不支持的平台上忽略"""
+        if not hasattr(os, "O_DIRECTORY"):
+            return
+        for directory in directories:
+            fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
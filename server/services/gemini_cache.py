@@ -0,0 +1,284 @@
+import glob
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Callable, Iterable, Optional, Tuple
+
+# 默认策略：缓存7天，最多占用256MB / 5000个分享
+DEFAULT_TTL = float(os.environ.get("GEMINI_CACHE_TTL", str(7 * 24 * 3600)))
+DEFAULT_MAX_BYTES = int(os.environ.get("GEMINI_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+DEFAULT_MAX_ENTRIES = int(os.environ.get("GEMINI_CACHE_MAX_ENTRIES", "5000"))
+# 写入原始文本时每次编码的字符数（大响应不会整段编码成 bytes）
+WRITE_CHUNK_CHARS = 1 << 18
+
+
+class GeminiCache:
+    """
+    Gemini分享抓取结果的磁盘缓存
+    - 原始batchexecute文本与解析结果按内容哈希存放在 objects/ 下（相同内容只存一份）
+    - 解析结果的文件名带解析器版本（<哈希>.p<版本>.json）：解析器升级后不会读到旧的解析结果，
+      而是用缓存的原始文本重新解析（给了 parse 时），不必重新请求上游
+    - index.db 记录 share_id -> 内容哈希、写入时间、最近访问时间
+    - 过期（TTL）条目读取时视为未命中；超出容量时按最近访问时间做LRU淘汰
+    """
+
+    def __init__(self, root: str, ttl: float = DEFAULT_TTL,
+                 max_bytes: int = DEFAULT_MAX_BYTES, max_entries: int = DEFAULT_MAX_ENTRIES,
+                 parser_version: int = 0, parse: Optional[Callable[[str], dict]] = None):
+        self.root = root
+        self.objects_dir = os.path.join(root, "objects")
+        self.parser_version = parser_version
+        self.parse = parse
+        self._parsed_suffix = f".p{parser_version}.json"
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+
+        os.makedirs(self.objects_dir, exist_ok=True)
+        self._db = sqlite3.connect(os.path.join(root, "index.db"), check_same_thread=False, timeout=30)
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS entries (
+                share_id TEXT PRIMARY KEY,
+                digest TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+        """)
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_entries_accessed ON entries(accessed_at)")
+        self._db.commit()
+
+    def get(self, share_id: str) -> Optional[dict]:
+        """返回缓存的解析结果 {title, turns}，未命中或已过期返回None"""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT digest, created_at FROM entries WHERE share_id = ?", (share_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            digest, created_at = row
+            if self.ttl and time.time() - created_at > self.ttl:
+                self._remove(share_id, digest)
+                self._db.commit()
+                return None
+            try:
+                with open(self._object_path(digest, self._parsed_suffix), "r", encoding="utf-8") as f:
+                    parsed = json.load(f)
+            except FileNotFoundError:
+                # 还没有当前解析器版本的结果：用原始文本重新解析
+                parsed = self._reparse(digest)
+                if parsed is None:
+                    self._remove(share_id, digest)
+                    self._db.commit()
+                    return None
+            except (OSError, ValueError):
+                # 对象文件损坏，当作未命中
+                self._remove(share_id, digest)
+                self._db.commit()
+                return None
+            self._db.execute(
+                "UPDATE entries SET accessed_at = ? WHERE share_id = ?", (time.time(), share_id)
+            )
+            self._db.commit()
+            return parsed
+
+    def get_raw(self, share_id: str) -> Optional[str]:
+        """返回缓存的原始batchexecute响应文本"""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT digest FROM entries WHERE share_id = ?", (share_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        try:
+            with open(self._object_path(row[0], ".raw.txt"), "r", encoding="utf-8") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def put(self, share_id: str, raw_text: str, parsed: dict, created_at: Optional[float] = None) -> None:
+        """写入一条缓存，并在超出容量时淘汰最久未访问的条目"""
+        digest, raw_size = self.write_raw([raw_text])
+        self.put_parsed(share_id, digest, raw_size, parsed, created_at)
+
+    def write_raw(self, parts: Iterable[str]) -> Tuple[str, int]:
+        """
+        分段写入原始响应文本（各段依次拼接），返回 (内容哈希, 字节数)
+        按块编码、边写边算哈希，不会生成整段文本的 bytes 副本；之后须用 put_parsed 登记
+        """
+        hasher = hashlib.sha256()
+        size = 0
+        tmp_path = os.path.join(self.objects_dir, f"raw.{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            with open(tmp_path, "wb") as f:
+                for part in parts:
+                    for start in range(0, len(part), WRITE_CHUNK_CHARS):
+                        chunk = part[start:start + WRITE_CHUNK_CHARS].encode("utf-8")
+                        hasher.update(chunk)
+                        f.write(chunk)
+                        size += len(chunk)
+            digest = hasher.hexdigest()
+            path = self._object_path(digest, ".raw.txt")
+            if os.path.exists(path):
+                self._unlink(tmp_path)
+            else:
+                os.replace(tmp_path, path)
+        except BaseException:
+            self._unlink(tmp_path)
+            raise
+        return digest, size
+
+    def put_parsed(self, share_id: str, digest: str, raw_size: int, parsed: dict,
+                   created_at: Optional[float] = None) -> None:
+        """登记 write_raw 写入的原始文本及其解析结果（解析结果直接流式写入文件）"""
+        now = time.time()
+        with self._lock:
+            if not os.path.exists(self._object_path(digest, ".raw.txt")):
+                # 写入后、登记前被淘汰（同内容的另一条目恰好被删除）：放弃这次缓存
+                return
+            parsed_size = self._write_json(digest, self._parsed_suffix, parsed)
+
+            old = self._db.execute(
+                "SELECT digest FROM entries WHERE share_id = ?", (share_id,)
+            ).fetchone()
+            self._db.execute(
+                "INSERT OR REPLACE INTO entries (share_id, digest, size, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (share_id, digest, raw_size + parsed_size, created_at or now, now)
+            )
+            if old and old[0] != digest:
+                self._drop_object_if_orphan(old[0])
+            self._evict()
+            self._db.commit()
+
+    def invalidate(self, share_id: str) -> None:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT digest FROM entries WHERE share_id = ?", (share_id,)
+            ).fetchone()
+            if row:
+                self._remove(share_id, row[0])
+                self._db.commit()
+
+    def seed_from_dir(self, data_dir: str, parse_func) -> int:
+        """
+        从 batch_validate.py 保存的 *_raw.txt 样本预热缓存
+        parse_func: 原始文本 -> {title, turns}；解析失败的样本会被跳过
+        返回新写入的条目数
+        """
+        if not os.path.isdir(data_dir):
+            return 0
+
+        seeded = 0
+        for name in os.listdir(data_dir):
+            if not name.endswith("_raw.txt"):
+                continue
+            share_id = name[:-len("_raw.txt")]
+            with self._lock:
+                exists = self._db.execute(
+                    "SELECT 1 FROM entries WHERE share_id = ?", (share_id,)
+                ).fetchone()
+            if exists:
+                continue
+            try:
+                with open(os.path.join(data_dir, name), "r", encoding="utf-8") as f:
+                    raw_text = f.read()
+                parsed = parse_func(raw_text)
+            except Exception:
+                continue
+            self.put(share_id, raw_text, parsed)
+            seeded += 1
+        return seeded
+
+    def stats(self) -> dict:
+        with self._lock:
+            count, total = self._db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries"
+            ).fetchone()
+        return {"entries": count, "bytes": total, "max_entries": self.max_entries, "max_bytes": self.max_bytes}
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+    def _object_path(self, digest: str, suffix: str) -> str:
+        return os.path.join(self.objects_dir, f"{digest}{suffix}")
+
+    def _reparse(self, digest: str) -> Optional[dict]:
+        """用原始文本生成当前版本的解析结果（调用方持有 _lock）；没有 parse、原始文本缺失或解析失败时返回 None"""
+        if self.parse is None:
+            return None
+        try:
+            raw_path = self._object_path(digest, ".raw.txt")
+            with open(raw_path, "r", encoding="utf-8") as f:
+                raw_text = f.read()
+            parsed = self.parse(raw_text)
+            del raw_text
+            raw_size = os.path.getsize(raw_path)
+        except Exception:
+            return None
+        parsed_size = self._write_json(digest, self._parsed_suffix, parsed)
+        self._db.execute("UPDATE entries SET size = ? WHERE digest = ?", (raw_size + parsed_size, digest))
+        # 旧版本的解析结果不会再被读取
+        for path in self._parsed_objects(digest):
+            if not path.endswith(self._parsed_suffix):
+                self._unlink(path)
+        return parsed
+
+    def _parsed_objects(self, digest: str):
+        return glob.glob(os.path.join(glob.escape(self.objects_dir), f"{digest}*.json"))
+
+    @staticmethod
+    def _unlink(path: str) -> None:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def _write_json(self, digest: str, suffix: str, obj: dict) -> int:
+        """流式写入 JSON 对象文件（不先生成整段字符串），返回文件字节数"""
+        path = self._object_path(digest, suffix)
+        try:
+            return os.path.getsize(path)
+        except FileNotFoundError:
+            pass
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(obj, f, ensure_ascii=False)
+            size = f.tell()
+        os.replace(tmp_path, path)
+        return size
+
+    def _remove(self, share_id: str, digest: str) -> None:
+        self._db.execute("DELETE FROM entries WHERE share_id = ?", (share_id,))
+        self._drop_object_if_orphan(digest)
+
+    def _drop_object_if_orphan(self, digest: str) -> None:
+        still_used = self._db.execute(
+            "SELECT 1 FROM entries WHERE digest = ? LIMIT 1", (digest,)
+        ).fetchone()
+        if still_used:
+            return
+        self._unlink(self._object_path(digest, ".raw.txt"))
+        for path in self._parsed_objects(digest):
+            self._unlink(path)
+
+    def _evict(self) -> None:
+        count, total = self._db.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries"
+        ).fetchone()
+        if count <= self.max_entries and total <= self.max_bytes:
+            return
+        rows = self._db.execute(
+            "SELECT share_id, digest, size FROM entries ORDER BY accessed_at ASC"
+        ).fetchall()
+        for share_id, digest, size in rows:
+            if count <= self.max_entries and total <= self.max_bytes:
+                break
+            self._remove(share_id, digest)
+            count -= 1
+            total -= size
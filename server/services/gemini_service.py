@@ -1,10 +1,28 @@
+import asyncio
+import os
 import requests
-import json
+import httpx
 import re
-from typing import Optional
+import time
+from typing import Optional, Tuple
 
-# Gemini分享链接的RPC端点
-BASE_URL = "https://gemini.google.com/_/BardChatUi/data/batchexecute"
+from .gemini_cache import GeminiCache
+from .batchexecute import (
+    afind_payload, aiter_lines, find_payload, iter_lines, parse_payload, parse_text, wrap_payload_parts
+)
+from .metrics import (
+    GEMINI_CACHE_LOOKUPS, GEMINI_CIRCUIT_TRANSITIONS, GEMINI_COALESCED, GEMINI_FETCH_ERRORS,
+    GEMINI_FETCH_SECONDS, GEMINI_RESPONSE_BYTES, GEMINI_UPSTREAM_REJECTIONS, failure_reason, span
+)
+from .upstream import (
+    AdmissionQueue, CircuitBreaker, InflightRequests, UpstreamBusyError, UpstreamUnavailableError
+)
+
+# Gemini分享链接的RPC端点（可用环境变量指向本地stub服务器做测试）
+BASE_URL = os.environ.get(
+    "GEMINI_BATCHEXECUTE_URL",
+    "https://gemini.google.com/_/BardChatUi/data/batchexecute"
+)
 
 # 最小化的查询参数（已验证有效）
 QUERY_PARAMS_TEMPLATE = {
@@ -20,7 +38,47 @@ HEADERS = {
     "cookie": "_gcl_au=1.1.1678809549.1769051420; NID=528=XZyVJ9pubNj3FwezA4SUDWyr3CJLvv829fBf4Y_vsT30EKqIwlcX-yHsPI8Wzml-HwQfpMmoY5cS3EfMukb3pxoI_Ff2r7S_DP6owRZ_LkP7Y0AsCA2RGizxQ3tcCav7L63nmmiyq44LSZx-pvNmopVxXa4b0tUNIcr6KsaJqgFIbOOiCFDcBodklSEe8Zwl20x4KkciT_oWI78; _ga_WC57KJ50ZZ=GS2.1.s1769051419$o1$g0$t1769051419$j60$l0$h0; _ga=GA1.1.946165692.1769051420; COMPASS=gemini-pd=CjwACWuJV93jFYb_b6k1ZbZc5AVi75OXfwVJx6huPFdJgLZgT-iphNSBtyIyTho-2Gurv4U86El7hPmdVFUQnM3LywYaTQAJa4lXIkN3sOK5jSzDLo2KoxQKl9Bgki7C7N4fLHso4yScK57z7OtHDPXawsZ63IvG9HHHWfhbYkNI8LQLixZ0PclguOc_5RUrTwfQIAEwAQ; _ga_BF8Q35BMLM=GS2.1.s1769051420$o1$g0$t1769051420$j60$l0$h0"
 }
 
+# 异步客户端的连接池/并发/超时配置（进程级共享；超时同样用于同步抓取）
+CLIENT_SETTINGS = {
+    "max_concurrency": int(os.environ.get("GEMINI_MAX_CONCURRENCY", "8")),
+    "max_connections": int(os.environ.get("GEMINI_MAX_CONNECTIONS", "20")),
+    "max_keepalive": int(os.environ.get("GEMINI_MAX_KEEPALIVE", "10")),
+    "keepalive_expiry": float(os.environ.get("GEMINI_KEEPALIVE_EXPIRY", "30")),
+    "connect_timeout": float(os.environ.get("GEMINI_CONNECT_TIMEOUT", "5")),
+    "read_timeout": float(os.environ.get("GEMINI_READ_TIMEOUT", "20")),
+    # 上游保护：连续失败这么多次后熔断，熔断后每隔 breaker_reset_timeout 秒放行一个探测请求
+    "breaker_failures": int(os.environ.get("GEMINI_BREAKER_FAILURES", "5")),
+    "breaker_reset_timeout": float(os.environ.get("GEMINI_BREAKER_RESET_TIMEOUT", "30")),
+    # 并发名额用满后最多排队的请求数、最长排队秒数；超出即返回 429
+    "max_queue": int(os.environ.get("GEMINI_MAX_QUEUE", "32")),
+    "queue_timeout": float(os.environ.get("GEMINI_QUEUE_TIMEOUT", "10")),
+}
+
+
+def is_upstream_failure(exc: BaseException) -> bool:
+    """
+    是否计入熔断：超时、连接失败、被拒绝（401/403，例如 cookie 失效）、限流（429）、服务端错误
+    单个分享找不到数据帧或解析失败只与这条链接有关，说明上游本身是通的
+    """
+    reason = failure_reason(exc)
+    if reason in ("timeout", "network"):
+        return True
+    if reason.startswith("http_"):
+        status = int(reason[len("http_"):])
+        return status in (401, 403, 429) or status >= 500
+    return False
+
 class GeminiService:
+    # 进程内复用的 keep-alive 客户端与并发闸门，首次使用时在事件循环内创建
+    _client: Optional[httpx.AsyncClient] = None
+    _admission: Optional[AdmissionQueue] = None
+    # 同一 share_id 的并发抓取合并为一个上游请求
+    _inflight: Optional[InflightRequests] = None
+    # 同步与异步抓取共用的熔断器
+    _breaker: Optional[CircuitBreaker] = None
+    # 可选的磁盘缓存，由应用启动时注入
+    cache: Optional[GeminiCache] = None
+
     @staticmethod
     def extract_id(url: str) -> Optional[str]:
         """从Gemini分享链接中提取share ID"""
@@ -28,16 +86,241 @@ class GeminiService:
         return match.group(1) if match else None
 
     @staticmethod
-    def fetch_conversation(share_url: str) -> dict:
+    def fetch_conversation(share_url: str, force_refresh: bool = False) -> dict:
         """
         从Gemini分享链接获取对话内容
-        返回: {'title': str, 'content': str, 'turns': list}
+        返回: {'title': str, 'turns': list}
         """
         share_id = GeminiService.extract_id(share_url)
         if not share_id:
             raise ValueError("Invalid Gemini Share URL")
 
-        # 构建请求参数（完全按照batch_validate.py的方式）
+        cache = GeminiService.cache
+        if cache is not None and not force_refresh:
+            cached = cache.get(share_id)
+            GEMINI_CACHE_LOOKUPS.inc(result="miss" if cached is None else "hit")
+            if cached is not None:
+                return cached
+
+        breaker = GeminiService._get_breaker()
+        GeminiService._acquire_breaker(breaker)
+        params, payload = GeminiService._build_request(share_id)
+        
+        answered = False
+        try:
+            start = time.perf_counter()
+            # requests 的 (连接, 读取) 超时与异步客户端的 httpx.Timeout 取自同一份配置
+            timeout = (CLIENT_SETTINGS["connect_timeout"], CLIENT_SETTINGS["read_timeout"])
+            with span("fetch"), requests.post(BASE_URL, params=params, data=payload, headers=HEADERS,
+                                              timeout=timeout, stream=True) as resp:
+                if resp.status_code != 200:
+                    raise Exception(f"Google API returned HTTP {resp.status_code}")
+                resp.encoding = resp.encoding or 'utf-8'
+                # 边接收边切帧，只保留 wrb.fr 数据帧
+                frame = find_payload(iter_lines(resp.iter_content(chunk_size=65536, decode_unicode=True)))
+                GEMINI_RESPONSE_BYTES.observe(resp.raw.tell())
+            GEMINI_FETCH_SECONDS.observe(time.perf_counter() - start, client="sync")
+            breaker.record_success()
+            answered = True
+
+            holder = [frame]
+            del frame
+            return GeminiService._decode_frame(share_id, holder, cache)
+            
+        except Exception as e:
+            GEMINI_FETCH_ERRORS.inc(reason=failure_reason(e))
+            if not answered:
+                GeminiService._record_failure(breaker, e)
+            raise Exception(f"Failed to fetch conversation: {str(e)}")
+        except BaseException:
+            if not answered:
+                breaker.abandon()
+            raise
+
+    @staticmethod
+    async def fetch_conversation_async(share_url: str, force_refresh: bool = False) -> dict:
+        """
+        fetch_conversation 的异步版本，走共享连接池，不阻塞事件循环
+        返回: {'title': str, 'turns': list}
+        """
+        share_id = GeminiService.extract_id(share_url)
+        if not share_id:
+            raise ValueError("Invalid Gemini Share URL")
+
+        cache = GeminiService.cache
+        if cache is not None and not force_refresh:
+            cached = await asyncio.to_thread(cache.get, share_id)
+            GEMINI_CACHE_LOOKUPS.inc(result="miss" if cached is None else "hit")
+            if cached is not None:
+                return cached
+
+        # 同一分享的并发导入共用一个上游请求（包括 force_refresh：等到的也是刚抓取的结果）
+        inflight = GeminiService._get_inflight()
+        if inflight.pending(share_id):
+            GEMINI_COALESCED.inc()
+        return await inflight.run(share_id, lambda: GeminiService._fetch_upstream(share_id, cache))
+
+    @staticmethod
+    async def _fetch_upstream(share_id: str, cache: Optional[GeminiCache]) -> dict:
+        """
+        真正请求上游：熔断打开时立即失败（UpstreamUnavailableError），
+        并发名额与排队都满了时立即失败（UpstreamBusyError），不再等到超时
+        """
+        breaker = GeminiService._get_breaker()
+        GeminiService._acquire_breaker(breaker)
+        params, payload = GeminiService._build_request(share_id)
+        client = GeminiService.get_client()
+
+        answered = False
+        try:
+            async with GeminiService._get_admission().slot():
+                # 计时从拿到并发名额开始，排队时间不算在抓取延迟里
+                start = time.perf_counter()
+                with span("fetch"):
+                    async with client.stream("POST", BASE_URL, params=params, data=payload) as resp:
+                        if resp.status_code != 200:
+                            raise Exception(f"Google API returned HTTP {resp.status_code}")
+                        # 边接收边切帧，只保留 wrb.fr 数据帧
+                        frame = await afind_payload(aiter_lines(resp.aiter_text()))
+                        GEMINI_RESPONSE_BYTES.observe(resp.num_bytes_downloaded)
+                GEMINI_FETCH_SECONDS.observe(time.perf_counter() - start, client="async")
+            breaker.record_success()
+            answered = True
+
+            # 大响应的JSON解析是CPU密集的，放到线程里避免卡住事件循环
+            holder = [frame]
+            del frame
+            return await asyncio.to_thread(GeminiService._decode_frame, share_id, holder, cache)
+
+        except UpstreamBusyError:
+            breaker.abandon()
+            GEMINI_UPSTREAM_REJECTIONS.inc(reason="queue_full")
+            raise
+        except Exception as e:
+            GEMINI_FETCH_ERRORS.inc(reason=failure_reason(e))
+            if not answered:
+                GeminiService._record_failure(breaker, e)
+            raise Exception(f"Failed to fetch conversation: {str(e)}")
+        except BaseException:
+            if not answered:
+                breaker.abandon()
+            raise
+
+    @staticmethod
+    def upstream_status() -> dict:
+        """熔断器与排队情况（/health 展示）"""
+        admission = GeminiService._admission
+        return {
+            "circuit": GeminiService._get_breaker().snapshot(),
+            "queue": admission.snapshot() if admission is not None else None,
+        }
+
+    @staticmethod
+    def configure(**settings) -> None:
+        """调整连接池/并发/超时配置，须在首次请求前调用（或在 aclose 之后）"""
+        unknown = set(settings) - set(CLIENT_SETTINGS)
+        if unknown:
+            raise ValueError(f"Unknown client settings: {', '.join(sorted(unknown))}")
+        CLIENT_SETTINGS.update(settings)
+        # 熔断参数在下次抓取时按新配置生效
+        GeminiService._breaker = None
+
+    @staticmethod
+    def get_client() -> httpx.AsyncClient:
+        """返回进程级共享的 AsyncClient，连接在多次导入之间保持复用"""
+        if GeminiService._client is None or GeminiService._client.is_closed:
+            GeminiService._client = httpx.AsyncClient(
+                headers=HEADERS,
+                limits=httpx.Limits(
+                    max_connections=CLIENT_SETTINGS["max_connections"],
+                    max_keepalive_connections=CLIENT_SETTINGS["max_keepalive"],
+                    keepalive_expiry=CLIENT_SETTINGS["keepalive_expiry"],
+                ),
+                timeout=httpx.Timeout(
+                    CLIENT_SETTINGS["read_timeout"],
+                    connect=CLIENT_SETTINGS["connect_timeout"],
+                ),
+            )
+        return GeminiService._client
+
+    @staticmethod
+    async def aclose() -> None:
+        """关闭共享客户端（应用退出时调用）"""
+        if GeminiService._client is not None:
+            await GeminiService._client.aclose()
+        GeminiService._client = None
+        GeminiService._admission = None
+        GeminiService._inflight = None
+
+    @staticmethod
+    def _get_admission() -> AdmissionQueue:
+        if GeminiService._admission is None:
+            GeminiService._admission = AdmissionQueue(
+                CLIENT_SETTINGS["max_concurrency"],
+                max_waiting=CLIENT_SETTINGS["max_queue"],
+                max_wait=CLIENT_SETTINGS["queue_timeout"],
+            )
+        return GeminiService._admission
+
+    @staticmethod
+    def _get_inflight() -> InflightRequests:
+        if GeminiService._inflight is None:
+            GeminiService._inflight = InflightRequests()
+        return GeminiService._inflight
+
+    @staticmethod
+    def _get_breaker() -> CircuitBreaker:
+        if GeminiService._breaker is None:
+            breaker = CircuitBreaker(
+                failure_threshold=CLIENT_SETTINGS["breaker_failures"],
+                reset_timeout=CLIENT_SETTINGS["breaker_reset_timeout"],
+            )
+            breaker.add_listener(lambda state: GEMINI_CIRCUIT_TRANSITIONS.inc(state=state))
+            GeminiService._breaker = breaker
+        return GeminiService._breaker
+
+    @staticmethod
+    def _acquire_breaker(breaker: CircuitBreaker) -> None:
+        try:
+            breaker.acquire()
+        except UpstreamUnavailableError:
+            GEMINI_UPSTREAM_REJECTIONS.inc(reason="circuit_open")
+            raise
+
+    @staticmethod
+    def _record_failure(breaker: CircuitBreaker, exc: BaseException) -> None:
+        if is_upstream_failure(exc):
+            breaker.record_failure()
+        elif failure_reason(exc) == "internal":
+            # 本地的代码错误：没有得到上游的结论，既不计入失败也不当作恢复
+            breaker.abandon()
+        else:
+            breaker.record_success()
+
+    @staticmethod
+    def _decode_frame(share_id: str, holder: list, cache: Optional[GeminiCache]) -> dict:
+        """
+        解析数据帧并写入缓存，返回 {'title', 'turns'}
+        数据帧由 holder 交出（调用方不再持有引用），各个大字符串用完即释放：
+        - 解码出内层JSON文本后，数据帧分段写入缓存（包装成最小的 rt=c 响应，可被同一解析器重新解析），随即丢弃
+        - 轮次逐个解码出来后丢弃内层文本，解析结果流式写入缓存
+        峰值约为数据帧的两倍（数据帧与内层文本同时存在的那一刻）
+        """
+        frame = holder.pop()
+        conversation = parse_payload(frame)
+        digest = raw_size = None
+        if cache is not None:
+            digest, raw_size = cache.write_raw(wrap_payload_parts(frame))
+        del frame
+        result = conversation.to_dict()
+        del conversation
+        if cache is not None:
+            cache.put_parsed(share_id, digest, raw_size, result)
+        return result
+
+    @staticmethod
+    def _build_request(share_id: str) -> Tuple[dict, dict]:
+        """构建batchexecute请求的查询参数与表单（完全按照batch_validate.py的方式）"""
         params = QUERY_PARAMS_TEMPLATE.copy()
         params["source-path"] = f"/share/{share_id}"
         
@@ -47,106 +330,10 @@ class GeminiService:
             "f.req": f'[[["ujx1Bf","{inner_req.replace(chr(34), chr(92)+chr(34))}",null,"generic"]]]',
             "at": ""
         }
-        
-        try:
-            resp = requests.post(BASE_URL, params=params, data=payload, headers=HEADERS, timeout=20)
-            if resp.status_code != 200:
-                raise Exception(f"Google API returned HTTP {resp.status_code}")
-                
-            return GeminiService._parse_response(resp.text)
-            
-        except Exception as e:
-            raise Exception(f"Failed to fetch conversation: {str(e)}")
+        return params, payload
 
     @staticmethod
     def _parse_response(raw_text: str) -> dict:
-        """解析Gemini RPC响应，提取对话内容（完全按照parse_raw_to_md.py的逻辑）"""
-        lines = raw_text.split('\n')
-        target_line = None
-        
-        # 找到包含 wrb.fr 的行（取最后一行）
-        for line in reversed(lines):
-            if 'wrb.fr' in line:
-                match = re.search(r'(\[\["wrb\.fr".*)$', line)
-                if match:
-                    target_line = match.group(1)
-                    break
-        
-        if not target_line:
-            raise ValueError("Could not find data payload in response")
-        
-        try:
-            # 解析外层JSON
-            outer_data = json.loads(target_line)
-            inner_json_str = outer_data[0][2]
-            inner_data = json.loads(inner_json_str)
-            
-            # 提取标题
-            title = "Gemini对话记录"
-            try:
-                if len(inner_data[0]) > 2:
-                    title_node = inner_data[0][2]
-                    if isinstance(title_node, list) and len(title_node) > 1:
-                        title = str(title_node[1])
-                    else:
-                        title = str(title_node)
-            except:
-                pass
-            
-            # 提取对话列表
-            conv_list = inner_data[0][1]
-            turns = []
-            markdown_lines = []
-            
-            for item in conv_list:
-                if not isinstance(item, list) or len(item) < 4:
-                    continue
-                
-                user_text = None
-                model_text = None
-                
-                # 提取User内容: item[2][0][0]
-                try:
-                    user_text = item[2][0][0]
-                except:
-                    pass
-                
-                # 提取Model内容 - 尝试多种路径
-                try:
-                    candidates = item[3]
-                    if isinstance(candidates, list) and len(candidates) > 0:
-                        first_node = candidates[0]
-                        if isinstance(first_node, list) and len(first_node) > 0:
-                            # 尝试路径 A: item[3][0][0][1][0]
-                            content_node = first_node[0]
-                            if isinstance(content_node, list) and len(content_node) > 1 and isinstance(content_node[1], list):
-                                model_text = content_node[1][0]
-                            # 尝试路径 B: item[3][0][1][0]
-                            elif len(first_node) > 1 and isinstance(first_node[1], list):
-                                model_text = first_node[1][0]
-                except:
-                    pass
-                
-                if user_text or model_text:
-                    turns.append({
-                        'user': user_text,
-                        'model': model_text
-                    })
-                    
-                    if user_text:
-                        markdown_lines.append(f"## 🙋‍♂️ User\n\n{user_text}\n")
-                    if model_text:
-                        markdown_lines.append(f"## 🤖 AI\n\n{model_text}\n")
-                    
-                    markdown_lines.append("---\n")
-            
-            return {
-                "title": title,
-                "content": "\n".join(markdown_lines),
-                "turns": turns
-            }
-            
-        except json.JSONDecodeError as e:
-            raise ValueError(f"Failed to decode JSON response: {str(e)}")
-        except Exception as e:
-            raise ValueError(f"Parsing error: {str(e)}")
+        """解析Gemini RPC响应，提取对话内容（与 parse_raw_to_md.py 共用 batchexecute 解析器）"""
+        with span("parse"):
+            return parse_text(raw_text).to_dict()
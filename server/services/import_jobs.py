@@ -0,0 +1,253 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Awaitable, Callable, Dict, List, Optional, Set
+
+# 任务处理函数：接收任务记录和进度回调 report(stage, progress)，返回可JSON序列化的结果
+JobHandler = Callable[[dict, Callable[[str, float], None]], Awaitable[dict]]
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+
+class ImportJobQueue:
+    """
+    后台导入任务队列
+    - 任务状态持久化在 SQLite 中，服务重启后 queued/running 的任务会重新排队
+    - 固定数量的 asyncio worker 并发执行，提交接口立即返回任务ID
+    - 多进程部署时只有一个进程调用 start 执行任务，其他进程只提交（写入数据库），
+      执行方每 poll_interval 秒从库里捡起别的进程提交的任务
+    - worker 与轮询的数据库读写都放到线程里（连接的 busy timeout 可达 30 秒，不能卡住事件循环）；
+      进度回调只记下最新进度，由每个任务一个的后台写入合并落库
+    """
+
+    def __init__(self, db_path: str, handler: JobHandler, workers: int = 4, poll_interval: float = 1.0):
+        self.db_path = db_path
+        self.handler = handler
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._queue: Optional[asyncio.Queue] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._tasks: List[asyncio.Task] = []
+        # 已放入本进程队列、尚未执行完的任务（避免轮询时重复入队）
+        self._enqueued: Set[str] = set()
+
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._db = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                batch_id TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL,
+                stage TEXT,
+                progress REAL NOT NULL DEFAULT 0,
+                result TEXT,
+                error TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        """)
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_jobs_batch ON jobs(batch_id)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, created_at)")
+        self._db.commit()
+
+    # ---- 生命周期 ----
+
+    async def start(self) -> None:
+        """恢复未完成的任务并启动 worker"""
+        self._queue = asyncio.Queue()
+        self._loop = asyncio.get_running_loop()
+        for job_id in await asyncio.to_thread(self._recover):
+            self._enqueue(job_id)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._poll()))
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queue = None
+        self._loop = None
+        self._enqueued.clear()
+
+    @property
+    def running(self) -> bool:
+        """本进程是否在执行任务"""
+        return bool(self._tasks)
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+    # ---- 提交与查询 ----
+
+    def submit(self, kind: str, payloads: List[dict]) -> dict:
+        """提交一批任务，返回 {batch_id, jobs: [{id, ...payload}]}"""
+        batch_id = uuid.uuid4().hex
+        now = time.time()
+        jobs = []
+        with self._lock:
+            for payload in payloads:
+                job_id = uuid.uuid4().hex
+                self._db.execute(
+                    "INSERT INTO jobs (id, batch_id, kind, payload, status, created_at, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (job_id, batch_id, kind, json.dumps(payload, ensure_ascii=False), QUEUED, now, now)
+                )
+                jobs.append({"id": job_id, **payload})
+            self._db.commit()
+        # 提交可能来自线程池：交给事件循环入队
+        loop = self._loop
+        if loop is not None:
+            for job in jobs:
+                try:
+                    loop.call_soon_threadsafe(self._enqueue, job["id"])
+                except RuntimeError:
+                    break  # 事件循环已关闭，下次启动时从库里恢复
+        return {"batch_id": batch_id, "jobs": jobs}
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            row = self._db.execute(f"SELECT {self._COLUMNS} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._to_dict(row) if row else None
+
+    def list(self, batch_id: Optional[str] = None, status: Optional[str] = None, limit: int = 100) -> List[dict]:
+        clauses, params = [], []
+        if batch_id:
+            clauses.append("batch_id = ?")
+            params.append(batch_id)
+        if status:
+            clauses.append("status = ?")
+            params.append(status)
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT {self._COLUMNS} FROM jobs{where} ORDER BY created_at DESC LIMIT ?",
+                (*params, limit)
+            ).fetchall()
+        return [self._to_dict(row) for row in rows]
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+
+    # ---- 内部 ----
+
+    _COLUMNS = ("id, batch_id, kind, payload, status, stage, progress, result, error, "
+                "attempts, created_at, updated_at")
+
+    @staticmethod
+    def _to_dict(row) -> dict:
+        (job_id, batch_id, kind, payload, status, stage, progress, result, error,
+         attempts, created_at, updated_at) = row
+        return {
+            "id": job_id,
+            "batch_id": batch_id,
+            "kind": kind,
+            "payload": json.loads(payload),
+            "status": status,
+            "stage": stage,
+            "progress": progress,
+            "result": json.loads(result) if result else None,
+            "error": error,
+            "attempts": attempts,
+            "created_at": created_at,
+            "updated_at": updated_at,
+        }
+
+    def _update(self, job_id: str, **fields) -> None:
+        fields["updated_at"] = time.time()
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._lock:
+            self._db.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+            self._db.commit()
+
+    def _recover(self) -> List[str]:
+        """上次退出时正在运行的任务从头再来；返回全部排队中的任务ID"""
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET status = ?, stage = NULL, progress = 0 WHERE status = ?", (QUEUED, RUNNING)
+            )
+            self._db.commit()
+        return self._queued_ids()
+
+    def _queued_ids(self) -> List[str]:
+        with self._lock:
+            return [row[0] for row in self._db.execute(
+                "SELECT id FROM jobs WHERE status = ? ORDER BY created_at", (QUEUED,)
+            )]
+
+    def _enqueue(self, job_id: str) -> None:
+        if self._queue is not None and job_id not in self._enqueued:
+            self._enqueued.add(job_id)
+            self._queue.put_nowait(job_id)
+
+    async def _poll(self) -> None:
+        """捡起其他进程提交的任务"""
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            for job_id in await asyncio.to_thread(self._queued_ids):
+                self._enqueue(job_id)
+
+    async def _worker(self) -> None:
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await self._run(job_id)
+            finally:
+                self._enqueued.discard(job_id)
+                self._queue.task_done()
+
+    async def _run(self, job_id: str) -> None:
+        job = await asyncio.to_thread(self.get, job_id)
+        if job is None or job["status"] != QUEUED:
+            return
+        await asyncio.to_thread(self._update, job_id, status=RUNNING, stage="starting", progress=0.0,
+                                attempts=job["attempts"] + 1)
+
+        # 处理函数在事件循环上同步调用 report：只记下最新进度，
+        # 由一个后台写入任务落库，写入期间的多次上报合并成一次
+        latest: dict = {}
+        writer: Optional[asyncio.Task] = None
+
+        async def write_progress() -> None:
+            while latest:
+                fields = dict(latest)
+                latest.clear()
+                await asyncio.to_thread(self._update, job_id, **fields)
+
+        def report(stage: str, progress: float) -> None:
+            nonlocal writer
+            latest.update(stage=stage, progress=progress)
+            if writer is None or writer.done():
+                writer = asyncio.create_task(write_progress())
+
+        try:
+            result = await self.handler(job, report)
+        except asyncio.CancelledError:
+            # 服务关闭：保持 running 状态，下次启动时会重新排队
+            if writer is not None:
+                writer.cancel()
+            raise
+        except Exception as e:
+            fields = {"status": FAILED, "stage": "failed", "error": str(e)}
+        else:
+            fields = {"status": SUCCEEDED, "stage": "done", "progress": 1.0,
+                      "result": json.dumps(result, ensure_ascii=False), "error": None}
+        # 最终状态要在最后一次进度之后写入，不能被它覆盖
+        latest.clear()
+        if writer is not None:
+            await asyncio.gather(writer, return_exceptions=True)
+        await asyncio.to_thread(self._update, job_id, **fields)
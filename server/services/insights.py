@@ -0,0 +1,541 @@
+import asyncio
+import hashlib
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from urllib.parse import quote
+
+import httpx
+
+from .conversation import AI_HEADING, USER_HEADING
+from .metrics import INSIGHT_COMPLETION_SECONDS, INSIGHT_COMPLETIONS
+
+# 单次请求（提示词 + 对话内容）的 token 预算；超出的对话按消息边界切分后分别分析，再合并
+DEFAULT_MAX_TOKENS = int(os.environ.get("INSIGHT_MAX_TOKENS", "6000"))
+# 每段至少留给对话内容的 token 数（提示词很长时也不至于切得过碎）
+MIN_CHUNK_TOKENS = 512
+# 每个后端同时进行的请求数（同一后端的所有分析任务共用）
+DEFAULT_MAX_CONCURRENCY = int(os.environ.get("INSIGHT_MAX_CONCURRENCY", "4"))
+DEFAULT_MODEL = os.environ.get("INSIGHT_MODEL", "gpt-4o-mini")
+DEFAULT_TIMEOUT = float(os.environ.get("INSIGHT_TIMEOUT", "120"))
+# 429 / 5xx / 网络错误的重试次数（有 Retry-After 时按它等待）
+MAX_RETRIES = 3
+# 洞察文档：<原文件名去掉 .md>.insights.md，在按名称排序的列表里紧挨着原文档
+INSIGHT_SUFFIX = ".insights.md"
+
+_MARKER_RE = re.compile(r'<!-- insightpipe:insight source="([^"]*)" key="([0-9a-f]{64})" -->')
+# 在每条消息的标题前切开（服务端生成的对话文档布局）
+_MESSAGE_RE = re.compile(rf"(?m)^(?={re.escape(USER_HEADING)}$|{re.escape(AI_HEADING)}$)")
+_PARAGRAPH_RE = re.compile(r"(?<=\n\n)")
+# 中日韩字符与全角符号：大致每个字符一个 token
+_WIDE_RE = re.compile(r"[\u2e80-\u9fff\uac00-\ud7af\uf900-\ufaff\uff00-\uffef]")
+
+ANALYSIS_PROMPT = """你是一个专业的对话分析师。我上传了一段Gemini对话记录。
+
+**任务**：提取这段对话中的核心洞察（Insights）。
+
+**输出格式**：
+## 对话概览
+- 主题：[一句话概括]
+- 核心问题：[用户想解决什么]
+
+## 关键洞察（3-5条）
+1. [洞察标题]
+   - 证据：[AI给出的数据/案例]
+   - 启发：[可迁移的思维模式]
+
+2. [洞察标题]
+   - 证据：[具体支撑]
+   - 启发：[实际应用]
+
+## 可执行建议
+[如果有具体行动计划，在此总结]
+
+**注意**：
+- 忽略客套话和重复内容
+- 优先提取有数据支撑的结论
+- 关注"为什么"而不仅是"是什么"
+- 如果涉及敏感话题，客观总结事实部分即可
+"""
+
+CHUNK_NOTE = "\n（对话较长，已分段发送。下面是第 {index}/{total} 段，只分析这一段的内容。）\n"
+
+MERGE_PROMPT = """下面是同一段对话分段分析得到的多份结果。
+
+**任务**：把它们合并成一份完整的分析，沿用原来的输出格式（对话概览 / 关键洞察 / 可执行建议）。
+
+**注意**：
+- 合并重复的洞察，保留证据最充分的表述
+- 关键洞察总数仍控制在3-5条
+- 不要提及"分段"
+"""
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估计 token 数（不依赖具体模型的分词器）：中日韩字符约 1 个，其余约 4 个字符 1 个"""
+    narrow, wide = _WIDE_RE.subn("", text)
+    return wide + math.ceil(len(narrow) / 4)
+
+
+def split_chunks(text: str, max_tokens: int) -> List[str]:
+    """
+    按 token 预算切分文档，各段按顺序拼接即为原文
+    尽量在消息边界（User / AI 标题）处切开；单条消息超出预算时按段落、再按字符切
+    """
+    if estimate_tokens(text) <= max_tokens:
+        return [text]
+    chunks: List[str] = []
+    current: List[str] = []
+    size = 0
+    for piece in _iter_pieces(text, max_tokens):
+        tokens = estimate_tokens(piece)
+        if current and size + tokens > max_tokens:
+            chunks.append("".join(current))
+            current, size = [], 0
+        current.append(piece)
+        size += tokens
+    if current:
+        chunks.append("".join(current))
+    return chunks
+
+
+def _iter_pieces(text: str, max_tokens: int) -> Iterator[str]:
+    for message in _MESSAGE_RE.split(text):
+        if not message:
+            continue
+        if estimate_tokens(message) <= max_tokens:
+            yield message
+            continue
+        for paragraph in _PARAGRAPH_RE.split(message):
+            if estimate_tokens(paragraph) <= max_tokens:
+                yield paragraph
+            else:
+                yield from _split_by_chars(paragraph, max_tokens)
+
+
+def _split_by_chars(text: str, max_tokens: int) -> Iterator[str]:
+    start = 0
+    while start < len(text):
+        rest = text[start:]
+        length = max(1, len(rest) * max_tokens // max(1, estimate_tokens(rest)))
+        while length > 1 and estimate_tokens(rest[:length]) > max_tokens:
+            length = length * 3 // 4
+        yield rest[:length]
+        start += length
+
+
+def cache_key(*parts: str) -> str:
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def build_prompt(instruction: str, content: str) -> str:
+    return f"{instruction}\n---\n\n{content}"
+
+
+def insight_filename(filename: str) -> str:
+    """原文档 -> 洞察文档的文件名"""
+    stem = filename[:-3] if filename.endswith(".md") else filename
+    return f"{stem}{INSIGHT_SUFFIX}"
+
+
+def is_insight_doc(filename: str) -> bool:
+    return filename.endswith(INSIGHT_SUFFIX)
+
+
+def read_marker(content: str) -> Optional[Tuple[str, str]]:
+    """洞察文档里记录的 (原文件名, 分析时的内容哈希)"""
+    match = _MARKER_RE.search(content)
+    return (match.group(1), match.group(2)) if match else None
+
+
+def document_title(content: str, filename: str) -> str:
+    for line in content.splitlines()[:20]:
+        if line.startswith("# "):
+            return line[2:].strip()
+    return filename[:-3] if filename.endswith(".md") else filename
+
+
+def render_insight(source: str, title: str, key: str, body: str, chunks: int, backend: str) -> str:
+    """洞察文档：标题、指回原文档的链接、哈希标记（重跑时据此跳过），然后是分析结果"""
+    note = f"，分 {chunks} 段分析后合并" if chunks > 1 else ""
+    return (f"# 💡 洞察：{title}\n\n"
+            f"> 来源：[{source}]({quote(source)}) · 后端：{backend}{note}\n"
+            f'<!-- insightpipe:insight source="{source}" key="{key}" -->\n\n'
+            f"{body.strip()}\n")
+
+
+class InsightCache:
+    """
+    分析结果缓存：键为 sha256(后端标识, 完整提示词)，提示词中包含对话内容
+    - 提示词、对话内容或模型任一变化都是新的键；重跑时没变的对话/片段直接命中
+    - 服务端各 worker 与命令行脚本共用同一个 SQLite 文件
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._db = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS results (
+                key TEXT PRIMARY KEY,
+                backend TEXT NOT NULL,
+                result TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )
+        """)
+        self._db.commit()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._db.execute("SELECT result FROM results WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def put(self, key: str, backend: str, result: str) -> None:
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO results (key, backend, result, created_at) VALUES (?, ?, ?, ?)",
+                (key, backend, result, time.time())
+            )
+            self._db.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            count, total = self._db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(LENGTH(result)), 0) FROM results"
+            ).fetchone()
+        return {"entries": count, "chars": total}
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+class CompletionBackend:
+    """
+    补全后端基类：子类实现 _complete(prompt) -> 文本
+    - max_concurrency 限制同时进行的请求数
+    - identity 区分不同后端/模型的结果，参与缓存键
+    """
+
+    name = "base"
+
+    def __init__(self, max_concurrency: int = DEFAULT_MAX_CONCURRENCY):
+        self.max_concurrency = max(1, max_concurrency)
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    @property
+    def identity(self) -> str:
+        return self.name
+
+    async def complete(self, prompt: str) -> str:
+        async with self._get_semaphore():
+            start = time.perf_counter()
+            try:
+                return await self._complete(prompt)
+            finally:
+                INSIGHT_COMPLETION_SECONDS.observe(time.perf_counter() - start, backend=self.name)
+
+    async def _complete(self, prompt: str) -> str:
+        raise NotImplementedError
+
+    async def aclose(self) -> None:
+        pass
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        # 命令行脚本每次 asyncio.run 都是新的事件循环，闸门跟着事件循环重建
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None or self._loop is not loop:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._loop = loop
+        return self._semaphore
+
+
+class OpenAICompatibleBackend(CompletionBackend):
+    """OpenAI 兼容的 /chat/completions 接口（OpenAI、vLLM、Ollama、LM Studio 等）"""
+
+    name = "openai"
+
+    def __init__(self, base_url: str, model: str = DEFAULT_MODEL, api_key: Optional[str] = None,
+                 max_concurrency: int = DEFAULT_MAX_CONCURRENCY, timeout: float = DEFAULT_TIMEOUT,
+                 temperature: float = 0.2):
+        super().__init__(max_concurrency)
+        self.base_url = base_url.rstrip("/") + "/"
+        self.model = model
+        self.api_key = api_key
+        self.timeout = timeout
+        self.temperature = temperature
+        self._client: Optional[httpx.AsyncClient] = None
+        self._client_loop: Optional[asyncio.AbstractEventLoop] = None
+
+    @property
+    def identity(self) -> str:
+        return f"{self.name}:{self.model}"
+
+    def _get_client(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._client.is_closed or self._client_loop is not loop:
+            headers = {"authorization": f"Bearer {self.api_key}"} if self.api_key else {}
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers=headers,
+                limits=httpx.Limits(max_connections=self.max_concurrency,
+                                    max_keepalive_connections=self.max_concurrency),
+                timeout=httpx.Timeout(self.timeout, connect=10.0),
+            )
+            self._client_loop = loop
+        return self._client
+
+    async def _complete(self, prompt: str) -> str:
+        client = self._get_client()
+        body = {
+            "model": self.model,
+            "messages": [{"role": "user", "content": prompt}],
+            "temperature": self.temperature,
+        }
+        for attempt in range(MAX_RETRIES + 1):
+            try:
+                response = await client.post("chat/completions", json=body)
+            except httpx.TransportError:
+                if attempt == MAX_RETRIES:
+                    raise
+                await asyncio.sleep(2 ** attempt)
+                continue
+            if (response.status_code == 429 or response.status_code >= 500) and attempt < MAX_RETRIES:
+                await asyncio.sleep(_retry_delay(response, attempt))
+                continue
+            response.raise_for_status()
+            try:
+                return response.json()["choices"][0]["message"]["content"]
+            except (ValueError, KeyError, IndexError, TypeError):
+                raise ValueError("补全接口返回了无法识别的响应")
+        raise RuntimeError("unreachable")
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+        self._client = None
+
+
+def _retry_delay(response: httpx.Response, attempt: int) -> float:
+    try:
+        return min(60.0, max(0.0, float(response.headers.get("retry-after", ""))))
+    except ValueError:
+        return float(2 ** attempt)
+
+
+class StubBackend(CompletionBackend):
+    """
+    本地桩后端：不发网络请求，按提示词生成确定性的结果（测试、基准测试与离线演示用）
+    delay 模拟请求耗时；calls 记录实际调用次数，用来验证缓存命中
+    """
+
+    name = "stub"
+
+    def __init__(self, max_concurrency: int = DEFAULT_MAX_CONCURRENCY, delay: float = 0.0):
+        super().__init__(max_concurrency)
+        self.delay = delay
+        self.calls = 0
+
+    async def _complete(self, prompt: str) -> str:
+        self.calls += 1
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        digest = hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:12]
+        return (f"## 对话概览\n- 主题：stub-{digest}\n- 核心问题：（桩后端未做真实分析）\n\n"
+                f"## 关键洞察（3-5条）\n1. 提示词约 {estimate_tokens(prompt)} tokens\n"
+                f"   - 证据：stub\n   - 启发：stub\n\n## 可执行建议\n无\n")
+
+
+BACKENDS = {"openai": OpenAICompatibleBackend, "stub": StubBackend}
+
+
+def create_backend(name: Optional[str] = None, model: Optional[str] = None, api_base: Optional[str] = None,
+                   api_key: Optional[str] = None, max_concurrency: Optional[int] = None) -> CompletionBackend:
+    """
+    按参数或环境变量创建后端：INSIGHT_BACKEND=openai|stub、INSIGHT_API_BASE（或 OPENAI_BASE_URL）、
+    INSIGHT_API_KEY（或 OPENAI_API_KEY）、INSIGHT_MODEL、INSIGHT_MAX_CONCURRENCY
+    没有指定后端时，配置了接口地址就用 openai，否则报错（不会悄悄用桩后端生成假的洞察）
+    """
+    api_base = api_base or os.environ.get("INSIGHT_API_BASE") or os.environ.get("OPENAI_BASE_URL")
+    name = name or os.environ.get("INSIGHT_BACKEND") or ("openai" if api_base else None)
+    concurrency = max_concurrency or DEFAULT_MAX_CONCURRENCY
+    if name is None:
+        raise ValueError("未配置分析后端：设置 INSIGHT_API_BASE，或用 INSIGHT_BACKEND=stub 使用本地桩后端")
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown insight backend: {name!r} (expected {', '.join(BACKENDS)})")
+    if name == "stub":
+        return StubBackend(max_concurrency=concurrency)
+    if not api_base:
+        raise ValueError("openai 后端需要 INSIGHT_API_BASE（例如 https://api.openai.com/v1）")
+    return OpenAICompatibleBackend(
+        api_base,
+        model=model or DEFAULT_MODEL,
+        api_key=api_key or os.environ.get("INSIGHT_API_KEY") or os.environ.get("OPENAI_API_KEY"),
+        max_concurrency=concurrency,
+    )
+
+
+class InsightPipeline:
+    """
+    批量洞察分析：文档 -> 分析提示词 ->（超出预算时分段）并发请求后端 -> 洞察文档
+    - 洞察文档保存为 <原文件名>.insights.md，开头链接回原文档，并记下 (提示词, 后端, 内容) 的哈希；
+      重跑时哈希没变的文档直接跳过，内容变了的文档，没变的片段仍然命中缓存
+    - 读写通过回调完成：服务端的写入要同步索引、发布变更事件，命令行脚本直接写 DocStore
+    """
+
+    def __init__(self, backend: CompletionBackend, cache: InsightCache,
+                 read: Callable[[str], str], save: Callable[[str, str], None],
+                 prompt: str = ANALYSIS_PROMPT, max_tokens: int = DEFAULT_MAX_TOKENS):
+        self.backend = backend
+        self.cache = cache
+        self.read = read
+        self.save = save
+        self.prompt = prompt
+        self.max_tokens = max_tokens
+
+    def document_key(self, content: str) -> str:
+        return cache_key(self.backend.identity, self.prompt, content)
+
+    def status(self, filename: str) -> dict:
+        """原文档的洞察文档是否存在、是否对应当前内容；原文档不存在时抛出 FileNotFoundError"""
+        content = self.read(filename)
+        target = insight_filename(filename)
+        existing = self._read_optional(target)
+        return {
+            "filename": filename,
+            "insight": target if existing is not None else None,
+            "up_to_date": existing is not None and read_marker(existing) == (filename, self.document_key(content)),
+        }
+
+    async def run(self, filenames: Iterable[str], refresh: bool = False,
+                  progress: Optional[Callable[[int, int], None]] = None) -> dict:
+        """
+        分析一批文档（洞察文档本身会被跳过）；refresh=True 时忽略缓存重新请求后端
+        返回 {"counts": {...}, "documents": [{filename, status, ...}]}
+        """
+        targets = [f for f in dict.fromkeys(filenames) if not is_insight_doc(f)]
+        stats = {"completions": 0, "cached": 0}
+        results: Dict[str, dict] = {}
+        pending = iter(targets)
+
+        async def worker():
+            for filename in pending:
+                results[filename] = await self._analyze_document(filename, refresh, stats)
+                if progress is not None:
+                    progress(len(results), len(targets))
+
+        # 文档级的并发只需要让后端的请求闸门保持满载
+        workers = min(len(targets), self.backend.max_concurrency * 2)
+        await asyncio.gather(*(worker() for _ in range(workers)))
+
+        documents = [results[filename] for filename in targets]
+        counts = {status: 0 for status in ("analyzed", "unchanged", "failed", "missing")}
+        for doc in documents:
+            counts[doc["status"]] += 1
+        counts.update(stats)
+        return {"counts": counts, "documents": documents}
+
+    async def analyze(self, content: str, refresh: bool = False,
+                      stats: Optional[Dict[str, int]] = None) -> Tuple[str, int]:
+        """分析一段文档内容，返回 (分析结果, 分段数)"""
+        stats = stats if stats is not None else {"completions": 0, "cached": 0}
+        note_tokens = estimate_tokens(CHUNK_NOTE)
+        budget = max(MIN_CHUNK_TOKENS, self.max_tokens - estimate_tokens(self.prompt) - note_tokens)
+        chunks = split_chunks(content, budget)
+        if len(chunks) == 1:
+            return await self._complete(build_prompt(self.prompt, content), refresh, stats), 1
+        total = len(chunks)
+        parts = await asyncio.gather(*(
+            self._complete(build_prompt(self.prompt + CHUNK_NOTE.format(index=index, total=total), chunk),
+                           refresh, stats)
+            for index, chunk in enumerate(chunks, 1)
+        ))
+        return await self._merge(list(parts), refresh, stats), total
+
+    async def _merge(self, parts: List[str], refresh: bool, stats: Dict[str, int]) -> str:
+        """把各段的分析逐层合并（一次放不下时先分组合并）"""
+        budget = max(MIN_CHUNK_TOKENS, self.max_tokens - estimate_tokens(MERGE_PROMPT))
+
+        async def merge_group(group: List[str]) -> str:
+            if len(group) == 1:
+                return group[0]
+            body = "\n\n".join(f"### 第 {i} 部分\n\n{part.strip()}" for i, part in enumerate(group, 1))
+            return await self._complete(build_prompt(MERGE_PROMPT, body), refresh, stats)
+
+        while len(parts) > 1:
+            groups = _group_by_budget(parts, budget)
+            if len(groups) == len(parts):
+                # 每份都单独超出预算：两两合并，保证逐层收敛
+                groups = [parts[i:i + 2] for i in range(0, len(parts), 2)]
+            parts = list(await asyncio.gather(*(merge_group(group) for group in groups)))
+        return parts[0]
+
+    async def _complete(self, prompt: str, refresh: bool, stats: Dict[str, int]) -> str:
+        key = cache_key(self.backend.identity, prompt)
+        if not refresh:
+            cached = await asyncio.to_thread(self.cache.get, key)
+            if cached is not None:
+                INSIGHT_COMPLETIONS.inc(backend=self.backend.name, result="cached")
+                stats["cached"] += 1
+                return cached
+        try:
+            result = await self.backend.complete(prompt)
+        except Exception:
+            INSIGHT_COMPLETIONS.inc(backend=self.backend.name, result="error")
+            raise
+        INSIGHT_COMPLETIONS.inc(backend=self.backend.name, result="completed")
+        stats["completions"] += 1
+        await asyncio.to_thread(self.cache.put, key, self.backend.identity, result)
+        return result
+
+    async def _analyze_document(self, filename: str, refresh: bool, stats: Dict[str, int]) -> dict:
+        try:
+            content = await asyncio.to_thread(self.read, filename)
+        except FileNotFoundError:
+            return {"filename": filename, "status": "missing"}
+        target = insight_filename(filename)
+        key = self.document_key(content)
+        if not refresh:
+            existing = await asyncio.to_thread(self._read_optional, target)
+            if existing is not None and read_marker(existing) == (filename, key):
+                return {"filename": filename, "status": "unchanged", "insight": target}
+        try:
+            body, chunks = await self.analyze(content, refresh, stats)
+            markdown = render_insight(filename, document_title(content, filename), key, body,
+                                      chunks, self.backend.identity)
+            await asyncio.to_thread(self.save, target, markdown)
+        except Exception as e:
+            # 单篇失败（后端报错、超时）不影响其他文档
+            return {"filename": filename, "status": "failed", "error": str(e)}
+        return {"filename": filename, "status": "analyzed", "insight": target, "chunks": chunks}
+
+    def _read_optional(self, filename: str) -> Optional[str]:
+        try:
+            return self.read(filename)
+        except FileNotFoundError:
+            return None
+
+
+def _group_by_budget(parts: List[str], budget: int) -> List[List[str]]:
+    groups: List[List[str]] = []
+    size = 0
+    for part in parts:
+        tokens = estimate_tokens(part)
+        if groups and size + tokens <= budget:
+            groups[-1].append(part)
+            size += tokens
+        else:
+            groups.append([part])
+            size = tokens
+    return groups
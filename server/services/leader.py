@@ -0,0 +1,82 @@
+import os
+import threading
+from typing import Callable, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows：不支持多 worker，单进程总是 leader
+    fcntl = None
+
+
+class LeaderLock:
+    """
+    多 worker 部署时选出一个进程负责全局性的后台工作（目录对账、索引全量同步、导入任务）
+    - 用状态目录下一个文件的 fcntl 排他锁实现：持有者退出（包括崩溃）时锁由内核释放
+    - 没抢到的进程用 watch 在后台定期重试，leader 退出后由其中一个接管
+    - 锁文件里写着 leader 的 pid，只用于排查
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._held = False
+        self._file = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    @property
+    def is_leader(self) -> bool:
+        with self._lock:
+            return self._held
+
+    def try_acquire(self) -> bool:
+        """非阻塞地尝试成为 leader"""
+        with self._lock:
+            if self._held:
+                return True
+            if fcntl is not None:
+                f = open(self.path, "a+")
+                try:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    f.close()
+                    return False
+                f.seek(0)
+                f.truncate()
+                f.write(f"{os.getpid()}\n")
+                f.flush()
+                self._file = f
+            self._held = True
+            return True
+
+    def watch(self, on_acquire: Callable[[], None], interval: float = 2.0) -> None:
+        """后台每 interval 秒重试一次，抢到后调用 on_acquire（在重试线程中）"""
+        if self._thread is not None:
+            return
+        self._stop.clear()
+
+        def run():
+            while not self._stop.wait(interval):
+                if self.try_acquire():
+                    on_acquire()
+                    return
+
+        self._thread = threading.Thread(target=run, name="leader-watch", daemon=True)
+        self._thread.start()
+
+    def stop_watching(self) -> None:
+        """不再尝试接管（关闭时先调用，避免在停止后台工作期间又成为 leader）"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def release(self) -> None:
+        self.stop_watching()
+        with self._lock:
+            if self._file is not None:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+                self._file.close()
+                self._file = None
+            self._held = False
@@ -0,0 +1,413 @@
+"""
+进程内指标（Prometheus 文本格式导出，无第三方依赖）
+- Counter / Histogram 支持标签，线程安全
+- span(stage)：导入流水线各阶段的耗时；默认关闭，关闭时返回共享的空上下文，开销可忽略
+  打开方式：环境变量 INSIGHTPIPE_SPANS=1，或运行时调用 set_spans_enabled(True)
+- 多 worker 部署时每个进程定期把快照写到共享目录（MetricsSpool），导出时汇总所有存活 worker 的数据
+"""
+import bisect
+import json
+import os
+import re
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+BYTES_BUCKETS = tuple(1024 * 4 ** i for i in range(10))  # 1KB .. 256MB
+TURN_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+    def snapshot(self) -> list:
+        raise NotImplementedError
+
+    def render(self, peers: Iterable[list] = ()) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def snapshot(self) -> list:
+        with self._lock:
+            return [[list(key), value] for key, value in self._values.items()]
+
+    def render(self, peers: Iterable[list] = ()) -> List[str]:
+        """peers：其他 worker 的 snapshot()，同一组标签的值相加"""
+        with self._lock:
+            values = dict(self._values)
+        for snapshot in peers:
+            for key, value in snapshot:
+                key = tuple(key)
+                values[key] = values.get(key, 0.0) + value
+        lines = self.header()
+        for key, value in sorted(values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # 每组标签：[各桶计数（非累计）..., +Inf 计数], 总和
+        self._values: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = ([0] * (len(self.buckets) + 1), [0.0])
+            entry[0][index] += 1
+            entry[1][0] += value
+
+    def count(self, **labels) -> int:
+        with self._lock:
+            entry = self._values.get(self._key(labels))
+            return sum(entry[0]) if entry else 0
+
+    def snapshot(self) -> list:
+        with self._lock:
+            return [[list(key), list(counts), total[0]] for key, (counts, total) in self._values.items()]
+
+    def render(self, peers: Iterable[list] = ()) -> List[str]:
+        """peers：其他 worker 的 snapshot()（桶边界相同），逐桶相加"""
+        with self._lock:
+            values = {key: (list(counts), total[0]) for key, (counts, total) in self._values.items()}
+        for snapshot in peers:
+            for key, counts, total in snapshot:
+                key = tuple(key)
+                mine = values.get(key)
+                if mine is None:
+                    values[key] = (list(counts), total)
+                else:
+                    values[key] = ([a + b for a, b in zip(mine[0], counts)], mine[1] + total)
+        lines = self.header()
+        for key, (counts, total) in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def snapshot(self) -> Dict[str, list]:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {metric.name: metric.snapshot() for metric in metrics}
+
+    def render(self, peers: Iterable[Dict[str, list]] = ()) -> str:
+        """导出文本；peers 为其他 worker 的 snapshot()，与本进程的数据汇总后输出"""
+        peers = list(peers)
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render(peer[metric.name] for peer in peers if metric.name in peer))
+        return "\n".join(lines) + "\n"
+
+
+class MetricsSpool:
+    """
+    多 worker 部署时的指标汇总：每个进程定期把 REGISTRY 快照写到共享目录的 <pid>.json，
+    任一 worker 被抓取时读取其他存活进程的快照一并导出（其他进程的数据最多滞后 interval 秒）
+    已退出进程的快照会被清理，它们累计的计数随之消失，Prometheus 会当作计数器重置处理
+    """
+
+    def __init__(self, directory: str, registry: Registry, interval: float = 5.0):
+        self.directory = directory
+        self.registry = registry
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        os.makedirs(directory, exist_ok=True)
+
+    @property
+    def _own_path(self) -> str:
+        return os.path.join(self.directory, f"{os.getpid()}.json")
+
+    def publish(self) -> None:
+        path = self._own_path
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.registry.snapshot(), f)
+        os.replace(tmp_path, path)
+
+    def peers(self) -> List[Dict[str, list]]:
+        """其他存活 worker 的最近快照"""
+        snapshots = []
+        own = os.getpid()
+        for name in os.listdir(self.directory):
+            stem, ext = os.path.splitext(name)
+            if ext != ".json" or not stem.isdigit() or int(stem) == own:
+                continue
+            path = os.path.join(self.directory, name)
+            if not _pid_alive(int(stem)):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                continue
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return snapshots
+
+    def render(self) -> str:
+        return self.registry.render(self.peers())
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="metrics-spool", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """停止定期写入并删除本进程的快照"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        try:
+            os.remove(self._own_path)
+        except OSError:
+            pass
+
+    def _run(self) -> None:
+        while True:
+            try:
+                self.publish()
+            except OSError:
+                pass
+            if self._stop.wait(self.interval):
+                return
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+REGISTRY = Registry()
+
+HTTP_REQUEST_SECONDS = REGISTRY.histogram(
+    "insightpipe_http_request_duration_seconds", "HTTP request latency by route",
+    ("method", "route", "status"))
+GEMINI_FETCH_SECONDS = REGISTRY.histogram(
+    "insightpipe_gemini_fetch_duration_seconds", "Gemini share fetch latency (network + payload search)",
+    ("client",))
+GEMINI_FETCH_ERRORS = REGISTRY.counter(
+    "insightpipe_gemini_fetch_errors_total", "Gemini fetch/parse failures by failure mode",
+    ("reason",))
+GEMINI_CACHE_LOOKUPS = REGISTRY.counter(
+    "insightpipe_gemini_cache_lookups_total", "Gemini cache lookups", ("result",))
+GEMINI_UPSTREAM_REJECTIONS = REGISTRY.counter(
+    "insightpipe_gemini_upstream_rejections_total",
+    "Gemini fetches rejected without calling upstream (circuit open / admission queue full)", ("reason",))
+GEMINI_CIRCUIT_TRANSITIONS = REGISTRY.counter(
+    "insightpipe_gemini_circuit_transitions_total", "Gemini circuit breaker state changes", ("state",))
+GEMINI_COALESCED = REGISTRY.counter(
+    "insightpipe_gemini_coalesced_total", "Gemini fetches that joined an in-flight request for the same share")
+GEMINI_RESPONSE_BYTES = REGISTRY.histogram(
+    "insightpipe_gemini_response_bytes", "Size of batchexecute responses read from the network",
+    (), BYTES_BUCKETS)
+IMPORT_TURNS = REGISTRY.histogram(
+    "insightpipe_import_turns", "Turns per imported conversation", (), TURN_BUCKETS)
+INSIGHT_COMPLETIONS = REGISTRY.counter(
+    "insightpipe_insight_completions_total", "Insight analysis completions by backend and outcome",
+    ("backend", "result"))
+INSIGHT_COMPLETION_SECONDS = REGISTRY.histogram(
+    "insightpipe_insight_completion_duration_seconds", "Completion backend latency for insight analysis",
+    ("backend",))
+STAGE_SECONDS = REGISTRY.histogram(
+    "insightpipe_stage_duration_seconds", "Time spent per pipeline stage (only while spans are enabled)",
+    ("stage",))
+
+
+# ---- span ----
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class _Span:
+    __slots__ = ("stage", "start")
+
+    def __init__(self, stage: str):
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        STAGE_SECONDS.observe(time.perf_counter() - self.start, stage=self.stage)
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+_spans_enabled = os.environ.get("INSIGHTPIPE_SPANS", "").lower() in ("1", "true", "yes", "on")
+
+
+def set_spans_enabled(enabled: bool) -> None:
+    global _spans_enabled
+    _spans_enabled = enabled
+
+
+def spans_enabled() -> bool:
+    return _spans_enabled
+
+
+def span(stage: str):
+    """with span("parse.decode"): ...  关闭时返回共享的空上下文"""
+    return _Span(stage) if _spans_enabled else _NULL_SPAN
+
+
+_HTTP_STATUS_RE = re.compile(r"returned HTTP (\d{3})")
+
+
+def failure_reason(exc: BaseException) -> str:
+    """
+    把抓取/解析异常归类为有限的几种失败模式（用作指标标签）
+    只有传输层异常算 "network"；其余没法归类的（多半是代码错误）为 "internal"，不能当作上游故障
+    """
+    import httpx
+    import requests
+
+    from .batchexecute import PayloadNotFoundError
+
+    if isinstance(exc, PayloadNotFoundError):
+        return "payload_not_found"
+    name = type(exc).__name__
+    if "Timeout" in name:
+        return "timeout"
+    message = str(exc)
+    status = _HTTP_STATUS_RE.search(message)
+    if status:
+        return f"http_{status.group(1)}"
+    if message.startswith("Failed to decode JSON"):
+        return "json_decode"
+    if isinstance(exc, ValueError):
+        return "parse"
+    if isinstance(exc, (httpx.TransportError, requests.ConnectionError, requests.exceptions.ChunkedEncodingError,
+                        ConnectionError)):
+        return "network"
+    return "internal"
+
+
+# ---- ASGI 中间件 ----
+
+class MetricsMiddleware:
+    """按路由模板（而非实际路径，避免标签爆炸）统计请求耗时与状态码"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            HTTP_REQUEST_SECONDS.observe(time.perf_counter() - start, method=scope["method"],
+                                         route=path, status=str(status[0]))
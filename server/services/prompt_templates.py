@@ -0,0 +1,119 @@
+import os
+import re
+import stat
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# {{NAME}} 形式的命名占位符
+PLACEHOLDER_RE = re.compile(r"\{\{\s*([A-Za-z_][A-Za-z0-9_]*)\s*\}\}")
+TEMPLATE_SUFFIXES = (".txt", ".md")
+
+
+class CompiledTemplate:
+    """预解析的模板：字面量与占位符交替的片段列表，渲染只做一次 join"""
+
+    def __init__(self, name: str, source: str, mtime_ns: int, size: int):
+        self.name = name
+        self.mtime_ns = mtime_ns
+        self.size = size
+        # 片段: (是否占位符, 字面量文本或占位符名)
+        self.segments: List[Tuple[bool, str]] = []
+        self.placeholders: List[str] = []
+
+        last = 0
+        for match in PLACEHOLDER_RE.finditer(source):
+            if match.start() > last:
+                self.segments.append((False, source[last:match.start()]))
+            self.segments.append((True, match.group(1)))
+            if match.group(1) not in self.placeholders:
+                self.placeholders.append(match.group(1))
+            last = match.end()
+        if last < len(source):
+            self.segments.append((False, source[last:]))
+
+    def render(self, values: Dict[str, str]) -> str:
+        """未提供值的占位符原样保留"""
+        return "".join(
+            values.get(text, "{{" + text + "}}") if is_placeholder else text
+            for is_placeholder, text in self.segments
+        )
+
+
+class TemplateEngine:
+    """
+    templates/ 目录的模板引擎，服务端与 scripts/ask.py 共用
+    模板编译后常驻内存；按 check_interval 节流检查 mtime，文件变化时重新编译，
+    因此请求路径上通常没有任何文件 I/O
+    """
+
+    def __init__(self, templates_dir: str, check_interval: float = 2.0):
+        self.templates_dir = templates_dir
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._cache: Dict[str, CompiledTemplate] = {}
+        self._checked_at: Dict[str, float] = {}
+        self._listing: Optional[List[str]] = None
+        self._listing_checked_at = 0.0
+
+    def get(self, name: str) -> CompiledTemplate:
+        """返回编译好的模板；不存在（或不是 list_templates 会列出的普通模板文件）时抛出 FileNotFoundError"""
+        if os.path.basename(name) != name or not name.endswith(TEMPLATE_SUFFIXES):
+            raise FileNotFoundError(f"Template '{name}' not found.")
+
+        now = time.monotonic()
+        with self._lock:
+            compiled = self._cache.get(name)
+            if compiled is not None and now - self._checked_at.get(name, 0.0) < self.check_interval:
+                return compiled
+
+        path = os.path.join(self.templates_dir, name)
+        try:
+            stats = os.stat(path)
+            if not stat.S_ISREG(stats.st_mode):
+                raise FileNotFoundError(path)
+        except FileNotFoundError:
+            with self._lock:
+                self._cache.pop(name, None)
+                self._checked_at.pop(name, None)
+            raise FileNotFoundError(f"Template '{name}' not found.")
+
+        if compiled is None or (compiled.mtime_ns, compiled.size) != (stats.st_mtime_ns, stats.st_size):
+            with open(path, 'r', encoding='utf-8') as f:
+                compiled = CompiledTemplate(name, f.read(), stats.st_mtime_ns, stats.st_size)
+        with self._lock:
+            self._cache[name] = compiled
+            self._checked_at[name] = now
+        return compiled
+
+    def render(self, name: str, values: Dict[str, str]) -> str:
+        return self.get(name).render(values)
+
+    def render_many(self, name: str, values_list: Iterable[Dict[str, str]]) -> List[str]:
+        """批量渲染：模板只查找/校验一次"""
+        compiled = self.get(name)
+        return [compiled.render(values) for values in values_list]
+
+    def list_templates(self) -> List[dict]:
+        """列出可用模板及其占位符（目录列表同样按 check_interval 缓存）"""
+        now = time.monotonic()
+        with self._lock:
+            names = self._listing
+            fresh = names is not None and now - self._listing_checked_at < self.check_interval
+        if not fresh:
+            names = sorted(
+                entry for entry in os.listdir(self.templates_dir)
+                if entry.endswith(TEMPLATE_SUFFIXES) and os.path.isfile(os.path.join(self.templates_dir, entry))
+            )
+            with self._lock:
+                self._listing = names
+                self._listing_checked_at = now
+
+        templates = []
+        for name in names:
+            try:
+                compiled = self.get(name)
+            except FileNotFoundError:
+                continue
+            templates.append({"name": name, "placeholders": compiled.placeholders})
+        return templates
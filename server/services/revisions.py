@@ -0,0 +1,261 @@
+import difflib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Iterator, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows：只有进程内的锁
+    fcntl = None
+
+from .doc_store import content_hash
+
+SNAPSHOT = "snapshot"
+DELTA = "delta"
+
+# 距上一个快照超过这么多个增量时写完整快照，限制重建一个版本要回放的增量数
+SNAPSHOT_INTERVAL = 32
+# 增量超过全文的这个比例时直接存快照（大改写时增量没有意义）
+DELTA_MAX_RATIO = 0.5
+
+
+def _decode(data: bytes) -> str:
+    """
+    版本内容按 surrogateescape 解码：不是合法 UTF-8 的字节（外部编辑写入的 GBK 等）
+    也能逐字节存取，覆盖/删除这类文档时照常记录版本
+    """
+    return data.decode("utf-8", "surrogateescape")
+
+
+def _encode(text: str) -> bytes:
+    return text.encode("utf-8", "surrogateescape")
+
+
+def _displayable(text: str) -> str:
+    """对外返回的文本：无法解码的字节显示为 U+FFFD（JSON 响应不能包含代理字符）"""
+    return _encode(text).decode("utf-8", "replace")
+
+
+def make_delta(base: List[str], target: List[str]) -> list:
+    """
+    行级增量：[i1, i2] 表示复制 base[i1:i2]，字符串列表表示插入这些行
+    行保留换行符，重建结果与原文逐字节一致
+    """
+    ops = []
+    matcher = difflib.SequenceMatcher(None, base, target, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            ops.append([i1, i2])
+        elif j2 > j1:  # replace / insert；delete 只需不复制
+            ops.append(target[j1:j2])
+    return ops
+
+
+def apply_delta(base: List[str], ops: list) -> List[str]:
+    lines = []
+    for op in ops:
+        if op and isinstance(op[0], int):
+            lines.extend(base[op[0]:op[1]])
+        else:
+            lines.extend(op)
+    return lines
+
+
+class RevisionStore:
+    """
+    文档历史版本（docs/ 中的文件始终是最新版本，读最新版不经过这里）
+    - 每个版本以行级增量存储在追加写的 pack 文件中（zlib 压缩），定期写完整快照
+    - 元数据（版本号、pack 偏移、哈希）在 SQLite 中
+    - pack 追加与版本号分配在跨进程文件锁下进行，API 各 worker 与 scripts/save.py 可同时写入
+    """
+
+    def __init__(self, root: str, cache_entries: int = 64):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self.pack_path = os.path.join(root, "revisions.pack")
+        self.lock_path = os.path.join(root, "revisions.lock")
+        self._lock = threading.RLock()
+        # 各文档最新版本的行列表，计算下一个增量时免去回放
+        self._latest: "OrderedDict[str, tuple]" = OrderedDict()
+        self._cache_entries = cache_entries
+
+        self._db = sqlite3.connect(os.path.join(root, "revisions.db"), check_same_thread=False, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS revisions (
+                filename TEXT NOT NULL,
+                rev INTEGER NOT NULL,
+                kind TEXT NOT NULL,
+                pack_offset INTEGER NOT NULL,
+                pack_length INTEGER NOT NULL,
+                hash TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                line_count INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (filename, rev)
+            )
+        """)
+        self._db.commit()
+
+    # ---- 写入 ----
+
+    def record(self, filename: str, data: bytes) -> Optional[int]:
+        """记录一个新版本，返回版本号；与最新版本内容相同时不记录，返回 None"""
+        digest = content_hash(data)
+        text = _decode(data)
+        lines = text.splitlines(keepends=True)
+
+        with self._exclusive():
+            latest = self._latest_row(filename)
+            if latest is not None and latest["hash"] == digest:
+                return None
+
+            rev = 1 if latest is None else latest["rev"] + 1
+            kind, payload = SNAPSHOT, text
+            if latest is not None and rev - self._last_snapshot_rev(filename, rev) < SNAPSHOT_INTERVAL:
+                base = self._lines(filename, latest["rev"])
+                ops = make_delta(base, lines)
+                encoded = json.dumps(ops, ensure_ascii=False)
+                if len(encoded) <= len(text) * DELTA_MAX_RATIO:
+                    kind, payload = DELTA, encoded
+
+            blob = zlib.compress(_encode(payload), 6)
+            with open(self.pack_path, "ab") as pack:
+                offset = pack.seek(0, os.SEEK_END)
+                pack.write(blob)
+                pack.flush()
+                os.fsync(pack.fileno())
+
+            self._db.execute(
+                "INSERT INTO revisions (filename, rev, kind, pack_offset, pack_length, hash, size, "
+                "line_count, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (filename, rev, kind, offset, len(blob), digest, len(data), len(lines), time.time())
+            )
+            self._db.commit()
+            self._remember(filename, rev, lines)
+            return rev
+
+    def latest_hash(self, filename: str) -> Optional[str]:
+        with self._lock:
+            row = self._latest_row(filename)
+        return row["hash"] if row else None
+
+    # ---- 查询 ----
+
+    def list(self, filename: str) -> List[dict]:
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT {self._COLUMNS} FROM revisions WHERE filename = ? ORDER BY rev DESC", (filename,)
+            ).fetchall()
+        return [self._to_dict(row) for row in rows]
+
+    def get(self, filename: str, rev: Optional[int] = None) -> Optional[dict]:
+        """某个版本的元数据和内容（rev 为 None 时取最新版本）；不存在时返回 None"""
+        with self._lock:
+            row = self._latest_row(filename) if rev is None else self._row(filename, rev)
+            if row is None:
+                return None
+            return {**row, "content": _displayable("".join(self._lines(filename, row["rev"])))}
+
+    def diff(self, filename: str, from_rev: int, to_rev: int, context: int = 3) -> Optional[str]:
+        """两个版本的 unified diff；任一版本不存在时返回 None"""
+        with self._lock:
+            if self._row(filename, from_rev) is None or self._row(filename, to_rev) is None:
+                return None
+            old = self._lines(filename, from_rev)
+            new = self._lines(filename, to_rev)
+        return _displayable("".join(difflib.unified_diff(
+            old, new, fromfile=f"{filename}@{from_rev}", tofile=f"{filename}@{to_rev}", n=context
+        )))
+
+    def stats(self) -> dict:
+        with self._lock:
+            count, logical = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM revisions").fetchone()
+        pack_bytes = os.path.getsize(self.pack_path) if os.path.exists(self.pack_path) else 0
+        return {"revisions": count, "logical_bytes": logical, "pack_bytes": pack_bytes}
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+    # ---- 内部 ----
+
+    _COLUMNS = "filename, rev, kind, pack_offset, pack_length, hash, size, line_count, created_at"
+
+    @staticmethod
+    def _to_dict(row) -> dict:
+        filename, rev, kind, _, _, digest, size, line_count, created_at = row
+        return {"filename": filename, "rev": rev, "kind": kind, "hash": digest,
+                "size": size, "line_count": line_count, "created_at": created_at}
+
+    @contextmanager
+    def _exclusive(self) -> Iterator[None]:
+        """版本号分配 + pack 追加：进程内锁 + 跨进程文件锁"""
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+            with open(self.lock_path, "a") as lock_file:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def _row(self, filename: str, rev: int) -> Optional[dict]:
+        row = self._db.execute(
+            f"SELECT {self._COLUMNS} FROM revisions WHERE filename = ? AND rev = ?", (filename, rev)
+        ).fetchone()
+        return self._to_dict(row) if row else None
+
+    def _latest_row(self, filename: str) -> Optional[dict]:
+        row = self._db.execute(
+            f"SELECT {self._COLUMNS} FROM revisions WHERE filename = ? ORDER BY rev DESC LIMIT 1", (filename,)
+        ).fetchone()
+        return self._to_dict(row) if row else None
+
+    def _last_snapshot_rev(self, filename: str, before: int) -> int:
+        row = self._db.execute(
+            "SELECT MAX(rev) FROM revisions WHERE filename = ? AND rev < ? AND kind = ?",
+            (filename, before, SNAPSHOT)
+        ).fetchone()
+        return row[0] or 0
+
+    def _read_blob(self, offset: int, length: int) -> str:
+        with open(self.pack_path, "rb") as pack:
+            pack.seek(offset)
+            return _decode(zlib.decompress(pack.read(length)))
+
+    def _lines(self, filename: str, rev: int) -> List[str]:
+        """从最近的快照开始回放增量，重建指定版本"""
+        cached = self._latest.get(filename)
+        if cached is not None and cached[0] == rev:
+            return cached[1]
+
+        rows = self._db.execute(
+            "SELECT rev, kind, pack_offset, pack_length FROM revisions "
+            "WHERE filename = ? AND rev <= ? AND rev >= ("
+            "  SELECT MAX(rev) FROM revisions WHERE filename = ? AND rev <= ? AND kind = ?"
+            ") ORDER BY rev",
+            (filename, rev, filename, rev, SNAPSHOT)
+        ).fetchall()
+        lines: List[str] = []
+        for _, kind, offset, length in rows:
+            payload = self._read_blob(offset, length)
+            if kind == SNAPSHOT:
+                lines = payload.splitlines(keepends=True)
+            else:
+                lines = apply_delta(lines, json.loads(payload))
+        return lines
+
+    def _remember(self, filename: str, rev: int, lines: List[str]) -> None:
+        self._latest[filename] = (rev, lines)
+        self._latest.move_to_end(filename)
+        while len(self._latest) > self._cache_entries:
+            self._latest.popitem(last=False)
@@ -0,0 +1,307 @@
+import html
+import os
+import re
+import sqlite3
+import threading
+import unicodedata
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from .doc_layout import DocLayout
+
+# 中日韩字符区间：CJK统一表意文字(含扩展A/兼容)、假名、谚文
+CJK_RANGES = "\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff"
+# 其他文字（拉丁含重音、西里尔、希腊……）按 Unicode 单词字符切分
+TOKEN_RE = re.compile(rf"([^\W{CJK_RANGES}]+)|([{CJK_RANGES}]+)")
+# 切词规则变化时递增：依赖 tokenize 的索引（查重、向量）据此重建
+TOKENIZER_VERSION = 2
+# 全文索引的表结构或切词规则变化时递增，旧索引会被清空重建
+INDEX_VERSION = 2
+
+# 冷启动重建时，超过这个数量的文档才值得开进程池
+PARALLEL_THRESHOLD = 200
+# 批量写入时每这么多篇提交一次
+COMMIT_EVERY = 500
+SNIPPET_RADIUS = 60
+
+
+def _fold(text: str) -> str:
+    """NFKC（全角、连字等兼容字符归一）+ casefold"""
+    return unicodedata.normalize("NFKC", text).casefold()
+
+
+def tokenize(text: str) -> List[str]:
+    """其他文字按单词切分（小写）；CJK连续字符切成重叠二元组，单字保留为一元"""
+    tokens = []
+    for word, cjk in TOKEN_RE.findall(_fold(text)):
+        if word:
+            tokens.append(word)
+        elif len(cjk) == 1:
+            tokens.append(cjk)
+        else:
+            tokens.extend(cjk[i:i + 2] for i in range(len(cjk) - 1))
+    return tokens
+
+
+def tokenize_chars(text: str) -> List[str]:
+    """CJK连续串（两字及以上）中的每个单字，单独建列索引，使单字查询也能命中"""
+    return [char for _, cjk in TOKEN_RE.findall(_fold(text)) if len(cjk) > 1 for char in cjk]
+
+
+IndexRow = Tuple[str, int, int, str, str, str, str, str]
+
+
+def _tokenize_file(args: Tuple[str, str]) -> Optional[IndexRow]:
+    """进程池任务：读取并切分一个文档（参数为 路径, 文件名），返回可直接写入索引的行"""
+    path, filename = args
+    try:
+        stats = os.stat(path)
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            body = f.read()
+    except OSError:
+        return None
+    title = filename[:-len(".md")] if filename.endswith(".md") else filename
+    return (filename, stats.st_size, stats.st_mtime_ns,
+            " ".join(tokenize(title)), " ".join(tokenize(body)),
+            " ".join(tokenize_chars(title)), " ".join(tokenize_chars(body)),
+            # 合并空白后的原文，只用于截取摘要片段
+            " ".join(body.split()))
+
+
+class SearchIndex:
+    """
+    Markdown知识库的全文检索（SQLite FTS5倒排索引 + BM25排序）
+    文本在Python侧预先切分（CJK二元组，另有单字列），FTS5只负责倒排与打分；
+    合并空白后的原文存在 search_text 中，摘要只取命中位置附近的窗口，查询时不读文档文件；
+    save/delete 时增量更新，冷启动时按 mtime/size 对账并并行重建
+    """
+
+    def __init__(self, docs_dir: str, db_path: str):
+        self.docs_dir = docs_dir
+        self.layout = DocLayout(docs_dir)
+        self.db_path = db_path
+        self._lock = threading.RLock()
+
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._db = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        if self._db.execute("PRAGMA user_version").fetchone()[0] != INDEX_VERSION:
+            # 旧版本的表结构/切词结果不可用：清空，由 sync 按新规则重建
+            for table in ("search_docs", "search_fts", "search_text"):
+                self._db.execute(f"DROP TABLE IF EXISTS {table}")
+            self._db.execute(f"PRAGMA user_version = {INDEX_VERSION}")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS search_docs (
+                id INTEGER PRIMARY KEY,
+                filename TEXT UNIQUE NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL
+            )
+        """)
+        self._db.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS search_fts "
+            "USING fts5(title, body, title_chars, body_chars, tokenize='unicode61')"
+        )
+        self._db.execute("CREATE TABLE IF NOT EXISTS search_text (id INTEGER PRIMARY KEY, body TEXT NOT NULL)")
+        self._db.commit()
+
+    # ---- 维护 ----
+
+    def index_document(self, filename: str) -> None:
+        """（重新）索引单个文档，文件已不存在时从索引中删除"""
+        row = _tokenize_file((self.layout.locate(filename), filename))
+        with self._lock:
+            if row is None:
+                self._delete(filename)
+            else:
+                self._write(row)
+            self._db.commit()
+
+    def remove_document(self, filename: str) -> None:
+        with self._lock:
+            self._delete(filename)
+            self._db.commit()
+
+    def apply_changes(self, diff: Dict[str, List[str]]) -> None:
+        """应用 DocIndex.reconcile 返回的差异"""
+        for filename in diff.get("added", []) + diff.get("changed", []):
+            self.index_document(filename)
+        for filename in diff.get("removed", []):
+            self.remove_document(filename)
+
+    def sync(self, workers: Optional[int] = None) -> Dict[str, int]:
+        """
+        与磁盘对账：只重新切分 size/mtime 变化的文档；
+        需要处理的文档较多时（冷启动）用进程池并行切分
+        """
+        on_disk = {}
+        paths = {}
+        for filename, (path, stats) in self.layout.scan().items():
+            on_disk[filename] = (stats.st_size, stats.st_mtime_ns)
+            paths[filename] = path
+
+        with self._lock:
+            indexed = {
+                row[0]: (row[1], row[2])
+                for row in self._db.execute("SELECT filename, size, mtime_ns FROM search_docs")
+            }
+        stale = [name for name, sig in on_disk.items() if indexed.get(name) != sig]
+        removed = [name for name in indexed if name not in on_disk]
+
+        jobs = [(paths[name], name) for name in stale]
+        if len(jobs) >= PARALLEL_THRESHOLD:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                rows = pool.map(_tokenize_file, jobs, chunksize=64)
+                self._write_many(rows)
+        else:
+            self._write_many(map(_tokenize_file, jobs))
+
+        with self._lock:
+            for name in removed:
+                self._delete(name)
+            self._db.commit()
+        return {"indexed": len(stale), "removed": len(removed), "total": len(on_disk)}
+
+    def start_background_sync(self) -> threading.Thread:
+        """在后台线程里完成冷启动对账，不阻塞应用启动"""
+        thread = threading.Thread(target=self.sync, name="search-index-sync", daemon=True)
+        thread.start()
+        return thread
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+    # ---- 查询 ----
+
+    def search(self, query: str, limit: int = 20, offset: int = 0) -> List[dict]:
+        """BM25排序的全文检索，返回带高亮片段的结果"""
+        match = self._build_match(query)
+        if not match:
+            return []
+
+        with self._lock:
+            rows = self._db.execute(
+                """
+                SELECT d.id, d.filename, bm25(search_fts, 5.0, 1.0, 5.0, 1.0) AS score
+                FROM search_fts JOIN search_docs d ON d.id = search_fts.rowid
+                WHERE search_fts MATCH ?
+                ORDER BY score
+                LIMIT ? OFFSET ?
+                """,
+                (match, limit, offset)
+            ).fetchall()
+
+            needles = self._needles(query)
+            results = []
+            for doc_id, filename, score in rows:
+                results.append({
+                    "filename": filename,
+                    "title": filename[:-len(".md")] if filename.endswith(".md") else filename,
+                    # FTS5的bm25越小越相关，对外翻转成越大越好
+                    "score": round(-score, 4),
+                    "snippet": self._snippet(doc_id, needles),
+                })
+        return results
+
+    # ---- 内部 ----
+
+    def _write_many(self, rows: Iterable[Optional[IndexRow]]) -> None:
+        """分批提交：冷启动重建期间其他 worker 的写入不必等整个重建完成"""
+        with self._lock:
+            pending = 0
+            for row in rows:
+                if row is not None:
+                    self._write(row)
+                    pending += 1
+                    if pending >= COMMIT_EVERY:
+                        self._db.commit()
+                        pending = 0
+            self._db.commit()
+
+    def _write(self, row: IndexRow) -> None:
+        filename, size, mtime_ns, title_tokens, body_tokens, title_chars, body_chars, text = row
+        existing = self._db.execute(
+            "SELECT id FROM search_docs WHERE filename = ?", (filename,)
+        ).fetchone()
+        if existing:
+            doc_id = existing[0]
+            self._db.execute(
+                "UPDATE search_docs SET size = ?, mtime_ns = ? WHERE id = ?", (size, mtime_ns, doc_id)
+            )
+            self._db.execute("DELETE FROM search_fts WHERE rowid = ?", (doc_id,))
+        else:
+            doc_id = self._db.execute(
+                "INSERT INTO search_docs (filename, size, mtime_ns) VALUES (?, ?, ?)",
+                (filename, size, mtime_ns)
+            ).lastrowid
+        self._db.execute(
+            "INSERT INTO search_fts (rowid, title, body, title_chars, body_chars) VALUES (?, ?, ?, ?, ?)",
+            (doc_id, title_tokens, body_tokens, title_chars, body_chars)
+        )
+        self._db.execute("INSERT OR REPLACE INTO search_text (id, body) VALUES (?, ?)", (doc_id, text))
+
+    def _delete(self, filename: str) -> None:
+        existing = self._db.execute(
+            "SELECT id FROM search_docs WHERE filename = ?", (filename,)
+        ).fetchone()
+        if existing:
+            self._db.execute("DELETE FROM search_fts WHERE rowid = ?", (existing[0],))
+            self._db.execute("DELETE FROM search_text WHERE id = ?", (existing[0],))
+            self._db.execute("DELETE FROM search_docs WHERE id = ?", (existing[0],))
+
+    @staticmethod
+    def _build_match(query: str) -> str:
+        """
+        查询串 -> FTS5表达式：其他文字各词为项，CJK连续串作为二元组短语，项之间AND
+        CJK单字查询是一个不限列的单字项，同时命中单字列
+        """
+        clauses = []
+        for word, cjk in TOKEN_RE.findall(_fold(query)):
+            if word:
+                clauses.append(f'"{word}"')
+            else:
+                clauses.append('"' + " ".join(tokenize(cjk)) + '"')
+        return " AND ".join(clauses)
+
+    @staticmethod
+    def _needles(query: str) -> List[str]:
+        """摘要里要定位和高亮的原词（不做大小写折叠，定位时再按原样/小写各找一次）"""
+        return [word or cjk for word, cjk in TOKEN_RE.findall(unicodedata.normalize("NFKC", query))]
+
+    def _snippet(self, doc_id: int, needles: List[str]) -> str:
+        """
+        在 search_text 中定位第一个命中，只取出附近的窗口，命中词用<mark>包裹（其余内容做HTML转义）
+        SQLite 的 lower() 只折叠 ASCII 且不改变长度，非ASCII文字再按原样/首字母大写/全大写各找一次
+        """
+        if not needles:
+            return ""
+        probes = []
+        for needle in needles:
+            probes += [needle.lower(), needle, needle.capitalize(), needle.upper()]
+        columns = ", ".join(["instr(lower(body), ?), instr(body, ?), instr(body, ?), instr(body, ?)"] * len(needles))
+        found = self._db.execute(
+            f"SELECT length(body), {columns} FROM search_text WHERE id = ?", (*probes, doc_id)
+        ).fetchone()
+        if found is None:
+            return ""
+        length, positions = found[0], [p for p in found[1:] if p > 0]
+        center = min(positions) if positions else 1
+        start = max(1, center - SNIPPET_RADIUS)
+        window = self._db.execute(
+            "SELECT substr(body, ?, ?) FROM search_text WHERE id = ?",
+            (start, center + SNIPPET_RADIUS - start, doc_id)
+        ).fetchone()[0]
+
+        pattern = re.compile("|".join(re.escape(n) for n in sorted(needles, key=len, reverse=True)),
+                             re.IGNORECASE)
+        parts = []
+        last = 0
+        for m in pattern.finditer(window):
+            parts.append(html.escape(window[last:m.start()]))
+            parts.append(f"<mark>{html.escape(m.group(0))}</mark>")
+            last = m.end()
+        parts.append(html.escape(window[last:]))
+        prefix = "…" if start > 1 else ""
+        suffix = "…" if start + len(window) <= length else ""
+        return prefix + "".join(parts) + suffix
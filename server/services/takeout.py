@@ -0,0 +1,453 @@
+"""
+离线导入对话导出文件（Google Takeout 的 Gemini 活动记录、对话 JSON/JSONL 导出），服务端与 scripts/ 共用
+
+- iter_json_items 增量解析：顶层数组逐个元素 raw_decode，缓冲区只保留当前元素，
+  不会把几个 GB 的导出文件整个 json.load 进内存；也支持 JSONL 和 {"conversations": [...]} 这种外包一层的格式
+- iter_export_items 透明地处理 zip（Takeout 下载包）与 gzip 压缩
+- convert_batch 把原始条目转换成与服务端导入相同布局的 Markdown，在进程池里运行
+- run_import 把两者串起来：流式读取 -> 进程池转换 -> 按批写入
+"""
+import gzip
+import hashlib
+import html
+import io
+import json
+import re
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from html.parser import HTMLParser
+from typing import IO, Callable, Iterable, Iterator, List, Optional, TextIO, Tuple
+
+from .conversation import DEFAULT_TITLE, count_turns, render_turns_document
+
+# 每次从输入读取的字符数；单个元素更大时按需加倍
+READ_SIZE = 1 << 20
+# 每个进程池任务转换的条目数（摊薄进程间传输的开销）
+CONVERT_CHUNK = 64
+# 每批写入 docs/ 的文档数
+WRITE_BATCH = 200
+EXPORT_SUFFIXES = (".json", ".jsonl", ".ndjson", ".json.gz", ".jsonl.gz")
+# 识别 JSONL 时最多预读的字符数：第一个值更大时按单个对象流式解析（压成一行的大对象不会被整体读入）
+JSONL_PROBE_SIZE = 4 << 20
+
+_WS = " \t\n\r"
+_decoder = json.JSONDecoder()
+
+
+# ---- 流式 JSON ----
+
+class _StreamReader:
+    """在文本流上滑动的缓冲区：raw_decode 遇到不完整的元素时读入更多再重试"""
+
+    def __init__(self, stream: TextIO, read_size: int = READ_SIZE):
+        self.stream = stream
+        self.read_size = read_size
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def fill(self, at_least: int = 0) -> bool:
+        if self.eof:
+            return False
+        chunk = self.stream.read(max(self.read_size, at_least))
+        if not chunk:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self) -> Optional[str]:
+        """跳过空白，返回下一个字符（不消费）；输入结束时返回 None"""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in _WS:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.fill():
+                return None
+
+    def expect(self, chars: str) -> str:
+        char = self.peek()
+        if char is None or char not in chars:
+            raise ValueError(f"Malformed export: expected one of {chars!r}, got {char!r}")
+        self.pos += 1
+        return char
+
+    def value(self):
+        """解码下一个完整的JSON值；到达缓冲区末尾的值可能被截断，读入更多后重新解码"""
+        self.peek()
+        while True:
+            try:
+                item, end = _decoder.raw_decode(self.buf, self.pos)
+                if end < len(self.buf) or self.eof:
+                    self.pos = end
+                    return item
+            except json.JSONDecodeError as e:
+                if self.eof:
+                    raise ValueError(f"Malformed export: {e}")
+            # 每次至少读入与当前未完成部分等量的数据，超大元素的重试次数是对数级的
+            self.fill(at_least=len(self.buf) - self.pos)
+
+    def iter_array(self) -> Iterator[object]:
+        """当前位置是 '['：逐个产出数组元素"""
+        self.expect("[")
+        if self.peek() == "]":
+            self.pos += 1
+            return
+        while True:
+            yield self.value()
+            if self.expect(",]") == "]":
+                return
+
+
+# 单个对话对象里承载消息的字段：整体解码，而不是当作条目列表展开
+_CONVERSATION_KEYS = {"turns", "messages", "chunks", "conversation", "chat_messages", "mapping"}
+
+
+def _iter_object_arrays(reader: _StreamReader) -> Iterator[object]:
+    """
+    顶层是（多行的）对象：逐个字段读取
+    数组字段流式展开（如 {"conversations": [...]}）；整个对象本身是一段对话时产出它自己
+    """
+    reader.expect("{")
+    fields = {}
+    if reader.peek() != "}":
+        while True:
+            key = reader.value()
+            reader.expect(":")
+            if reader.peek() == "[" and key not in _CONVERSATION_KEYS:
+                yield from reader.iter_array()
+            else:
+                fields[key] = reader.value()
+            if reader.expect(",}") == "}":
+                break
+    else:
+        reader.pos += 1
+    if normalize_conversation(fields) is not None:
+        yield fields
+
+
+def _expand(item) -> Iterator[object]:
+    """JSONL 的一行：本身是对话，或是外包一层的 {"conversations": [...]}"""
+    if isinstance(item, dict) and normalize_conversation(item) is None:
+        lists = [v for v in item.values() if isinstance(v, list) and v and isinstance(v[0], dict)]
+        if lists:
+            for value in lists:
+                yield from value
+            return
+    yield item
+
+
+def iter_json_items(stream: TextIO, read_size: int = READ_SIZE) -> Iterator[object]:
+    """自动识别 JSON 数组 / JSONL / 外包一层的对象，逐个产出条目"""
+    reader = _StreamReader(stream, read_size)
+    first = reader.peek()
+    if first is None:
+        return
+    if first == "[":
+        yield from reader.iter_array()
+        return
+    if first != "{":
+        raise ValueError("Unsupported export format (expected a JSON array, object or JSONL)")
+
+    if _starts_with_line(reader):
+        # JSONL：每行一个值
+        yield from _expand(reader.value())
+    else:
+        # 多行排版或超大的单个对象：逐个字段流式读取
+        yield from _iter_object_arrays(reader)
+    while reader.peek() is not None:
+        yield from _expand(reader.value())
+
+
+def _starts_with_line(reader: _StreamReader) -> bool:
+    """
+    第一个值是否独占一行（其后是换行或输入结束），即 JSONL
+    最多预读 JSONL_PROBE_SIZE 个字符：值更大时直接返回 False，不会为识别格式把整个文件读进内存
+    """
+    while True:
+        try:
+            _, end = _decoder.raw_decode(reader.buf, reader.pos)
+        except json.JSONDecodeError:
+            end = -1
+        if end != -1:
+            while end < len(reader.buf) and reader.buf[end] in " \t\r":
+                end += 1
+            if end < len(reader.buf):
+                return reader.buf[end] == "\n"
+            if reader.eof:
+                return True
+        elif reader.eof or len(reader.buf) - reader.pos >= JSONL_PROBE_SIZE:
+            return False
+        if not reader.fill(at_least=min(len(reader.buf) - reader.pos, JSONL_PROBE_SIZE)):
+            if end == -1:
+                return False
+
+
+def iter_export_items(fileobj: IO[bytes]) -> Iterator[object]:
+    """
+    从上传的文件或磁盘文件中逐个产出原始条目
+    zip（Takeout 下载包）：依次读取其中的 .json/.jsonl 文件；gzip：透明解压
+    """
+    fileobj.seek(0)
+    if zipfile.is_zipfile(fileobj):
+        fileobj.seek(0)
+        with zipfile.ZipFile(fileobj) as archive:
+            for info in archive.infolist():
+                name = info.filename.lower()
+                if info.is_dir() or not name.endswith(EXPORT_SUFFIXES):
+                    continue
+                with archive.open(info) as member:
+                    yield from _iter_stream(member, gzipped=name.endswith(".gz"))
+        return
+
+    fileobj.seek(0)
+    magic = fileobj.read(2)
+    fileobj.seek(0)
+    yield from _iter_stream(fileobj, gzipped=magic == b"\x1f\x8b")
+
+
+def _iter_stream(raw: IO[bytes], gzipped: bool) -> Iterator[object]:
+    if gzipped:
+        raw = gzip.GzipFile(fileobj=raw)
+    text = io.TextIOWrapper(raw, encoding="utf-8-sig", newline="")
+    try:
+        yield from iter_json_items(text)
+    finally:
+        if not raw.closed:
+            text.detach()  # 不随包装对象一起关闭调用方的文件
+
+
+# ---- 条目 -> 对话 ----
+
+_USER_ROLES = {"user", "human", "prompt", "you"}
+_MODEL_ROLES = {"model", "assistant", "gemini", "bard", "bot", "ai", "response"}
+_PROMPTED_PREFIXES = ("Prompted ", "已提问 ", "提问了 ")
+
+
+class _TextExtractor(HTMLParser):
+    """Takeout 活动记录里的回答是 HTML：取出文本，块级元素换行"""
+
+    BLOCKS = {"p", "div", "br", "li", "ul", "ol", "pre", "h1", "h2", "h3", "h4", "h5", "h6", "tr", "table"}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts: List[str] = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.BLOCKS:
+            self.parts.append("\n")
+        if tag == "li":
+            self.parts.append("- ")
+
+    def handle_endtag(self, tag):
+        if tag in self.BLOCKS and tag != "li":
+            self.parts.append("\n")
+
+    def handle_data(self, data):
+        self.parts.append(data)
+
+
+def html_to_text(markup: str) -> str:
+    parser = _TextExtractor()
+    parser.feed(markup)
+    parser.close()
+    text = "".join(parser.parts)
+    return re.sub(r"\n{3,}", "\n\n", text).strip()
+
+
+def _message_text(message: dict) -> str:
+    for key in ("text", "content", "parts", "message", "body"):
+        value = message.get(key)
+        if value is None:
+            continue
+        if isinstance(value, str):
+            return value
+        if isinstance(value, dict):
+            return _message_text(value)
+        if isinstance(value, list):
+            parts = [p if isinstance(p, str) else _message_text(p) for p in value if isinstance(p, (str, dict))]
+            return "\n\n".join(p for p in parts if p)
+    return ""
+
+
+def _message_role(message: dict) -> Optional[str]:
+    role = message.get("role") or message.get("author") or message.get("sender") or message.get("type")
+    if isinstance(role, dict):
+        role = role.get("role") or role.get("name")
+    role = str(role or "").lower()
+    if role in _USER_ROLES:
+        return "user"
+    if role in _MODEL_ROLES:
+        return "model"
+    return None
+
+
+def _turns_from_messages(messages: list) -> List[dict]:
+    turns: List[dict] = []
+    for message in messages:
+        if isinstance(message, dict) and isinstance(message.get("message"), dict):
+            message = message["message"]  # {"message": {"author": ..., "content": ...}} 形式的节点
+        if not isinstance(message, dict):
+            continue
+        role = _message_role(message)
+        text = _message_text(message).strip()
+        if role is None or not text:
+            continue
+        if role == "user" or not turns or turns[-1]["model"]:
+            turns.append({"user": text if role == "user" else "", "model": text if role == "model" else ""})
+        else:
+            turns[-1]["model"] = text
+    return turns
+
+
+def normalize_conversation(item) -> Optional[dict]:
+    """
+    把一个原始条目识别成 {'id', 'title', 'turns'}；不是对话的条目返回 None
+    支持：
+    - {"title", "turns": [{"user", "model"}]}（本项目 / GeminiService 的解析结果）
+    - {"title", "messages"|"chunks"|"conversation": [{"role", "text"|"content"|"parts"}]}
+    - Takeout「我的活动」里的 Gemini 条目：{"title": "Prompted ...", "safeHtmlItem": [{"html"}], "time"}
+    """
+    if not isinstance(item, dict):
+        return None
+    title = item.get("title") or item.get("name") or ""
+    conv_id = item.get("id") or item.get("conversation_id") or item.get("share_id") or item.get("uuid")
+
+    turns = None
+    if isinstance(item.get("turns"), list):
+        turns = [
+            {"user": str(t.get("user") or ""), "model": str(t.get("model") or "")}
+            for t in item["turns"] if isinstance(t, dict) and (t.get("user") or t.get("model"))
+        ]
+    else:
+        for key in ("messages", "chunks", "conversation", "chat_messages", "mapping"):
+            messages = item.get(key)
+            if isinstance(messages, dict):
+                messages = list(messages.values())
+            if isinstance(messages, list):
+                turns = _turns_from_messages(messages)
+                break
+
+    if turns is None and isinstance(title, str) and title.startswith(_PROMPTED_PREFIXES):
+        # Takeout 活动记录：一条记录是一问一答
+        prompt = title.split(" ", 1)[1].strip()
+        answer = "\n\n".join(html_to_text(h.get("html", "")) for h in item.get("safeHtmlItem") or []
+                             if isinstance(h, dict))
+        turns = [{"user": prompt, "model": answer}] if prompt else []
+        title = prompt[:60]
+        conv_id = conv_id or item.get("time")
+
+    if not turns:
+        return None
+    title = html.unescape(str(title)).strip() or DEFAULT_TITLE
+    if not conv_id:
+        conv_id = hashlib.sha1(json.dumps(turns, ensure_ascii=False).encode("utf-8")).hexdigest()
+    return {"id": str(conv_id), "title": title, "turns": turns}
+
+
+def sanitize_filename(name: str) -> str:
+    keepcharacters = (' ', '.', '_')
+    return "".join(c for c in name if c.isalnum() or c in keepcharacters).rstrip()
+
+
+def document_filename(conv_id: str, title: str) -> str:
+    """与 /api/import/gemini 相同的命名：<id>_<标题前30字>.md"""
+    safe_id = re.sub(r"[^A-Za-z0-9_-]", "", conv_id)[:40] or hashlib.sha1(conv_id.encode()).hexdigest()[:16]
+    safe_title = re.sub(r"\.{2,}", ".", sanitize_filename(title)[:30])
+    return f"{safe_id}_{safe_title}.md"
+
+
+def convert_batch(items: List[object]) -> List[dict]:
+    """
+    进程池任务：识别 + 渲染一批条目
+    返回 [{'filename', 'title', 'turns', 'markdown'}]；不是对话的条目返回 {'invalid': True}
+    """
+    converted = []
+    for item in items:
+        conversation = normalize_conversation(item)
+        if conversation is None:
+            converted.append({"invalid": True})
+            continue
+        turns = conversation["turns"]
+        converted.append({
+            "filename": document_filename(conversation["id"], conversation["title"]),
+            "title": conversation["title"],
+            "turns": turns,
+            "markdown": render_turns_document(conversation["title"], turns, count_turns(turns)),
+        })
+    return converted
+
+
+# ---- 流水线 ----
+
+def write_batch(doc_store, turn_store, docs: List[dict], overwrite: bool) -> Tuple[dict, List[dict]]:
+    """
+    一批转换结果落盘（DocStore.write_many：目录只同步一次），并由解析结果直接生成轮次旁路文件
+    返回 (计数, 实际写入的文档)
+    """
+    results = doc_store.write_many(((doc["filename"], doc["markdown"]) for doc in docs), overwrite=overwrite)
+    saved = []
+    for doc in {doc["filename"]: doc for doc in docs}.values():
+        if results.get(doc["filename"]) is not None:
+            if turn_store is not None:
+                turn_store.write(doc["filename"], doc["title"], doc["turns"])
+            saved.append(doc)
+    counts = {"saved": len(saved), "exists": sum(1 for digest in results.values() if digest is None)}
+    return counts, saved
+
+
+def _chunks(items: Iterable[object], size: int) -> Iterator[List[object]]:
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def run_import(items: Iterable[object], write_batch: Callable[[List[dict]], dict],
+               workers: int = 1, batch_size: int = WRITE_BATCH, mp_context=None) -> dict:
+    """
+    流式读取 -> 转换（workers > 1 时在进程池中）-> 每凑满 batch_size 篇调用一次 write_batch
+    write_batch 返回 {'saved': n, 'exists': n, 'errors': n}；在途任务数有上限，内存占用与导出文件大小无关
+    """
+    counts = {"items": 0, "converted": 0, "invalid": 0, "saved": 0, "exists": 0, "errors": 0}
+    pending: List[dict] = []
+
+    def collect(results: List[dict]) -> None:
+        counts["items"] += len(results)
+        for doc in results:
+            if doc.get("invalid"):
+                counts["invalid"] += 1
+            else:
+                counts["converted"] += 1
+                pending.append(doc)
+        if len(pending) >= batch_size:
+            flush()
+
+    def flush() -> None:
+        if pending:
+            for key, value in write_batch(list(pending)).items():
+                counts[key] = counts.get(key, 0) + value
+            pending.clear()
+
+    if workers <= 1:
+        for chunk in _chunks(items, CONVERT_CHUNK):
+            collect(convert_batch(chunk))
+    else:
+        in_flight = set()
+        with ProcessPoolExecutor(max_workers=workers, mp_context=mp_context) as pool:
+            for chunk in _chunks(items, CONVERT_CHUNK):
+                in_flight.add(pool.submit(convert_batch, chunk))
+                if len(in_flight) >= workers * 2:
+                    done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        collect(future.result())
+            for future in in_flight:
+                collect(future.result())
+    flush()
+    return counts
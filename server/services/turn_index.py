@@ -0,0 +1,128 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from .conversation import AI_HEADING, USER_HEADING, TurnCounter
+from .doc_layout import DocLayout
+from .turn_store import TurnStore
+
+USER_LINE = USER_HEADING.encode("utf-8")
+AI_LINE = AI_HEADING.encode("utf-8")
+
+# 每次流式读取的块大小
+CHUNK_SIZE = 64 * 1024
+
+
+class TurnOffsets:
+    """
+    一篇对话文档的轮次字节偏移
+    turn_starts[i] 是第 i+1 轮（从 User 或无提问的 AI 标题开始）的起始偏移；
+    第一轮之前是标题等前言部分
+    """
+
+    def __init__(self, mtime_ns: int, size: int, turn_starts: List[int]):
+        self.mtime_ns = mtime_ns
+        self.size = size
+        self.turn_starts = turn_starts
+
+    @property
+    def turn_count(self) -> int:
+        return len(self.turn_starts)
+
+    def byte_range(self, first: int, last: int) -> Tuple[int, int]:
+        """
+        第 first..last 轮（1起，含两端）的 [start, end) 字节范围
+        first 为 0 时从文件开头（含前言）开始；last 超出时截到最后一轮
+        """
+        last = min(last, self.turn_count)
+        start = 0 if first == 0 else self.turn_starts[first - 1]
+        end = self.turn_starts[last] if last < self.turn_count else self.size
+        return start, end
+
+
+def scan_turns(path: str) -> List[int]:
+    """逐行扫描（二进制）找出各轮起始偏移；内存占用与文件大小无关"""
+    turn_starts = []
+    counter = TurnCounter()
+    offset = 0
+    with open(path, "rb") as f:
+        for line in f:
+            heading = line.rstrip(b"\r\n")
+            role = "user" if heading == USER_LINE else "model" if heading == AI_LINE else None
+            # 没有提问的AI回复单独成一轮（与 iter_turn_markdown 的输出一致）
+            if role is not None and counter.feed(role) > len(turn_starts):
+                turn_starts.append(offset)
+            offset += len(line)
+    return turn_starts
+
+
+def iter_file_range(path: str, start: int, end: int) -> Iterator[bytes]:
+    """按块读取 [start, end) 字节"""
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            chunk = f.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+class TurnIndex:
+    """
+    对话文档的轮次偏移索引（进程内 LRU）
+    以 mtime/size 校验，文件变化后下次访问时重新扫描；save/delete 时主动失效
+    有 TurnStore 时从旁路文件取各轮起点，不再扫描 Markdown
+    """
+
+    def __init__(self, docs_dir: str, max_entries: int = 512, turn_store: Optional[TurnStore] = None):
+        self.docs_dir = docs_dir
+        self.layout = DocLayout(docs_dir)
+        self.max_entries = max_entries
+        self.turn_store = turn_store
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, TurnOffsets]" = OrderedDict()
+
+    def get(self, filename: str) -> TurnOffsets:
+        """返回文档的轮次偏移；文件不存在时抛出 FileNotFoundError"""
+        path = self.layout.locate(filename)
+        try:
+            stats = os.stat(path)
+        except FileNotFoundError:
+            self.invalidate(filename)
+            raise
+
+        with self._lock:
+            entry = self._entries.get(filename)
+            if entry is not None and (entry.mtime_ns, entry.size) == (stats.st_mtime_ns, stats.st_size):
+                self._entries.move_to_end(filename)
+                return entry
+
+        entry = TurnOffsets(stats.st_mtime_ns, stats.st_size, self._turn_starts(filename, path))
+        with self._lock:
+            self._entries[filename] = entry
+            self._entries.move_to_end(filename)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def _turn_starts(self, filename: str, path: str) -> List[int]:
+        if self.turn_store is None:
+            return scan_turns(path)
+        _, records = self.turn_store.load(filename)
+        starts: List[int] = []
+        for record in records:
+            if record["turn"] > len(starts):
+                starts.append(record["start"])
+        return starts
+
+    def invalidate(self, filename: str) -> None:
+        with self._lock:
+            self._entries.pop(filename, None)
+
+    def apply_changes(self, diff: Dict[str, List[str]]) -> None:
+        """DocIndex 对账回调"""
+        for filename in diff.get("changed", []) + diff.get("removed", []):
+            self.invalidate(filename)
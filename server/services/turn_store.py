@@ -0,0 +1,300 @@
+import json
+import os
+import threading
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from .conversation import (
+    AI_HEADING, USER_HEADING, TurnCounter, document_preamble, iter_message_layout, render_turns
+)
+from .doc_layout import DocLayout
+
+# 旁路文件所在的隐藏目录（与 .locks 一样放在 docs/ 下，不会被当作文档；其下按文档布局分片）
+SIDECAR_DIR_NAME = ".turns"
+# 旁路文件格式有变化时递增，旧文件会被重建
+FORMAT_VERSION = 1
+# 语料统计中轮数分布的区间上界
+TURN_COUNT_BUCKETS = (1, 5, 10, 20, 50, 100)
+
+ROLES = ("user", "model")
+_HEADING_ROLES = {USER_HEADING.encode("utf-8"): "user", AI_HEADING.encode("utf-8"): "model"}
+
+
+def scan_messages(path: str) -> Tuple[str, List[dict]]:
+    """
+    逐行扫描（二进制）一篇对话Markdown，得到标题和每条消息的位置
+    用于没有解析结果可用的文档（手动保存、外部编辑、旧文档）；每个版本只需扫描一次
+    """
+    title = ""
+    records: List[dict] = []
+    counter = TurnCounter()
+    current: Optional[dict] = None
+    # 当前消息最后两行非空内容的 (行内容, 行尾偏移)，用于去掉轮次之间的 --- 分隔线
+    tail: List[Tuple[bytes, int]] = []
+    pending_blank = False
+    offset = 0
+
+    def close():
+        if current is None:
+            return
+        if tail and tail[-1][0] == b"---":
+            tail.pop()
+        end = tail[-1][1] if tail else current["offset"]
+        current["length"] = max(0, end - current["offset"])
+        records.append(current)
+
+    with open(path, "rb") as f:
+        for line in f:
+            stripped = line.rstrip(b"\r\n")
+            role = _HEADING_ROLES.get(stripped)
+            if role is not None:
+                close()
+                current = {"turn": counter.feed(role), "role": role, "start": offset,
+                           "offset": offset + len(line), "length": 0}
+                tail = []
+                pending_blank = True
+            elif current is None:
+                if not title and stripped.startswith(b"# "):
+                    title = stripped[2:].decode("utf-8", "replace").strip()
+            elif pending_blank and not stripped.strip():
+                current["offset"] = offset + len(line)  # 标题后的空行不属于正文
+                pending_blank = False
+            else:
+                pending_blank = False
+                if stripped.strip():
+                    tail = tail[-1:] + [(stripped.strip(), offset + len(stripped))]
+            offset += len(line)
+    close()
+    return title, records
+
+
+def _header(title: str, records: List[dict], source: str, stats: os.stat_result) -> dict:
+    role_bytes = {role: 0 for role in ROLES}
+    for record in records:
+        role_bytes[record["role"]] += record["length"]
+    return {
+        "version": FORMAT_VERSION,
+        "title": title,
+        "turn_count": records[-1]["turn"] if records else 0,
+        "message_count": len(records),
+        "user_bytes": role_bytes["user"],
+        "model_bytes": role_bytes["model"],
+        "source": source,
+        "size": stats.st_size,
+        "mtime_ns": stats.st_mtime_ns,
+    }
+
+
+class TurnStore:
+    """
+    对话文档的结构化轮次数据：每篇 .md 对应一个 JSONL 旁路文件（docs/.turns/[分片目录/]<文件名>.jsonl）
+    - 第一行是汇总（标题、轮数、各角色字节数、对应的 .md 的 size/mtime），其余每行一条消息：
+      {"turn", "role", "start"（标题行偏移）, "offset"（正文偏移）, "length"（正文字节数）}
+    - 导入时由解析结果直接推算偏移；其他文档首次访问时扫描一遍生成
+    - .md 的 size/mtime 与汇总不符时视为过期，自动重建；读取单条消息只读取它的字节范围
+    - 旁路文件与文档使用同一个 DocLayout 分片；切换布局后由 scripts/reshard.py 调用 relocate_all 迁移，
+      迁移期间读取回退查找旧位置
+    """
+
+    def __init__(self, docs_dir: str):
+        self.docs_dir = docs_dir
+        self.layout = DocLayout(docs_dir)
+        self.sidecar_dir = os.path.join(docs_dir, SIDECAR_DIR_NAME)
+        os.makedirs(self.sidecar_dir, exist_ok=True)
+
+    def doc_path(self, filename: str) -> str:
+        return self.layout.locate(filename)
+
+    def sidecar_path(self, filename: str) -> str:
+        """当前布局下旁路文件的路径（写入位置）"""
+        return self.layout.path(filename + ".jsonl", SIDECAR_DIR_NAME)
+
+    def locate_sidecar(self, filename: str) -> str:
+        """旁路文件实际所在的路径（迁移中途可能还在旧位置）"""
+        paths = self.layout.candidates(filename + ".jsonl", SIDECAR_DIR_NAME)
+        if len(paths) > 1:
+            for path in paths:
+                if os.path.isfile(path):
+                    return path
+        return paths[0]
+
+    # ---- 写入 ----
+
+    def write(self, filename: str, title: str, turns: Iterable[dict]) -> Optional[dict]:
+        """
+        由解析结果生成旁路文件（文档须是 render_document(title, render_turns(turns), ...) 的输出）
+        推算结果与磁盘上的文件大小对不上时（例如文档已被改写）退回扫描；文档不存在时返回 None
+        """
+        try:
+            stats = os.stat(self.doc_path(filename))
+        except FileNotFoundError:
+            return None
+        turns = list(turns)
+        records = [
+            {"turn": turn, "role": role, "start": start, "offset": offset, "length": length}
+            for turn, role, start, offset, length in iter_message_layout(turns)
+        ]
+        preamble = len(document_preamble(title, records[-1]["turn"] if records else 0).encode("utf-8"))
+        for record in records:
+            record["start"] += preamble
+            record["offset"] += preamble
+        if preamble + len(render_turns(turns).encode("utf-8")) + 1 != stats.st_size:
+            return self.build(filename)
+        header = _header(title, records, "parsed", stats)
+        self._dump(filename, header, records)
+        return header
+
+    def build(self, filename: str) -> Optional[dict]:
+        """扫描文档生成旁路文件；文档不存在时删除旁路文件并返回 None"""
+        path = self.doc_path(filename)
+        try:
+            stats = os.stat(path)
+            title, records = scan_messages(path)
+        except FileNotFoundError:
+            self.remove(filename)
+            return None
+        # 汇总记录的是扫描前的 stat：扫描期间文件又被改写时，下次访问会再次重建
+        header = _header(title, records, "scan", stats)
+        self._dump(filename, header, records)
+        return header
+
+    def remove(self, filename: str) -> None:
+        for path in self.layout.candidates(filename + ".jsonl", SIDECAR_DIR_NAME):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def relocate_all(self) -> int:
+        """把旁路文件移到当前布局下的位置（scripts/reshard.py 使用），返回移动的个数"""
+        moved = 0
+        for name in self.layout.scan(SIDECAR_DIR_NAME, ".jsonl"):
+            target, *stale = self.layout.candidates(name, SIDECAR_DIR_NAME)
+            for path in stale:
+                try:
+                    if os.path.exists(target):
+                        os.remove(path)  # 新位置上已有（重建过的）版本
+                    else:
+                        os.makedirs(os.path.dirname(target), exist_ok=True)
+                        os.replace(path, target)
+                        moved += 1
+                except FileNotFoundError:
+                    continue
+        self.layout.remove_empty_dirs(SIDECAR_DIR_NAME)
+        return moved
+
+    def apply_changes(self, diff: Dict[str, List[str]]) -> None:
+        """DocIndex 对账回调：删除的文档连同旁路文件一起清理；修改过的在下次访问时重建"""
+        for filename in diff.get("removed", []):
+            self.remove(filename)
+
+    # ---- 读取 ----
+
+    def header(self, filename: str) -> dict:
+        """只读旁路文件第一行（语料统计用）；过期或缺失时重建；文档不存在时抛出 FileNotFoundError"""
+        stats = os.stat(self.doc_path(filename))
+        try:
+            with open(self.locate_sidecar(filename), "r", encoding="utf-8") as f:
+                header = json.loads(f.readline())
+            if self._fresh(header, stats):
+                return header
+        except (FileNotFoundError, ValueError):
+            pass
+        header = self.build(filename)
+        if header is None:
+            raise FileNotFoundError(filename)
+        return header
+
+    def load(self, filename: str) -> Tuple[dict, List[dict]]:
+        """汇总 + 全部消息记录；文档不存在时抛出 FileNotFoundError"""
+        stats = os.stat(self.doc_path(filename))
+        loaded = self._read(filename)
+        if loaded is not None and self._fresh(loaded[0], stats):
+            return loaded
+        if self.build(filename) is None:
+            raise FileNotFoundError(filename)
+        loaded = self._read(filename)
+        if loaded is None:
+            raise FileNotFoundError(filename)
+        return loaded
+
+    def read_texts(self, filename: str, records: List[dict]) -> List[dict]:
+        """按记录的字节范围读取消息正文（只读取需要的部分）"""
+        messages = []
+        with open(self.doc_path(filename), "rb") as f:
+            for record in records:
+                f.seek(record["offset"])
+                text = f.read(record["length"]).decode("utf-8", "replace")
+                messages.append({"turn": record["turn"], "role": record["role"], "text": text})
+        return messages
+
+    def iter_headers(self, filenames: Iterable[str]) -> Iterator[Tuple[str, dict]]:
+        """顺序读取各文档的汇总行（跳过已被删除的文档）"""
+        for filename in filenames:
+            try:
+                yield filename, self.header(filename)
+            except FileNotFoundError:
+                continue
+
+    def stats(self, filenames: Iterable[str]) -> dict:
+        """跨语料的轮次统计：只顺序读取每个旁路文件的汇总行"""
+        totals = {"documents": 0, "turn_count": 0, "message_count": 0, "user_bytes": 0, "model_bytes": 0}
+        distribution = {bound: 0 for bound in TURN_COUNT_BUCKETS}
+        overflow = 0
+        longest = None
+        for filename, header in self.iter_headers(filenames):
+            totals["documents"] += 1
+            for key in ("turn_count", "message_count", "user_bytes", "model_bytes"):
+                totals[key] += header[key]
+            bucket = next((bound for bound in TURN_COUNT_BUCKETS if header["turn_count"] <= bound), None)
+            if bucket is None:
+                overflow += 1
+            else:
+                distribution[bucket] += 1
+            if longest is None or header["turn_count"] > longest["turn_count"]:
+                longest = {"filename": filename, "title": header["title"], "turn_count": header["turn_count"]}
+        documents = totals["documents"]
+        return {
+            **totals,
+            "avg_turns": round(totals["turn_count"] / documents, 2) if documents else 0,
+            "avg_message_bytes": (round((totals["user_bytes"] + totals["model_bytes"]) / totals["message_count"], 1)
+                                  if totals["message_count"] else 0),
+            "turn_count_distribution": {
+                **{f"<={bound}": count for bound, count in distribution.items()},
+                f">{TURN_COUNT_BUCKETS[-1]}": overflow,
+            },
+            "longest": longest,
+        }
+
+    # ---- 内部 ----
+
+    @staticmethod
+    def _fresh(header: dict, stats: os.stat_result) -> bool:
+        return (header.get("version") == FORMAT_VERSION and header.get("size") == stats.st_size
+                and header.get("mtime_ns") == stats.st_mtime_ns)
+
+    def _read(self, filename: str) -> Optional[Tuple[dict, List[dict]]]:
+        try:
+            with open(self.locate_sidecar(filename), "r", encoding="utf-8") as f:
+                header = json.loads(f.readline())
+                records = [json.loads(line) for line in f if line.strip()]
+        except (FileNotFoundError, ValueError):
+            return None
+        return header, records
+
+    def _dump(self, filename: str, header: dict, records: List[dict]) -> None:
+        """写临时文件再原子替换：读者不会看到写了一半的旁路文件（可随时重建，不需要 fsync）"""
+        paths = self.layout.candidates(filename + ".jsonl", SIDECAR_DIR_NAME)
+        path = paths[0]
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(json.dumps(header, ensure_ascii=False, separators=(",", ":")) + "\n")
+            for record in records:
+                f.write(json.dumps(record, separators=(",", ":")) + "\n")
+        os.replace(tmp_path, path)
+        # 旧布局下的副本已经过期
+        for stale in paths[1:]:
+            try:
+                os.remove(stale)
+            except FileNotFoundError:
+                pass
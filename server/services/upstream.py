@@ -0,0 +1,209 @@
+import asyncio
+import math
+import threading
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable, Dict, TypeVar
+
+T = TypeVar("T")
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class UpstreamError(Exception):
+    """没有请求上游就直接拒绝；retry_after 为建议的重试间隔（秒，对应 Retry-After 头）"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+class UpstreamUnavailableError(UpstreamError):
+    """熔断器打开：上游近期持续失败（HTTP 503）"""
+
+
+class UpstreamBusyError(UpstreamError):
+    """等待上游的请求太多：排队已满或排队超时（HTTP 429）"""
+
+
+class CircuitBreaker:
+    """
+    熔断器：连续失败 failure_threshold 次后打开，reset_timeout 秒内的请求直接失败，不再等上游超时
+    - 到时间后进入半开状态，只放行 half_open_max 个探测请求：成功则关闭，失败则重新打开
+    - 调用方负责判断哪些失败计入（record_failure）；被取消、没真正发出的请求调用 abandon 归还探测名额
+    - 线程安全（同步抓取在线程池中调用）
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0, half_open_max: int = 1):
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self.half_open_max = max(1, half_open_max)
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probes = 0
+        self._listeners = []
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == OPEN and self._remaining() <= 0:
+                return HALF_OPEN
+            return self._state
+
+    def add_listener(self, callback: Callable[[str], None]) -> None:
+        """状态变化时回调（新状态），用于指标"""
+        self._listeners.append(callback)
+
+    def acquire(self) -> None:
+        """请求上游之前调用；熔断打开（或半开且探测名额已用完）时抛出 UpstreamUnavailableError"""
+        with self._lock:
+            if self._state == OPEN:
+                remaining = self._remaining()
+                if remaining > 0:
+                    raise UpstreamUnavailableError(
+                        f"Upstream unavailable after {self.failure_threshold} consecutive failures; "
+                        f"retrying in {math.ceil(remaining)}s", remaining)
+                self._transition(HALF_OPEN)
+            if self._state == HALF_OPEN:
+                if self._probes >= self.half_open_max:
+                    raise UpstreamUnavailableError("Upstream is being probed after failures", 1.0)
+                self._probes += 1
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._probes = 0
+            if self._state != CLOSED:
+                self._transition(CLOSED)
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._state == HALF_OPEN or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+                self._probes = 0
+                self._transition(OPEN)
+
+    def abandon(self) -> None:
+        """请求没有得到上游的结论（被取消、在排队时被拒绝）：归还探测名额，不影响计数"""
+        with self._lock:
+            if self._state == HALF_OPEN and self._probes > 0:
+                self._probes -= 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            state = self._state
+            remaining = self._remaining() if state == OPEN else 0.0
+            if state == OPEN and remaining <= 0:
+                state = HALF_OPEN
+            return {"state": state, "failures": self._failures, "retry_after": math.ceil(max(0.0, remaining))}
+
+    def _remaining(self) -> float:
+        return self.reset_timeout - (time.monotonic() - self._opened_at)
+
+    def _transition(self, state: str) -> None:
+        self._state = state
+        for callback in self._listeners:
+            callback(state)
+
+
+class AdmissionQueue:
+    """
+    上游请求的准入控制：最多 max_concurrency 个同时进行，最多 max_waiting 个排队
+    排队已满或等待超过 max_wait 秒时抛出 UpstreamBusyError，请求在这里被拒绝，而不是在服务端无限堆积
+    建议的重试间隔按最近的请求耗时（指数滑动平均）和排队长度估算
+    须在事件循环中创建和使用
+    """
+
+    def __init__(self, max_concurrency: int, max_waiting: int, max_wait: float, initial_latency: float = 1.0):
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_waiting = max(0, max_waiting)
+        self.max_wait = max_wait
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._active = 0
+        self._waiting = 0
+        self._latency = initial_latency
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        if self._active >= self.max_concurrency or self._waiting:
+            if self._waiting >= self.max_waiting:
+                raise UpstreamBusyError(
+                    f"Too many pending upstream requests ({self._waiting} queued)", self.retry_after())
+            self._waiting += 1
+            # 排队的 acquire 由这里持有：超时或被取消时，名额可能恰好已经交给了它，须归还
+            acquire = asyncio.ensure_future(self._semaphore.acquire())
+            try:
+                done, _ = await asyncio.wait({acquire}, timeout=self.max_wait)
+            except BaseException:
+                self._abandon(acquire)
+                raise
+            finally:
+                self._waiting -= 1
+            if not done:
+                self._abandon(acquire)
+                raise UpstreamBusyError(
+                    f"Timed out after {self.max_wait:g}s waiting for an upstream slot", self.retry_after())
+        else:
+            await self._semaphore.acquire()
+
+        self._active += 1
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._active -= 1
+            self._semaphore.release()
+            self._latency = 0.8 * self._latency + 0.2 * (time.perf_counter() - start)
+
+    def _abandon(self, acquire: asyncio.Future) -> None:
+        """放弃排队：acquire 已经（或在取消生效前）拿到名额时立即归还"""
+        def release_if_acquired(task: asyncio.Future) -> None:
+            if not task.cancelled() and task.exception() is None:
+                self._semaphore.release()
+
+        if acquire.done():
+            release_if_acquired(acquire)
+        else:
+            acquire.add_done_callback(release_if_acquired)
+            acquire.cancel()
+
+    def retry_after(self) -> float:
+        return self._latency * (self._waiting + 1) / self.max_concurrency
+
+    def snapshot(self) -> dict:
+        return {"active": self._active, "waiting": self._waiting,
+                "max_concurrency": self.max_concurrency, "max_waiting": self.max_waiting}
+
+
+class InflightRequests:
+    """
+    请求合并：同一个键同时只有一个进行中的请求，后来的调用者等待同一个结果
+    共享的请求是独立的任务，个别调用者取消（客户端断开）不会影响其他人，也不会中断请求本身
+    须在事件循环中使用
+    """
+
+    def __init__(self):
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    def pending(self, key: str) -> bool:
+        return key in self._tasks
+
+    async def run(self, key: str, factory: Callable[[], Awaitable[T]]) -> T:
+        task = self._tasks.get(key)
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            self._tasks[key] = task
+            task.add_done_callback(lambda done, key=key: self._finish(key, done))
+        return await asyncio.shield(task)
+
+    def _finish(self, key: str, task: asyncio.Task) -> None:
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+        # 所有调用者都已离开时也取走异常，避免 "exception was never retrieved" 告警
+        if not task.cancelled():
+            task.exception()
@@ -0,0 +1,391 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import zlib
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from .doc_layout import DocLayout
+from .search_index import TOKENIZER_VERSION, tokenize
+
+try:
+    import fcntl
+except ImportError:  # Windows：只有进程内的锁
+    fcntl = None
+
+DEFAULT_DIM = 512
+INITIAL_CAPACITY = 1024
+
+
+def chunk_markdown(text: str) -> List[Tuple[str, str]]:
+    """按 '## ' 二级标题切块（与 GeminiService._parse_response 生成的结构一致），返回 [(标题, 内容)]"""
+    chunks = []
+    heading = ""
+    lines: List[str] = []
+    for line in text.splitlines():
+        if line.startswith("## "):
+            if "".join(lines).strip():
+                chunks.append((heading, "\n".join(lines).strip()))
+            heading = line[3:].strip()
+            lines = [line]
+        else:
+            lines.append(line)
+    if "".join(lines).strip():
+        chunks.append((heading, "\n".join(lines).strip()))
+    return chunks
+
+
+def embed(texts: List[str], dim: int = DEFAULT_DIM) -> np.ndarray:
+    """
+    离线哈希向量：词/CJK二元组 + 拉丁词内的字符三元组，经 crc32 哈希到 dim 维（带符号），
+    词频取 log 缩放后做 L2 归一化，返回 (len(texts), dim) 的 float32 矩阵
+    """
+    matrix = np.zeros((len(texts), dim), dtype=np.float32)
+    for i, text in enumerate(texts):
+        counts: Dict[int, float] = {}
+        for token in tokenize(text):
+            features = [token]
+            if len(token) > 3 and token.isascii():
+                features.extend(token[j:j + 3] for j in range(len(token) - 2))
+            for feature in features:
+                h = zlib.crc32(feature.encode("utf-8"))
+                slot = h % dim
+                sign = 1.0 if (h >> 31) & 1 else -1.0
+                counts[slot] = counts.get(slot, 0.0) + sign
+        if not counts:
+            continue
+        slots = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+        values = np.fromiter(counts.values(), dtype=np.float32, count=len(counts))
+        matrix[i, slots] = np.sign(values) * np.log1p(np.abs(values))
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    np.divide(matrix, norms, out=matrix, where=norms > 0)
+    return matrix
+
+
+class VectorIndex:
+    """
+    本地向量检索层（RAG的检索部分）
+    - 每个文档按 '## ' 标题切块，块向量存放在内存映射的 float32 矩阵 vectors.f32 中
+    - chunks.db 记录 行号 -> (文件名, 序号, 标题, 内容哈希)，空闲行复用
+    - upsert 时按内容哈希复用未变化块的向量，只对新增/修改的块重新嵌入
+    - 检索是一次矩阵乘法 + argpartition 取 top-k
+    - 多个 worker 共用同一份矩阵文件和 chunks.db：写入在跨进程文件锁下进行并递增 generation，
+      其他进程在下次检索/写入前发现 generation 变化，重新加载行的归属并按需重新映射矩阵
+    """
+
+    def __init__(self, docs_dir: str, root: str, dim: int = DEFAULT_DIM):
+        self.docs_dir = docs_dir
+        self.layout = DocLayout(docs_dir)
+        self.root = root
+        self.dim = dim
+        self._lock = threading.RLock()
+        self._generation: Optional[int] = None
+
+        os.makedirs(root, exist_ok=True)
+        self._db = sqlite3.connect(os.path.join(root, "chunks.db"), check_same_thread=False, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS chunks (
+                row INTEGER PRIMARY KEY,
+                filename TEXT NOT NULL,
+                ordinal INTEGER NOT NULL,
+                heading TEXT NOT NULL,
+                hash TEXT NOT NULL
+            )
+        """)
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_chunks_filename ON chunks(filename)")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS files (
+                filename TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL
+            )
+        """)
+        self._db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self._db.commit()
+
+        with self._lock, self._file_lock():
+            self._db.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('generation', '0')")
+            stored = dict(self._db.execute("SELECT key, value FROM meta WHERE key IN ('dim', 'tokenizer')"))
+            if "dim" in stored and (int(stored["dim"]) != dim
+                                    or int(stored.get("tokenizer", 1)) != TOKENIZER_VERSION):
+                # 维度或切词规则变化后旧向量不可用，清空重建
+                self._db.execute("DELETE FROM chunks")
+                self._db.execute("DELETE FROM files")
+                self._db.execute("UPDATE meta SET value = CAST(value AS INTEGER) + 1 WHERE key = 'generation'")
+                if os.path.exists(self._matrix_path):
+                    os.remove(self._matrix_path)
+            self._db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('dim', ?)", (str(dim),))
+            self._db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('tokenizer', ?)",
+                             (str(TOKENIZER_VERSION),))
+            self._db.commit()
+
+            self._open_matrix()
+            self._load_state()
+            self._generation = self._stored_generation()
+
+    @property
+    def _matrix_path(self) -> str:
+        return os.path.join(self.root, "vectors.f32")
+
+    @property
+    def _lock_path(self) -> str:
+        return os.path.join(self.root, "write.lock")
+
+    # ---- 维护 ----
+
+    def upsert(self, filename: str) -> Dict[str, int]:
+        """重新切块并嵌入文档，内容哈希未变的块直接复用原有向量"""
+        path = self.layout.locate(filename)
+        try:
+            stats = os.stat(path)
+            with open(path, "r", encoding="utf-8", errors="replace") as f:
+                text = f.read()
+        except OSError:
+            self.remove(filename)
+            return {"embedded": 0, "reused": 0}
+
+        chunks = chunk_markdown(text)
+        hashes = [hashlib.sha1(body.encode("utf-8")).hexdigest() for _, body in chunks]
+
+        with self._exclusive():
+            old_rows: Dict[str, List[int]] = {}
+            for row, chunk_hash in self._db.execute(
+                "SELECT row, hash FROM chunks WHERE filename = ?", (filename,)
+            ):
+                old_rows.setdefault(chunk_hash, []).append(row)
+
+            reused = []
+            to_embed = []
+            for ordinal, ((heading, body), chunk_hash) in enumerate(zip(chunks, hashes)):
+                if old_rows.get(chunk_hash):
+                    reused.append((old_rows[chunk_hash].pop(), ordinal, heading, chunk_hash))
+                else:
+                    to_embed.append((ordinal, heading, body, chunk_hash))
+
+            # 不再使用的旧行回收到空闲列表
+            for rows in old_rows.values():
+                for row in rows:
+                    self._release(row)
+
+            for row, ordinal, heading, chunk_hash in reused:
+                self._db.execute(
+                    "UPDATE chunks SET ordinal = ?, heading = ? WHERE row = ?", (ordinal, heading, row)
+                )
+                self._owners[row] = (filename, heading)
+
+            if to_embed:
+                vectors = embed([body for _, _, body, _ in to_embed], self.dim)
+                for (ordinal, heading, _, chunk_hash), vector in zip(to_embed, vectors):
+                    row = self._allocate()
+                    self._matrix[row] = vector
+                    self._owners[row] = (filename, heading)
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO chunks (row, filename, ordinal, heading, hash) VALUES (?, ?, ?, ?, ?)",
+                        (row, filename, ordinal, heading, chunk_hash)
+                    )
+
+            self._matrix.flush()
+            self._db.execute(
+                "INSERT OR REPLACE INTO files (filename, size, mtime_ns) VALUES (?, ?, ?)",
+                (filename, stats.st_size, stats.st_mtime_ns)
+            )
+            self._commit()
+        return {"embedded": len(to_embed), "reused": len(reused)}
+
+    def remove(self, filename: str) -> None:
+        with self._exclusive():
+            rows = [r for (r,) in self._db.execute("SELECT row FROM chunks WHERE filename = ?", (filename,))]
+            for row in rows:
+                self._release(row)
+            self._matrix.flush()
+            self._db.execute("DELETE FROM files WHERE filename = ?", (filename,))
+            self._commit()
+
+    def apply_changes(self, diff: Dict[str, List[str]]) -> None:
+        """应用 DocIndex.reconcile 返回的差异"""
+        for filename in diff.get("added", []) + diff.get("changed", []):
+            self.upsert(filename)
+        for filename in diff.get("removed", []):
+            self.remove(filename)
+
+    def sync(self) -> Dict[str, int]:
+        """与磁盘对账，只处理 size/mtime 变化的文档"""
+        on_disk = {
+            filename: (stats.st_size, stats.st_mtime_ns)
+            for filename, (_, stats) in self.layout.scan().items()
+        }
+        with self._lock:
+            indexed = {
+                row[0]: (row[1], row[2])
+                for row in self._db.execute("SELECT filename, size, mtime_ns FROM files")
+            }
+        stale = [name for name, sig in on_disk.items() if indexed.get(name) != sig]
+        removed = [name for name in indexed if name not in on_disk]
+        for name in stale:
+            self.upsert(name)
+        for name in removed:
+            self.remove(name)
+        return {"updated": len(stale), "removed": len(removed), "total": len(on_disk)}
+
+    def start_background_sync(self) -> threading.Thread:
+        thread = threading.Thread(target=self.sync, name="vector-index-sync", daemon=True)
+        thread.start()
+        return thread
+
+    def close(self) -> None:
+        with self._lock:
+            self._matrix.flush()
+            self._db.close()
+
+    # ---- 检索 ----
+
+    def search(self, queries: List[str], k: int = 10) -> List[List[dict]]:
+        """批量语义检索：一次矩阵乘法得到所有查询对所有块的余弦相似度，各取 top-k 块"""
+        query_vectors = embed(queries, self.dim)
+        with self._lock:
+            self._refresh()
+            n = self._rows_used
+            if n == 0:
+                return [[] for _ in queries]
+            scores = query_vectors @ self._matrix[:n].T
+            owners = self._owners[:n]
+        return [self._top_chunks(row_scores, owners, k) for row_scores in scores]
+
+    def related(self, filename: str, k: int = 10) -> List[dict]:
+        """与指定文档最相近的其他文档：用文档各块向量的均值做查询，按文档聚合最高分"""
+        with self._lock:
+            self._refresh()
+            rows = [r for (r,) in self._db.execute("SELECT row FROM chunks WHERE filename = ?", (filename,))]
+            if not rows:
+                raise KeyError(filename)
+            n = self._rows_used
+            centroid = self._matrix[rows].mean(axis=0)
+            norm = np.linalg.norm(centroid)
+            if norm == 0:
+                return []
+            scores = self._matrix[:n] @ (centroid / norm)
+            owners = self._owners[:n]
+
+        best: Dict[str, Tuple[float, str]] = {}
+        # 只需看得分最高的一批块即可凑出 top-k 文档
+        candidates = min(n, max(k * 20, 200))
+        top = np.argpartition(-scores, candidates - 1)[:candidates]
+        for row in top[np.argsort(-scores[top])]:
+            owner = owners[row]
+            if owner is None or owner[0] == filename:
+                continue
+            score = float(scores[row])
+            if owner[0] not in best:
+                best[owner[0]] = (score, owner[1])
+                if len(best) >= k:
+                    break
+        return [
+            {"filename": name, "score": round(score, 4), "heading": heading}
+            for name, (score, heading) in best.items()
+        ]
+
+    # ---- 内部 ----
+
+    @staticmethod
+    def _top_chunks(scores: np.ndarray, owners: List[Optional[Tuple[str, str]]], k: int) -> List[dict]:
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        results = []
+        for row in top[np.argsort(-scores[top])]:
+            owner = owners[row]
+            if owner is None or scores[row] <= 0:
+                continue
+            results.append({"filename": owner[0], "heading": owner[1], "score": round(float(scores[row]), 4)})
+        return results
+
+    @contextmanager
+    def _exclusive(self) -> Iterator[None]:
+        """写入：进程内锁 + 跨进程文件锁，并先同步其他进程所做的修改"""
+        with self._lock, self._file_lock():
+            self._refresh()
+            yield
+
+    @contextmanager
+    def _file_lock(self) -> Iterator[None]:
+        if fcntl is None:
+            yield
+            return
+        with open(self._lock_path, "a") as lock_file:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def _stored_generation(self) -> int:
+        row = self._db.execute("SELECT value FROM meta WHERE key = 'generation'").fetchone()
+        return int(row[0]) if row else 0
+
+    def _commit(self) -> None:
+        """提交写入并递增 generation（须在 _exclusive 内调用）"""
+        self._generation = (self._generation or 0) + 1
+        self._db.execute("UPDATE meta SET value = ? WHERE key = 'generation'", (str(self._generation),))
+        self._db.commit()
+
+    def _refresh(self) -> None:
+        """其他进程写入过（generation 变化）时重新加载行的归属；矩阵文件变大时重新映射"""
+        generation = self._stored_generation()
+        if generation == self._generation:
+            return
+        if os.path.getsize(self._matrix_path) // (self.dim * 4) != self._capacity:
+            self._matrix.flush()
+            del self._matrix
+            self._open_matrix()
+        self._load_state()
+        self._generation = generation
+
+    def _load_state(self) -> None:
+        # 行号 -> (文件名, 标题)，检索时把块聚合回文档
+        self._owners: List[Optional[Tuple[str, str]]] = [None] * self._capacity
+        for row, filename, heading in self._db.execute("SELECT row, filename, heading FROM chunks"):
+            self._owners[row] = (filename, heading)
+        used = [r for r, owner in enumerate(self._owners) if owner is not None]
+        self._rows_used = (max(used) + 1) if used else 0
+        self._free = [r for r in range(self._rows_used) if self._owners[r] is None]
+
+    def _open_matrix(self) -> None:
+        path = self._matrix_path
+        row_bytes = self.dim * 4
+        if os.path.exists(path) and os.path.getsize(path) >= row_bytes:
+            self._capacity = os.path.getsize(path) // row_bytes
+        else:
+            self._capacity = INITIAL_CAPACITY
+            with open(path, "wb") as f:
+                f.truncate(self._capacity * row_bytes)
+        self._matrix = np.memmap(path, dtype=np.float32, mode="r+", shape=(self._capacity, self.dim))
+
+    def _grow(self) -> None:
+        """容量翻倍：扩展文件后重新映射"""
+        self._matrix.flush()
+        new_capacity = self._capacity * 2
+        del self._matrix
+        with open(self._matrix_path, "r+b") as f:
+            f.truncate(new_capacity * self.dim * 4)
+        self._owners.extend([None] * (new_capacity - self._capacity))
+        self._capacity = new_capacity
+        self._matrix = np.memmap(self._matrix_path, dtype=np.float32, mode="r+",
+                                 shape=(self._capacity, self.dim))
+
+    def _allocate(self) -> int:
+        if self._free:
+            return self._free.pop()
+        if self._rows_used >= self._capacity:
+            self._grow()
+        row = self._rows_used
+        self._rows_used += 1
+        return row
+
+    def _release(self, row: int) -> None:
+        self._matrix[row] = 0.0
+        self._owners[row] = None
+        self._free.append(row)
+        self._db.execute("DELETE FROM chunks WHERE row = ?", (row,))
@@ -18,8 +18,14 @@ fi
 echo "Starting Backend (FastAPI)..."
 cd "$(dirname "$0")"
 
+# 生产模式：INSIGHTPIPE_WORKERS=N ./start.sh 启动 N 个 worker 进程（默认 1，单进程）
+WORKERS=${INSIGHTPIPE_WORKERS:-1}
+GRACEFUL_TIMEOUT=${INSIGHTPIPE_GRACEFUL_SHUTDOWN_TIMEOUT:-30}
+export INSIGHTPIPE_WORKERS=$WORKERS
+
 # 使用追加模式 >> 而不是覆盖模式 >
-nohup python3 -m uvicorn server.main:app --host 0.0.0.0 --port 8817 >> server.log 2>&1 &
+nohup python3 -m uvicorn server.main:app --host 0.0.0.0 --port 8817 \
+    --workers "$WORKERS" --timeout-graceful-shutdown "$GRACEFUL_TIMEOUT" >> server.log 2>&1 &
 BACKEND_PID=$!
 echo $BACKEND_PID > .backend.pid
 
@@ -70,7 +76,7 @@ fi
 
 echo "✅ InsightPipe is running!"
 echo "   - Web UI: http://localhost:5817"
-echo "   - API:    http://localhost:8817"
+echo "   - API:    http://localhost:8817 ($WORKERS worker(s))"
 echo ""
 echo "📝 View logs: tail -f server.log (or web.log)"
 echo "💡 Run './stop.sh' to stop everything."
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# 与 benchmarks/ 一样直接从仓库根目录导入 server 包
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
@@ -0,0 +1,59 @@
+import os
+import sqlite3
+
+from server.services.doc_index import DocIndex
+
+
+def write(docs_dir, name, text="x"):
+    with open(os.path.join(docs_dir, name), "w", encoding="utf-8") as f:
+        f.write(text)
+
+
+def test_count_is_maintained_with_the_rows(tmp_path):
+    docs_dir = str(tmp_path / "docs")
+    os.makedirs(docs_dir)
+    db_path = str(tmp_path / "doc_index.db")
+    for i in range(3):
+        write(docs_dir, f"d{i}.md")
+
+    index = DocIndex(docs_dir, db_path)
+    assert index.count() == 3  # 首次查询触发全量对账
+
+    write(docs_dir, "d3.md")
+    index.upsert("d3.md")
+    index.upsert("d3.md")  # 更新已有记录不改变总数
+    assert index.count() == 4
+
+    os.remove(os.path.join(docs_dir, "d0.md"))
+    index.remove("d0.md")
+    index.remove("d0.md")  # 已经不在索引里
+    assert index.count() == 3
+
+    os.remove(os.path.join(docs_dir, "d1.md"))
+    write(docs_dir, "d4.md")
+    write(docs_dir, "d5.md")
+    index.reconcile()
+    assert index.count() == 4
+    os.remove(os.path.join(docs_dir, "d4.md"))
+    index.reconcile_changed_dirs()
+    assert index.count() == 3 == len(index.list())
+    index.close()
+
+
+def test_count_is_backfilled_for_existing_databases(tmp_path):
+    docs_dir = str(tmp_path / "docs")
+    os.makedirs(docs_dir)
+    db_path = str(tmp_path / "doc_index.db")
+    write(docs_dir, "a.md")
+    write(docs_dir, "b.md")
+    index = DocIndex(docs_dir, db_path)
+    index.reconcile()
+    index.close()
+
+    # 升级前建的库没有 doc_count
+    with sqlite3.connect(db_path) as db:
+        db.execute("DELETE FROM meta WHERE key = 'doc_count'")
+
+    index = DocIndex(docs_dir, db_path)
+    assert index.count() == 2
+    index.close()
@@ -0,0 +1,42 @@
+import asyncio
+import threading
+
+from server.services.import_jobs import SUCCEEDED, ImportJobQueue
+
+
+def test_jobs_touch_the_database_off_the_event_loop(tmp_path):
+    loop_thread = threading.get_ident()
+    update_threads = []
+
+    async def handler(job, report):
+        for i in range(100):
+            report("working", i / 100)
+            await asyncio.sleep(0)
+        return {"ok": True}
+
+    async def main():
+        queue = ImportJobQueue(str(tmp_path / "jobs.db"), handler, workers=1, poll_interval=0.05)
+        update = queue._update
+
+        def tracked_update(job_id, **fields):
+            update_threads.append(threading.get_ident())
+            update(job_id, **fields)
+
+        queue._update = tracked_update
+        await queue.start()
+        job_id = queue.submit("test", [{}])["jobs"][0]["id"]
+        for _ in range(200):
+            job = queue.get(job_id)
+            if job["status"] == SUCCEEDED:
+                break
+            await asyncio.sleep(0.01)
+        await queue.stop()
+        queue.close()
+        return job
+
+    job = asyncio.run(main())
+    assert job["status"] == SUCCEEDED
+    assert (job["stage"], job["progress"], job["result"]) == ("done", 1.0, {"ok": True})
+    assert update_threads and loop_thread not in update_threads
+    # 进度上报被合并：远少于 100 次写库
+    assert len(update_threads) < 50
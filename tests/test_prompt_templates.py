@@ -0,0 +1,24 @@
+import os
+
+import pytest
+
+from server.services.prompt_templates import TemplateEngine
+
+
+@pytest.fixture
+def engine(tmp_path):
+    (tmp_path / "base.txt").write_text("问题：{{QUESTION}}", encoding="utf-8")
+    (tmp_path / "notes").write_text("not a template", encoding="utf-8")
+    os.makedirs(tmp_path / "folder.md")
+    return TemplateEngine(str(tmp_path))
+
+
+def test_renders_template(engine):
+    assert engine.render("base.txt", {"QUESTION": "为什么"}) == "问题：为什么"
+    assert [t["name"] for t in engine.list_templates()] == ["base.txt"]
+
+
+@pytest.mark.parametrize("name", ["", ".", "..", "../base.txt", "notes", "folder.md", "missing.txt"])
+def test_rejects_anything_list_would_not_show(engine, name):
+    with pytest.raises(FileNotFoundError):
+        engine.get(name)
@@ -0,0 +1,65 @@
+import os
+
+import pytest
+
+from server.services.doc_store import DocStore
+from server.services.revisions import RevisionStore
+
+
+def make_store(tmp_path):
+    revisions = RevisionStore(str(tmp_path / "revisions"))
+    return DocStore(str(tmp_path / "docs"), revisions=revisions), revisions
+
+
+def test_non_utf8_document_can_be_overwritten_and_deleted(tmp_path):
+    store, revisions = make_store(tmp_path)
+    store.write("note.md", "# 笔记\n\n第一版\n")
+    # 外部编辑器以 GBK 保存
+    legacy = "# 笔记\n\n第二版\n".encode("gbk")
+    with open(store.locate("note.md"), "wb") as f:
+        f.write(legacy)
+
+    store.write("note.md", "# 笔记\n\n第三版\n")
+    store.delete("note.md")
+
+    history = revisions.list("note.md")
+    assert [r["rev"] for r in history] == [3, 2, 1]
+    assert history[1]["size"] == len(legacy)
+    # 逐字节保存；对外返回时无法解码的字节显示为 U+FFFD
+    assert revisions._lines("note.md", 2) == legacy.decode("utf-8", "surrogateescape").splitlines(keepends=True)
+    assert "�" in revisions.get("note.md", 2)["content"]
+    assert "第三版" in revisions.diff("note.md", 2, 3)
+    assert not os.path.exists(store.locate("note.md"))
+    revisions.close()
+
+
+def test_non_utf8_delta_round_trips(tmp_path):
+    _, revisions = make_store(tmp_path)
+    base = "".join(f"line {i}\n" for i in range(50)).encode("utf-8")
+    edited = base.replace(b"line 7\n", "第七行\n".encode("gbk"))
+    revisions.record("a.md", base)
+    revisions.record("a.md", edited)
+    assert revisions.list("a.md")[0]["kind"] == "delta"
+    # 绕过最新版本缓存，从 pack 文件回放增量
+    revisions._latest.clear()
+    assert "".join(revisions._lines("a.md", 2)).encode("utf-8", "surrogateescape") == edited
+    revisions.close()
+
+
+def test_failed_write_records_no_revision(tmp_path, monkeypatch):
+    store, revisions = make_store(tmp_path)
+    store.write("note.md", "v1\n")
+
+    def fail(*args):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(os, "replace", fail)
+    with pytest.raises(OSError):
+        store.write("note.md", "v2\n")
+    monkeypatch.undo()
+
+    assert [r["rev"] for r in revisions.list("note.md")] == [1]
+    assert store.read("note.md") == "v1\n"
+    store.write("note.md", "v3\n")
+    assert revisions.get("note.md")["content"] == "v3\n"
+    revisions.close()
@@ -0,0 +1,55 @@
+import asyncio
+
+import pytest
+
+from server.services.upstream import AdmissionQueue, UpstreamBusyError
+
+
+def test_waiter_cancelled_at_handoff_does_not_leak_the_slot():
+    async def main():
+        queue = AdmissionQueue(max_concurrency=1, max_waiting=5, max_wait=10)
+        release = asyncio.Event()
+        entered = []
+
+        async def waiter():
+            async with queue.slot():
+                entered.append(True)
+
+        async def holder():
+            async with queue.slot():
+                await release.wait()
+            # 名额刚交给排队者、它还没来得及运行：此时取消它
+            waiting.cancel()
+
+        holding = asyncio.create_task(holder())
+        await asyncio.sleep(0)
+        waiting = asyncio.create_task(waiter())
+        await asyncio.sleep(0)
+        assert queue.snapshot()["waiting"] == 1
+
+        release.set()
+        await holding
+        with pytest.raises(asyncio.CancelledError):
+            await waiting
+        await asyncio.sleep(0)
+
+        assert not entered
+        assert queue.snapshot()["active"] == queue.snapshot()["waiting"] == 0
+        # 名额已归还：下一个请求不用排队
+        await asyncio.wait_for(queue.slot().__aenter__(), 1)
+
+    asyncio.run(main())
+
+
+def test_waiter_timing_out_gives_up_its_place():
+    async def main():
+        queue = AdmissionQueue(max_concurrency=1, max_waiting=5, max_wait=0.01)
+        async with queue.slot():
+            with pytest.raises(UpstreamBusyError):
+                async with queue.slot():
+                    pass
+        assert queue.snapshot()["waiting"] == 0
+        async with queue.slot():
+            assert queue.snapshot()["active"] == 1
+
+    asyncio.run(main())
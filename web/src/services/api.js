@@ -17,15 +17,15 @@ export const api = {
         return res.json();
     },
 
-    saveDocument: async (title, content, overwrite = true) => {
+    saveDocument: async (title, content, overwrite = true, expectedHash = null) => {
         const res = await fetch(`${API_BASE_URL}/docs/save`, {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({ title, content, overwrite })
+            body: JSON.stringify({ title, content, overwrite, expected_hash: expectedHash })
         });
         if (!res.ok) {
             const err = await res.json();
-            throw new Error(err.detail || 'Failed to save document');
+            throw new Error(err.detail?.message || err.detail || 'Failed to save document');
         }
         return res.json();
     },
@@ -36,9 +36,113 @@ export const api = {
         return res.json();
     },
 
+    // Listing plus the change-feed position it corresponds to (for subscribeDocumentEvents)
+    listDocumentsSnapshot: async () => {
+        const res = await fetch(`${API_BASE_URL}/docs`);
+        if (!res.ok) throw new Error('Failed to list documents');
+        return { docs: await res.json(), lastEventId: res.headers.get('X-Last-Event-ID') };
+    },
+
+    subscribeDocumentEvents: (since, { onChange, onReset }) => {
+        const params = since ? `?since=${since}` : '';
+        const source = new EventSource(`${API_BASE_URL}/docs/events${params}`);
+        source.addEventListener('docs', (e) => onChange(JSON.parse(e.data)));
+        source.addEventListener('reset', () => onReset());
+        return source;
+    },
+
     getDocument: async (filename) => {
         const res = await fetch(`${API_BASE_URL}/docs/${filename}`);
         if (!res.ok) throw new Error('Failed to load document');
+        const doc = await res.json();
+        // Content hash of this version, sent back on save to detect concurrent edits
+        doc.hash = (res.headers.get('ETag') || '').replace(/^W\//, '').replace(/"/g, '').replace(/-(br|gzip)$/, '') || null;
+        return doc;
+    },
+
+    getDocumentTurns: async (filename, first, last = '') => {
+        const params = new URLSearchParams({ turns: `${first}-${last}` });
+        const res = await fetch(`${API_BASE_URL}/docs/${encodeURIComponent(filename)}/raw?${params}`);
+        if (!res.ok) throw new Error('Failed to load document turns');
+        return {
+            content: await res.text(),
+            turnCount: Number(res.headers.get('X-Turn-Count')),
+            range: res.headers.get('X-Turn-Range')
+        };
+    },
+
+    listTurns: async (filename, role = null) => {
+        const query = role ? `?role=${role}` : '';
+        const res = await fetch(`${API_BASE_URL}/docs/${encodeURIComponent(filename)}/turns${query}`);
+        if (!res.ok) throw new Error('Failed to load turns');
+        return await res.json();
+    },
+
+    getTurn: async (filename, turn, role = null) => {
+        const query = role ? `?role=${role}` : '';
+        const res = await fetch(`${API_BASE_URL}/docs/${encodeURIComponent(filename)}/turns/${turn}${query}`);
+        if (!res.ok) throw new Error('Failed to load turn');
+        return await res.json();
+    },
+
+    getTurnStats: async () => {
+        const res = await fetch(`${API_BASE_URL}/turns/stats`);
+        if (!res.ok) throw new Error('Failed to load turn stats');
+        return await res.json();
+    },
+
+    batchGetDocuments: async (filenames) => {
+        const res = await fetch(`${API_BASE_URL}/docs/batch-get`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ filenames })
+        });
+        if (!res.ok) throw new Error('Failed to load documents');
+        return res.json();
+    },
+
+    batchSaveDocuments: async (items) => {
+        const res = await fetch(`${API_BASE_URL}/docs/batch-save`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ items })
+        });
+        if (!res.ok) throw new Error('Failed to save documents');
+        return res.json();
+    },
+
+    exportUrl: (format = 'tar') => `${API_BASE_URL}/docs/export?format=${format}`,
+
+    importArchive: async (file, overwrite = false) => {
+        const res = await fetch(`${API_BASE_URL}/docs/import?overwrite=${overwrite}`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/octet-stream' },
+            body: file
+        });
+        if (!res.ok) {
+            const err = await res.json();
+            throw new Error(err.detail || 'Failed to import archive');
+        }
+        return res.json();
+    },
+
+    listRevisions: async (filename) => {
+        const res = await fetch(`${API_BASE_URL}/docs/${encodeURIComponent(filename)}/revisions`);
+        if (!res.ok) throw new Error('Failed to load revisions');
+        return res.json();
+    },
+
+    getRevision: async (filename, rev) => {
+        const res = await fetch(`${API_BASE_URL}/docs/${encodeURIComponent(filename)}/revisions/${rev}`);
+        if (!res.ok) throw new Error('Failed to load revision');
+        return res.json();
+    },
+
+    diffRevisions: async (filename, fromRev, toRev = null) => {
+        const params = new URLSearchParams({ from: fromRev });
+        if (toRev !== null) params.set('to', toRev);
+        const res = await fetch(`${API_BASE_URL}/docs/${encodeURIComponent(filename)}/diff?${params}`);
+        if (!res.ok) throw new Error('Failed to diff revisions');
         return res.json();
     },
 
@@ -50,6 +154,19 @@ export const api = {
         return res.json();
     },
 
+    searchDocuments: async (query, limit = 20) => {
+        const params = new URLSearchParams({ q: query, limit });
+        const res = await fetch(`${API_BASE_URL}/search?${params}`);
+        if (!res.ok) throw new Error('Failed to search documents');
+        return res.json();
+    },
+
+    relatedDocuments: async (filename, k = 10) => {
+        const res = await fetch(`${API_BASE_URL}/related/${encodeURIComponent(filename)}?k=${k}`);
+        if (!res.ok) throw new Error('Failed to load related documents');
+        return res.json();
+    },
+
     importGemini: async (url) => {
         const res = await fetch(`${API_BASE_URL}/import/gemini`, {
             method: 'POST',
@@ -61,5 +178,32 @@ export const api = {
             throw new Error(err.detail || 'Failed to import Gemini conversation');
         }
         return res.json();
+    },
+
+    submitImportJobs: async (urls, options = {}) => {
+        const res = await fetch(`${API_BASE_URL}/import/gemini/jobs`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ urls, ...options })
+        });
+        if (!res.ok) {
+            const err = await res.json();
+            throw new Error(err.detail || 'Failed to submit import jobs');
+        }
+        return res.json();
+    },
+
+    getImportJob: async (jobId) => {
+        const res = await fetch(`${API_BASE_URL}/import/jobs/${jobId}`);
+        if (!res.ok) throw new Error('Failed to load import job');
+        return res.json();
+    },
+
+    waitForImportJob: async (jobId, intervalMs = 500) => {
+        while (true) {
+            const job = await api.getImportJob(jobId);
+            if (job.status === 'succeeded' || job.status === 'failed') return job;
+            await new Promise(resolve => setTimeout(resolve, intervalMs));
+        }
     }
 };